@@ -0,0 +1,558 @@
+"""JSON API поверх DatabaseManager на asyncio (только стандартная библиотека)
+
+HTTP/1.1 с keep-alive; блокирующие запросы SQLite выполняются в пуле
+потоков (--db-workers), хэширование паролей - в пуле PasswordHasher
+(--hash-workers). Токен сессии передается заголовком
+"Authorization: Bearer <токен>".
+
+    POST /api/register               {email, password, nickname, full_name?, group_id?}
+    POST /api/login                  {email, password}
+    POST /api/logout
+    GET  /api/session
+    GET  /api/profile
+    GET  /api/groups/<id>/members    ?cursor=&limit=
+    POST /api/groups/<id>/members    {email}
+    GET  /api/users/search           ?q=&field=&limit=
+    GET  /api/search                 ?q=&kind=&limit=&cursor=
+    GET  /api/reports/<отчет>        ?limit=&days=&max_age=  (администраторы)
+    GET  /api/health
+
+    python api_server.py [--host 127.0.0.1] [--port 8080] [--db-dir databases]
+
+С --processes N (только Unix) родитель применяет миграции, открывает
+слушающий сокет и порождает N процессов-воркеров через fork. У каждого
+воркера свои соединения и кэши; записи, меняющие кэши (роли, группы,
+отзыв сессий), рассылаются остальным через таблицу cache_changes, а
+ограничение частоты по умолчанию хранится в общей БД SQLite.
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import signal
+import socket
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from database_manager import RATE_LIMIT_MESSAGES, STORAGE_MODES, DatabaseManager
+
+MAX_BODY_SIZE = 64 * 1024
+MAX_HEADERS = 100
+
+
+class HttpError(Exception):
+    """Ответ с кодом ошибки и сообщением для клиента"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class ApiServer:
+    """Асинхронный HTTP-сервер JSON API
+
+    db - DatabaseManager; db_workers - размер пула потоков для запросов
+    к SQLite (пул по умолчанию цикла событий). keepalive_timeout - сколько
+    секунд держать простаивающее соединение.
+    """
+
+    def __init__(self, db, host="127.0.0.1", port=8080, db_workers=8,
+                 keepalive_timeout=15.0, cors_origin=None):
+        self.db = db
+        self.host = host
+        self.port = port
+        self.db_workers = db_workers
+        self.keepalive_timeout = keepalive_timeout
+        self.cors_origin = cors_origin
+
+        self._executor = None
+        self._server = None
+        self._writers = set()
+        self._started = time.monotonic()
+        self._stats = {"connections": 0, "requests": 0, "errors": 0}
+        self._routes = [
+            ("POST", re.compile(r"/api/register"), self.handle_register),
+            ("POST", re.compile(r"/api/login"), self.handle_login),
+            ("POST", re.compile(r"/api/logout"), self.handle_logout),
+            ("GET", re.compile(r"/api/session"), self.handle_session),
+            ("GET", re.compile(r"/api/profile"), self.handle_profile),
+            ("GET", re.compile(r"/api/groups/([^/]+)/members"), self.handle_group_members),
+            ("POST", re.compile(r"/api/groups/([^/]+)/members"), self.handle_add_member),
+            ("GET", re.compile(r"/api/users/search"), self.handle_search_users),
+            ("GET", re.compile(r"/api/search"), self.handle_search),
+            ("GET", re.compile(r"/api/reports/(group_sizes|login_activity|active_sessions)"),
+             self.handle_report),
+            ("GET", re.compile(r"/api/health"), self.handle_health),
+        ]
+
+    async def start(self, sock=None):
+        """Запуск сервера на host:port или на готовом слушающем сокете"""
+        loop = asyncio.get_running_loop()
+        self._executor = ThreadPoolExecutor(self.db_workers, thread_name_prefix="api-db")
+        loop.set_default_executor(self._executor)
+        if sock is not None:
+            self._server = await asyncio.start_server(self._serve_connection, sock=sock)
+        else:
+            self._server = await asyncio.start_server(
+                self._serve_connection, self.host, self.port, reuse_address=True)
+        return self._server
+
+    async def serve_forever(self, sock=None):
+        if self._server is None:
+            await self.start(sock)
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            # Простаивающие keep-alive соединения иначе держали бы wait_closed
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    @property
+    def sockets(self):
+        return self._server.sockets if self._server is not None else []
+
+    def stats(self):
+        return dict(self._stats)
+
+    # Протокол
+    async def _read_request(self, reader):
+        """(метод, путь, параметры запроса, заголовки, тело) или None при закрытии"""
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, target, version = line.decode("latin-1").split()
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Некорректная строка запроса")
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            if len(headers) >= MAX_HEADERS:
+                raise HttpError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, "Слишком много заголовков")
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Некорректный Content-Length")
+        if length > MAX_BODY_SIZE:
+            raise HttpError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Слишком большое тело запроса")
+        body = await reader.readexactly(length) if length else b""
+
+        url = urlsplit(target)
+        headers[":version"] = version
+        return method.upper(), unquote(url.path), parse_qs(url.query), headers, body
+
+    def _keep_alive(self, headers):
+        connection = headers.get("connection", "").lower()
+        if headers.get(":version") == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+    async def _serve_connection(self, reader, writer):
+        self._stats["connections"] += 1
+        self._writers.add(writer)
+        peer = writer.get_extra_info("peername")
+        ip_address = peer[0] if isinstance(peer, tuple) else None
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), self.keepalive_timeout)
+                except HttpError as e:
+                    await self._respond(writer, e.status, {"error": e.message}, keep_alive=False)
+                    return
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+                    return
+                if request is None:
+                    return
+
+                method, path, query, headers, body = request
+                keep_alive = self._keep_alive(headers)
+                status, payload = await self._dispatch(method, path, query, headers, body, ip_address)
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    return
+        except (ConnectionError, OSError, asyncio.CancelledError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _dispatch(self, method, path, query, headers, body, ip_address):
+        self._stats["requests"] += 1
+        if method == "OPTIONS":
+            return HTTPStatus.NO_CONTENT, None
+
+        path_matched = False
+        for route_method, pattern, handler in self._routes:
+            match = pattern.fullmatch(path)
+            if not match:
+                continue
+            if route_method != method:
+                path_matched = True
+                continue
+            try:
+                data = json.loads(body) if body else {}
+                if not isinstance(data, dict):
+                    raise HttpError(HTTPStatus.BAD_REQUEST, "Ожидается JSON-объект")
+                request = {
+                    "query": query, "headers": headers, "data": data,
+                    "ip": ip_address, "params": match.groups(),
+                }
+                return await handler(request)
+            except HttpError as e:
+                return e.status, {"error": e.message}
+            except json.JSONDecodeError:
+                return HTTPStatus.BAD_REQUEST, {"error": "Некорректный JSON"}
+            except Exception as e:
+                self._stats["errors"] += 1
+                print(f"API error {method} {path}: {e!r}")
+                return HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "Ошибка сервера"}
+
+        if path_matched:
+            return HTTPStatus.METHOD_NOT_ALLOWED, {"error": "Метод не поддерживается"}
+        return HTTPStatus.NOT_FOUND, {"error": "Не найдено"}
+
+    async def _respond(self, writer, status, payload, keep_alive):
+        body = b"" if payload is None else json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+        head = [
+            f"HTTP/1.1 {status.value} {status.phrase}",
+            "Content-Type: application/json; charset=utf-8",
+            f"Content-Length: {len(body)}",
+            "Connection: " + ("keep-alive" if keep_alive else "close"),
+        ]
+        if keep_alive:
+            head.append(f"Keep-Alive: timeout={int(self.keepalive_timeout)}")
+        if self.cors_origin:
+            head += [
+                f"Access-Control-Allow-Origin: {self.cors_origin}",
+                "Access-Control-Allow-Headers: Authorization, Content-Type",
+                "Access-Control-Allow-Methods: GET, POST, OPTIONS",
+            ]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    # Вспомогательные функции
+    async def _call(self, fn, *args):
+        """Блокирующий вызов DatabaseManager в пуле потоков"""
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    async def _require_session(self, request):
+        """Email владельца действующей сессии из заголовка Authorization"""
+        scheme, _, token = request["headers"].get("authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not token.strip():
+            raise HttpError(HTTPStatus.UNAUTHORIZED, "Требуется авторизация")
+        valid, email = await self._call(self.db.validate_session, token.strip(), request["ip"])
+        if not valid:
+            raise HttpError(HTTPStatus.UNAUTHORIZED, "Сессия недействительна")
+        return email, token.strip()
+
+    @staticmethod
+    def _public_profile(user_info):
+        if user_info is None:
+            return None
+        return {key: value for key, value in user_info.items() if key != "settings_json"}
+
+    @staticmethod
+    def _fields(data, *names):
+        values = []
+        for name in names:
+            value = data.get(name)
+            if value is not None and not isinstance(value, str):
+                raise HttpError(HTTPStatus.BAD_REQUEST, f"Поле {name} должно быть строкой")
+            values.append(value)
+        return values
+
+    # Обработчики
+    async def handle_register(self, request):
+        email, password, nickname, full_name, group_id = self._fields(
+            request["data"], "email", "password", "nickname", "full_name", "group_id")
+        if not email or not password or not nickname:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Обязательные поля: email, password, nickname")
+        success, message = await self.db.register_user_async(
+            email, password, nickname, full_name, group_id, request["ip"])
+        if success:
+            status = HTTPStatus.CREATED
+        elif message == RATE_LIMIT_MESSAGES["register"]:
+            status = HTTPStatus.TOO_MANY_REQUESTS
+        else:
+            status = HTTPStatus.BAD_REQUEST
+        return status, {"ok": success, "message": message}
+
+    async def handle_login(self, request):
+        email, password = self._fields(request["data"], "email", "password")
+        if not email or not password:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Обязательные поля: email, password")
+        success, user_info, token, message = await self.db.authenticate_user_async(
+            email, password, request["ip"])
+        if not success:
+            status = (HTTPStatus.TOO_MANY_REQUESTS if message == RATE_LIMIT_MESSAGES["login"]
+                      else HTTPStatus.UNAUTHORIZED)
+            return status, {"ok": False, "message": message}
+        return HTTPStatus.OK, {
+            "ok": True, "message": message,
+            "session_token": token, "user": self._public_profile(user_info),
+        }
+
+    async def handle_logout(self, request):
+        _, token = await self._require_session(request)
+        revoked = await self._call(self.db.revoke_session, token)
+        return HTTPStatus.OK, {"ok": revoked}
+
+    async def handle_session(self, request):
+        email, _ = await self._require_session(request)
+        return HTTPStatus.OK, {"ok": True, "email": email}
+
+    async def handle_profile(self, request):
+        email, _ = await self._require_session(request)
+        user_info = await self._call(self.db.get_user_info, email)
+        if user_info is None:
+            raise HttpError(HTTPStatus.NOT_FOUND, "Профиль не найден")
+        return HTTPStatus.OK, {"ok": True, "user": self._public_profile(user_info)}
+
+    async def _require_group_access(self, request, group_id, manage=False):
+        """Доступ к группе: администратор, староста группы или (для чтения) участник"""
+        email, _ = await self._require_session(request)
+        roles = (await self._call(self.db.get_roles, [email]))[email]
+        if roles["is_admin"] or group_id in roles["led_groups"]:
+            return email
+        if not manage and group_id in await self._call(self.db.get_user_groups, email):
+            return email
+        raise HttpError(HTTPStatus.FORBIDDEN, "Недостаточно прав")
+
+    async def handle_group_members(self, request):
+        group_id = request["params"][0]
+        await self._require_group_access(request, group_id)
+        query = request["query"]
+        cursor = query.get("cursor", [None])[0]
+        try:
+            limit = int(query.get("limit", ["50"])[0])
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Некорректный limit")
+        page = await self._call(self.db.get_group_members, group_id, cursor, limit)
+        return HTTPStatus.OK, {"ok": True, **page}
+
+    async def handle_add_member(self, request):
+        group_id = request["params"][0]
+        await self._require_group_access(request, group_id, manage=True)
+        (email,) = self._fields(request["data"], "email")
+        if not email:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Обязательное поле: email")
+        email = self.db.sanitize_input(email.lower().strip(), 100)
+        if not await self._call(self.db.query_one, "users.email_exists", (email,)):
+            raise HttpError(HTTPStatus.NOT_FOUND, "Пользователь не найден")
+        added = await self._call(self.db.add_user_to_group, email, group_id)
+        return HTTPStatus.OK, {"ok": added}
+
+    async def handle_search_users(self, request):
+        await self._require_session(request)
+        query = request["query"]
+        prefix = query.get("q", [""])[0]
+        try:
+            limit = min(int(query.get("limit", ["20"])[0]), 100)
+            users = await self._call(self.db.search_users, prefix, query.get("field"), limit)
+        except ValueError as e:
+            raise HttpError(HTTPStatus.BAD_REQUEST, str(e))
+        return HTTPStatus.OK, {"ok": True, "users": users}
+
+    async def handle_search(self, request):
+        await self._require_session(request)
+        query = request["query"]
+        try:
+            page = await self._call(
+                self.db.search, query.get("q", [""])[0], query.get("kind"),
+                int(query.get("limit", ["20"])[0]), query.get("cursor", [None])[0])
+        except ValueError as e:
+            raise HttpError(HTTPStatus.BAD_REQUEST, str(e))
+        return HTTPStatus.OK, {"ok": True, **page}
+
+    async def handle_report(self, request):
+        email, _ = await self._require_session(request)
+        if not (await self._call(self.db.get_roles, [email]))[email]["is_admin"]:
+            raise HttpError(HTTPStatus.FORBIDDEN, "Недостаточно прав")
+        query = request["query"]
+        try:
+            max_age = query.get("max_age", [None])[0]
+            max_age = float(max_age) if max_age is not None else None
+            if request["params"][0] == "login_activity":
+                args = (int(query.get("days", ["7"])[0]),)
+            else:
+                args = (min(int(query.get("limit", ["50"])[0]), 1000),)
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Некорректные параметры отчета")
+        report = getattr(self.db, f"report_{request['params'][0]}")
+        return HTTPStatus.OK, {"ok": True, **await self._call(report, *args, max_age)}
+
+    async def handle_health(self, request):
+        return HTTPStatus.OK, {
+            "ok": True,
+            "pid": os.getpid(),
+            "uptime_s": round(time.monotonic() - self._started, 1),
+            **self.stats(),
+        }
+
+
+def parse_rate_limit(value):
+    """Разбор --rate-limit: "действие=запросов/минут" -> (действие, (запросов, минут))"""
+    match = re.fullmatch(r"(\w+)=(\d+)/(\d+)", value)
+    if not match:
+        raise argparse.ArgumentTypeError(f"ожидается действие=запросов/минут: {value}")
+    return match.group(1), (int(match.group(2)), int(match.group(3)))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--db-dir", default="databases")
+    parser.add_argument("--storage", default="split", choices=STORAGE_MODES)
+    parser.add_argument("--db-workers", type=int, default=8, help="потоков для запросов к SQLite")
+    parser.add_argument("--hash-workers", type=int, default=None,
+                        help="потоков хэширования паролей (по умолчанию - число CPU)")
+    parser.add_argument("--rate-limiter", default=None, choices=("memory", "sqlite", "none"),
+                        help="ограничение частоты входа и регистрации с одного IP "
+                             "(по умолчанию memory, при --processes > 1 - sqlite)")
+    parser.add_argument("--rate-limit", action="append", type=parse_rate_limit, default=[],
+                        metavar="ACTION=N/MIN",
+                        help="лимит действия с одного IP, например login=200/15 "
+                             "для пользователей за общим NAT (можно повторять)")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="число процессов-воркеров на общем сокете (fork, только Unix)")
+    parser.add_argument("--keepalive-timeout", type=float, default=15.0)
+    parser.add_argument("--cors-origin", default=None, help="значение Access-Control-Allow-Origin")
+    return parser
+
+
+def create_manager(args):
+    # Счетчики в памяти у каждого процесса свои, поэтому для нескольких
+    # воркеров лимиты по умолчанию хранятся в общей БД
+    rate_limiter = args.rate_limiter or ("sqlite" if args.processes > 1 else "memory")
+    return DatabaseManager(
+        args.db_dir,
+        pool_size=args.db_workers,
+        storage=args.storage,
+        password_hasher={"max_workers": args.hash_workers},
+        rate_limiter=None if rate_limiter == "none" else rate_limiter,
+        rate_limits=dict(args.rate_limit),
+        invalidation="sqlite" if args.processes > 1 else None,
+    )
+
+
+async def serve(args, sock=None, announce=True):
+    db = create_manager(args)
+    server = ApiServer(db, args.host, args.port, args.db_workers,
+                       args.keepalive_timeout, args.cors_origin)
+    await server.start(sock)
+    if announce:
+        for listener in server.sockets:
+            print(f"API: http://{listener.getsockname()[0]}:{listener.getsockname()[1]}", flush=True)
+
+    # SIGTERM завершает сервер штатно: соединения закрываются, журнал дописывается
+    serving = asyncio.ensure_future(server.serve_forever())
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, serving.cancel)
+    try:
+        await serving
+    except asyncio.CancelledError:
+        pass
+    finally:
+        await server.close()
+        db.close()
+
+
+def _run_worker(args, sock):
+    """Тело процесса-воркера; не возвращается"""
+    # Обработчики родителя наследуются при повторном запуске воркера
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    code = 0
+    try:
+        asyncio.run(serve(args, sock, announce=False))
+    except KeyboardInterrupt:
+        pass
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+
+def serve_prefork(args):
+    """Pre-fork: общий слушающий сокет и args.processes воркеров"""
+    # Миграции до fork, чтобы воркеры не применяли их одновременно
+    db = DatabaseManager(args.db_dir, storage=args.storage, rate_limiter=None)
+    db.init_databases()
+    db.close()
+
+    sock = socket.create_server((args.host, args.port), backlog=1024)
+    host, port = sock.getsockname()[:2]
+    print(f"API: http://{host}:{port}", flush=True)
+    print(f"Workers: {args.processes}", file=sys.stderr)
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            _run_worker(args, sock)
+        return pid
+
+    workers = {spawn() for _ in range(args.processes)}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        while workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            workers.discard(pid)
+            # Упавший воркер заменяется новым, пока сервер не останавливают
+            if not stopping:
+                print(f"Worker {pid} exited with status {status}, restarting", file=sys.stderr)
+                workers.add(spawn())
+    finally:
+        sock.close()
+
+
+def main():
+    args = build_parser().parse_args()
+    if args.processes > 1:
+        if not hasattr(os, "fork"):
+            sys.exit("--processes требует os.fork (Unix)")
+        serve_prefork(args)
+        return
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""Бенчмарк горячих путей DatabaseManager
+
+Каждый прогон создает временный каталог БД, заполняет его указанным числом
+пользователей и замеряет операции при заданной степени параллелизма.
+Результат (p50/p95/p99 задержки и пропускная способность) печатается
+в формате JSON, чтобы сравнивать коммиты между собой:
+
+    python benchmarks/bench_database_manager.py --users 1000,100000 \\
+        --concurrency 1,4 --output bench.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import secrets
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from database_manager import DatabaseManager  # noqa: E402
+
+PASSWORD = "Benchmark1"
+
+# Операция -> число вызовов по умолчанию (PBKDF2 дорогой, поэтому вызовов меньше)
+OPERATIONS = {
+    "register_user": 50,
+    "authenticate_success": 50,
+    "authenticate_failure": 50,
+    "validate_session": 5000,
+    "get_user_info": 5000,
+    "add_user_to_group": 2000,
+    "sanitize_input": 20000,
+}
+
+# Отдельные пользователи для authenticate_failure: пять ошибок подряд
+# блокируют аккаунт на 15 минут, и на общих пользователях
+# authenticate_success мерил бы ветку блокировки вместо PBKDF2. Перед
+# каждым замером блокировки сбрасываются, адреса перебираются по кругу,
+# так что до 4000 вызовов за замер ни один не блокируется
+FAILURE_USERS = 1000
+
+SANITIZE_SAMPLES = [
+    "student@uniportal.ru", "ИванСтудент", "Анна Петрова", "IT-101",
+    "<script>alert(1)</script>", "' OR 1=1; --",
+]
+
+
+def seed(db, users, batch_size=20000):
+    """Быстрое заполнение через import_users: один готовый хэш пароля на всех"""
+    password_hash, salt = db.make_password_hash(PASSWORD)
+
+    def rows():
+        for i in range(users):
+            yield {"email": f"user{i}@bench.ru", "password_hash": password_hash, "salt": salt,
+                   "nickname": f"user{i}", "full_name": f"Пользователь {i}", "group_id": f"G{i % 100}"}
+        for i in range(FAILURE_USERS):
+            yield {"email": f"fail{i}@bench.ru", "password_hash": password_hash, "salt": salt,
+                   "nickname": f"fail{i}"}
+
+    report = db.import_users(rows(), batch_size=batch_size)
+    if report["failed"]:
+        raise RuntimeError(f"Заполнение не удалось: {report['errors'][:5]}")
+
+
+def reset_lockouts(db):
+    """Сброс счетчиков ошибок входа у пользователей authenticate_failure"""
+    with db.connection("users_quick.db") as conn:
+        with conn:
+            conn.execute('''
+                UPDATE users_quick SET failed_attempts = 0, locked_until = NULL
+                WHERE email LIKE 'fail%@bench.ru'
+            ''')
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def make_operation(name, db, users, rng_seed, threads=1):
+    """Функция одного вызова операции с собственным генератором случайных чисел
+
+    rng_seed - номер потока из threads; по нему потоки делят адреса
+    authenticate_failure, не пересекаясь.
+    """
+    rng = random.Random(rng_seed)
+    counter = iter(range(10 ** 9))
+
+    def random_email():
+        return f"user{rng.randrange(users)}@bench.ru"
+
+    if name == "register_user":
+        # Уникальный префикс: повторные прогоны не должны упираться в дубликаты
+        prefix = f"new{secrets.token_hex(4)}"
+
+        def op():
+            n = next(counter)
+            db.register_user(f"{prefix}_{n}@bench.ru", PASSWORD, f"{prefix}_{n}", None, None)
+    elif name == "authenticate_success":
+        def op():
+            db.authenticate_user(random_email(), PASSWORD)
+    elif name == "authenticate_failure":
+        def op():
+            n = next(counter) * threads + rng_seed
+            db.authenticate_user(f"fail{n % FAILURE_USERS}@bench.ru", "Wrong" + PASSWORD)
+    elif name == "validate_session":
+        tokens = []
+        for _ in range(200):
+            token = db.generate_session_token()
+            db.save_session(random_email(), token, "127.0.0.1")
+            tokens.append(token)
+
+        def op():
+            db.validate_session(rng.choice(tokens), "127.0.0.1")
+    elif name == "get_user_info":
+        def op():
+            db.get_user_info(random_email())
+    elif name == "add_user_to_group":
+        def op():
+            db.add_user_to_group(random_email(), f"G{rng.randrange(1000)}")
+    elif name == "sanitize_input":
+        def op():
+            db.sanitize_input(rng.choice(SANITIZE_SAMPLES))
+    else:
+        raise ValueError(f"Неизвестная операция: {name}")
+    return op
+
+
+def run_operation(db, name, users, calls, concurrency):
+    """Замер calls вызовов операции в concurrency потоках"""
+    per_thread = max(1, calls // concurrency)
+    if name == "authenticate_failure":
+        reset_lockouts(db)
+    ops = [make_operation(name, db, users, seed_, concurrency) for seed_ in range(concurrency)]
+    latencies = [[] for _ in range(concurrency)]
+    barrier = threading.Barrier(concurrency + 1)
+
+    def worker(index):
+        op = ops[index]
+        out = latencies[index]
+        barrier.wait()
+        for _ in range(per_thread):
+            started = time.perf_counter()
+            op()
+            out.append(time.perf_counter() - started)
+        db.release_connections()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    values = sorted(value for chunk in latencies for value in chunk)
+    return {
+        "calls": len(values),
+        "elapsed_s": round(elapsed, 4),
+        "throughput_ops": round(len(values) / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": round(sum(values) / len(values) * 1000, 4) if values else 0.0,
+        "p50_ms": round(percentile(values, 0.50) * 1000, 4),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 4),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 4),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_list(value, cast=str):
+    return [cast(item) for item in value.split(",") if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", default="1000", help="масштабы через запятую: 1000,100000,1000000")
+    parser.add_argument("--concurrency", default="1,4", help="числа потоков через запятую")
+    parser.add_argument("--ops", default=",".join(OPERATIONS), help="операции через запятую")
+    parser.add_argument("--calls-factor", type=float, default=1.0,
+                        help="множитель числа вызовов каждой операции")
+    parser.add_argument("--pool-size", type=int, default=8)
+    parser.add_argument("--keep", action="store_true", help="не удалять временные каталоги")
+    parser.add_argument("--output", help="файл для JSON-результата (иначе stdout)")
+    args = parser.parse_args()
+
+    operations = parse_list(args.ops)
+    unknown = set(operations) - set(OPERATIONS)
+    if unknown:
+        parser.error(f"неизвестные операции: {', '.join(sorted(unknown))}")
+
+    result = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "cpu_count": os.cpu_count(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "runs": [],
+    }
+
+    for users in parse_list(args.users, int):
+        db_dir = tempfile.mkdtemp(prefix=f"uniportal-bench-{users}-")
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                db = DatabaseManager(db_dir, pool_size=args.pool_size)
+            started = time.perf_counter()
+            seed(db, users)
+            seed_time = time.perf_counter() - started
+
+            for concurrency in parse_list(args.concurrency, int):
+                for name in operations:
+                    calls = max(concurrency, int(OPERATIONS[name] * args.calls_factor))
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        stats = run_operation(db, name, users, calls, concurrency)
+                    stats.update({"operation": name, "users": users, "concurrency": concurrency})
+                    result["runs"].append(stats)
+                    print(f"{users:>8} users  x{concurrency:<3} {name:<22} "
+                          f"p50={stats['p50_ms']:.3f}ms p99={stats['p99_ms']:.3f}ms "
+                          f"{stats['throughput_ops']:.0f} ops/s", file=sys.stderr)
+
+            result.setdefault("seed_s", {})[str(users)] = round(seed_time, 2)
+            result.setdefault("statements", {})[str(users)] = db.statement_stats()
+            db.close()
+        finally:
+            if not args.keep:
+                shutil.rmtree(db_dir, ignore_errors=True)
+
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""Микробенчмарк DatabaseManager.sanitize_input
+
+Сравнивает время с прежней реализацией на обычных и вредоносных строках.
+Эталон и наборы строк - в tests/test_sanitize.py, совпадение результатов
+проверяет этот тест.
+
+    python benchmarks/bench_sanitize.py [--number 20000]
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from database_manager import DatabaseManager  # noqa: E402
+from tests.test_sanitize import MALICIOUS, TYPICAL, reference_sanitize_input  # noqa: E402
+
+
+def bench(number):
+    results = {}
+    for name, corpus in (("typical", TYPICAL), ("malicious", MALICIOUS)):
+        for label, fn in (("reference", reference_sanitize_input),
+                          ("current", DatabaseManager.sanitize_input)):
+            seconds = min(timeit.repeat(lambda: [fn(value) for value in corpus],
+                                        number=number // len(corpus), repeat=3))
+            calls = (number // len(corpus)) * len(corpus)
+            results[f"{name}.{label}_us"] = round(seconds / calls * 1e6, 3)
+        results[f"{name}.speedup"] = round(
+            results[f"{name}.reference_us"] / results[f"{name}.current_us"], 2)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=20000, help="вызовов на замер")
+    args = parser.parse_args()
+
+    print(json.dumps(bench(args.number), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
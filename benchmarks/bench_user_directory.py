@@ -0,0 +1,84 @@
+"""Память и скорость UserDirectory на синтетических пользователях
+
+Строит справочник из --users записей с кириллическими никнеймами и
+именами (как в users_full), печатает JSON с байтами на пользователя
+(tracemalloc), временем загрузки, вставки и поиска по префиксу и
+сравнивает их с UserDirectory.BYTES_PER_USER_BUDGET:
+
+    python benchmarks/bench_user_directory.py --users 100000,1000000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from database_manager import UserDirectory  # noqa: E402
+
+FIRST_NAMES = ["Иван", "Анна", "Пётр", "Мария", "Алексей", "Елена", "Дмитрий", "Ольга", "Сергей", "Наталья"]
+LAST_NAMES = ["Иванов", "Петрова", "Сидоров", "Смирнова", "Кузнецов", "Попова", "Волков", "Ёлкина"]
+
+
+def make_rows(users, seed=0):
+    rng = random.Random(seed)
+    for i in range(users):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        yield f"user{i}@uniportal.ru", f"{first}{last}{i}", f"{first} {last}"
+
+
+def measure(users, searches):
+    # Память и время загрузки - в разных прогонах: tracemalloc замедляет выделения
+    tracemalloc.start()
+    directory = UserDirectory()
+    directory.load(make_rows(users), directory.generation)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del directory
+
+    directory = UserDirectory()
+    started = time.perf_counter()
+    directory.load(make_rows(users), directory.generation)
+    load_time = time.perf_counter() - started
+
+    rng = random.Random(1)
+    prefixes = [rng.choice(FIRST_NAMES)[:rng.randint(1, 4)].lower() for _ in range(searches)]
+    started = time.perf_counter()
+    for prefix in prefixes:
+        directory.search(prefix, limit=20)
+    search_time = time.perf_counter() - started
+
+    inserts = 1000
+    started = time.perf_counter()
+    for email, nickname, full_name in make_rows(inserts, seed=2):
+        directory.put("new" + email, "Новый" + nickname, full_name)
+    insert_time = time.perf_counter() - started
+
+    bytes_per_user = memory / users
+    return {
+        "users": users,
+        "bytes_per_user": round(bytes_per_user, 1),
+        "budget_bytes_per_user": UserDirectory.BYTES_PER_USER_BUDGET,
+        "within_budget": bytes_per_user <= UserDirectory.BYTES_PER_USER_BUDGET,
+        "load_s": round(load_time, 2),
+        "search_us": round(search_time / searches * 1e6, 1),
+        "insert_us": round(insert_time / inserts * 1e6, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", default="100000", help="масштабы через запятую")
+    parser.add_argument("--searches", type=int, default=10000)
+    args = parser.parse_args()
+
+    results = [measure(int(users), args.searches) for users in args.users.split(",") if users.strip()]
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    return 0 if all(result["within_budget"] for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,49 @@
+"""Подбор стоимости хэша паролей под целевую задержку на этой машине
+
+Для каждой схемы печатает стоимость, при которой одно хэширование
+занимает около --target-ms, и оценку пропускной способности входа при
+заданном числе воркеров пула хэширования. Найденные значения передаются
+в DatabaseManager(password_scheme=..., password_cost=...); хэши
+существующих пользователей пересчитаются при их следующем входе.
+
+    python benchmarks/calibrate_password_hash.py [--target-ms 100] [--scheme scrypt]
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from database_manager import PASSWORD_SCHEMES, calibrate_password_cost  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target-ms", type=float, default=100.0,
+                        help="целевое время одного хэширования, мс")
+    parser.add_argument("--scheme", action="append", choices=sorted(PASSWORD_SCHEMES),
+                        help="схема (можно несколько; по умолчанию все)")
+    parser.add_argument("--samples", type=int, default=3, help="замеров на каждую стоимость")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="воркеров пула хэширования для оценки входов в секунду")
+    args = parser.parse_args()
+
+    results = []
+    for scheme in args.scheme or sorted(PASSWORD_SCHEMES):
+        try:
+            result = calibrate_password_cost(scheme, args.target_ms / 1000, args.samples)
+        except ValueError as e:
+            results.append({"scheme": scheme, "error": str(e)})
+            continue
+        result["ms"] = round(result.pop("seconds") * 1000, 2)
+        result["logins_per_sec"] = round(args.workers * 1000 / result["ms"], 1)
+        results.append(result)
+
+    print(json.dumps({"target_ms": args.target_ms, "workers": args.workers, "results": results},
+                     indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
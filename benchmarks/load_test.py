@@ -0,0 +1,230 @@
+"""Нагрузочный клиент для api_server.py
+
+Открывает --connections keep-alive соединений, регистрирует --users
+пользователей, входит ими и в течение --duration секунд выполняет смесь
+запросов (проверка сессии, профиль, список группы, вход). Печатает JSON
+с числом запросов, ошибками и p50/p95/p99 по каждому виду запроса.
+
+С --spawn сервер запускается во временном каталоге БД без ограничения
+частоты запросов (все запросы идут с одного IP):
+
+    python benchmarks/load_test.py --spawn --connections 32 --duration 10
+    python benchmarks/load_test.py --spawn --server-arg=--processes=4
+    python benchmarks/load_test.py --port 8080 --users 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+PASSWORD = "LoadTest123"
+
+# Вид запроса -> вес в смеси
+MIX = {
+    "session": 40,
+    "profile": 40,
+    "members": 15,
+    "login": 5,
+}
+
+
+class Client:
+    """Одно keep-alive соединение с сервером"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, data=None, token=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        body = json.dumps(data).encode("utf-8") if data is not None else b""
+        head = [f"{method} {path} HTTP/1.1", f"Host: {self.host}", f"Content-Length: {len(body)}"]
+        if token:
+            head.append(f"Authorization: Bearer {token}")
+        self.writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("Сервер закрыл соединение")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        payload = await self.reader.readexactly(int(headers.get("content-length", 0)))
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return status, json.loads(payload) if payload else None
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def prepare_users(args, clients):
+    """Регистрация и вход пользователей, возвращает [(email, группа, токен)]"""
+    prefix = f"load{random.randrange(10 ** 6)}"
+    users = [(f"{prefix}_{i}@load.ru", f"LOAD-{i % 10}", f"{prefix}_{i}") for i in range(args.users)]
+    sessions = []
+
+    async def worker(client, chunk):
+        for email, group_id, nickname in chunk:
+            status, payload = await client.request("POST", "/api/register", {
+                "email": email, "password": PASSWORD, "nickname": nickname, "group_id": group_id,
+            })
+            if status != 201:
+                raise RuntimeError(f"Регистрация {email}: {status} {payload}")
+            status, payload = await client.request(
+                "POST", "/api/login", {"email": email, "password": PASSWORD})
+            if status != 200:
+                raise RuntimeError(f"Вход {email}: {status} {payload}")
+            sessions.append((email, group_id, payload["session_token"]))
+
+    await asyncio.gather(*(
+        worker(client, users[index::len(clients)]) for index, client in enumerate(clients)
+    ))
+    return sessions
+
+
+async def run_load(args, clients, sessions):
+    latencies = {name: [] for name in MIX}
+    errors = {name: 0 for name in MIX}
+    names = list(MIX)
+    weights = [MIX[name] for name in names]
+    deadline = time.perf_counter() + args.duration
+
+    async def worker(client):
+        rng = random.Random()
+        while time.perf_counter() < deadline:
+            email, group_id, token = rng.choice(sessions)
+            name = rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                if name == "session":
+                    status, _ = await client.request("GET", "/api/session", token=token)
+                elif name == "profile":
+                    status, _ = await client.request("GET", "/api/profile", token=token)
+                elif name == "members":
+                    status, _ = await client.request(
+                        "GET", f"/api/groups/{group_id}/members?limit=20", token=token)
+                else:
+                    status, _ = await client.request(
+                        "POST", "/api/login", {"email": email, "password": PASSWORD})
+            except (ConnectionError, OSError, asyncio.IncompleteReadError):
+                client.close()
+                status = 0
+            latencies[name].append(time.perf_counter() - started)
+            if status != 200:
+                errors[name] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(client) for client in clients))
+    elapsed = time.perf_counter() - started
+
+    total = sum(len(values) for values in latencies.values())
+    result = {
+        "connections": len(clients),
+        "duration_s": round(elapsed, 2),
+        "requests": total,
+        "throughput_rps": round(total / elapsed, 1) if elapsed else 0.0,
+        "errors": sum(errors.values()),
+        "operations": {},
+    }
+    for name, values in latencies.items():
+        values.sort()
+        result["operations"][name] = {
+            "requests": len(values),
+            "errors": errors[name],
+            "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+        }
+    return result
+
+
+def spawn_server(args):
+    """Запуск api_server.py во временном каталоге, возвращает (процесс, каталог, порт)"""
+    db_dir = tempfile.mkdtemp(prefix="uniportal-load-")
+    command = [sys.executable, os.path.join(ROOT, "api_server.py"),
+               "--host", args.host, "--port", "0", "--db-dir", db_dir,
+               "--rate-limiter", "none", *args.server_arg]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True, cwd=ROOT)
+    line = process.stdout.readline()
+    if not line.startswith("API: "):
+        process.kill()
+        raise RuntimeError(f"Сервер не запустился: {line!r}")
+    return process, db_dir, int(line.rsplit(":", 1)[1])
+
+
+async def main_async(args):
+    clients = [Client(args.host, args.port) for _ in range(args.connections)]
+    try:
+        started = time.perf_counter()
+        sessions = await prepare_users(args, clients)
+        prepare_time = time.perf_counter() - started
+        result = await run_load(args, clients, sessions)
+        result["users"] = len(sessions)
+        result["prepare_s"] = round(prepare_time, 2)
+        return result
+    finally:
+        for client in clients:
+            client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--spawn", action="store_true", help="запустить сервер во временном каталоге")
+    parser.add_argument("--server-arg", action="append", default=[],
+                        help="дополнительный аргумент api_server.py (можно несколько)")
+    parser.add_argument("--connections", type=int, default=16)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=10.0, help="длительность нагрузки, с")
+    parser.add_argument("--output", help="файл для JSON-результата (иначе stdout)")
+    args = parser.parse_args()
+
+    process = db_dir = None
+    if args.spawn:
+        process, db_dir, args.port = spawn_server(args)
+    try:
+        result = asyncio.run(main_async(args))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+            shutil.rmtree(db_dir, ignore_errors=True)
+
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
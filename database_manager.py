@@ -3,19 +3,2443 @@ import hashlib
 import json
 import os
 import re
-from datetime import datetime
+from datetime import datetime, timedelta
 import secrets
 import getpass
+import sys
 import html
+import threading
+import time
+import queue
+import atexit
+import asyncio
+import weakref
+import copy
+import calendar
+import csv
+import gzip
+import glob
+import heapq
+import bisect
+import hmac
+import warnings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка архива только внутри процесса
+    fcntl = None
+
+
+# Шаблоны SQL-инъекций и XSS для sanitize_input (в порядке применения)
+_SANITIZE_SOURCES = (
+    r'(\s*;\s*|\s*--\s*|\s*/\*\s*|\s*\*/\s*|\s*union\s+select\s*|\s*drop\s+table\s*|\s*delete\s+from\s*|\s*insert\s+into\s*|\s*update\s+set\s*)',
+    r'(\s*or\s+1\s*=\s*1\s*|\s*and\s+1\s*=\s*1\s*)',
+    r'(\s*exec\s*\(|\s*xp_cmdshell\s*)',
+    r'(\s*<script\b[^>]*>.*?</script\s*>|\s*javascript:|\s*on\w+\s*=)',
+    r'(\s*alert\s*\(|\s*prompt\s*\(|\s*confirm\s*\()',
+)
+_SANITIZE_PATTERNS = tuple(re.compile(source, re.IGNORECASE) for source in _SANITIZE_SOURCES)
+
+
+def _sanitize_detector(sources):
+    """Общая альтернатива всех шаблонов для быстрой проверки
+
+    Крайние \\s* не влияют на то, есть ли совпадение, поэтому убираются:
+    без них поиск не перебирает пробелы в каждой позиции строки. Если
+    альтернатива ничего не нашла, ни один шаблон не изменит строку.
+    """
+    alternatives = []
+    for source in sources:
+        for alternative in source[1:-1].split("|"):
+            if alternative.startswith(r"\s*"):
+                alternative = alternative[3:]
+            if alternative.endswith(r"\s*"):
+                alternative = alternative[:-3]
+            alternatives.append(alternative)
+    return re.compile("|".join(alternatives), re.IGNORECASE)
+
+
+_SANITIZE_ANY = _sanitize_detector(_SANITIZE_SOURCES)
+# Управляющие символы (коды 0-31): поиск и таблица для str.translate
+_CONTROL_CHARS_RE = re.compile("[\x00-\x1f]")
+_CONTROL_CHARS = dict.fromkeys(range(32))
+
+# Профили PRAGMA: применяются к каждому новому соединению пула.
+# cache_size < 0 задается в КиБ, mmap_size - в байтах, busy_timeout - в мс.
+PRAGMA_PROFILES = {
+    # Нагрузка веб-запросов: WAL не блокирует читателей на время записи
+    "oltp": {
+        "auto_vacuum": "INCREMENTAL",
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -16000,
+        "mmap_size": 64 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+        "secure_delete": "FAST",
+    },
+    # Редкие, но важные записи: полная синхронизация и затирание удаленного
+    "secure": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "cache_size": -2000,
+        "mmap_size": 0,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+        "secure_delete": "ON",
+    },
+    # Массовая загрузка: скорость важнее устойчивости к сбою питания
+    "bulk-load": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "cache_size": -262144,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "busy_timeout": 30000,
+        "secure_delete": "OFF",
+    },
+    # Реплика для отчетов: только чтение
+    "read-only-replica": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -65536,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+        "query_only": "ON",
+    },
+}
+
+# Профиль по умолчанию для каждого файла БД
+DEFAULT_DB_PROFILES = {
+    "users_quick.db": "oltp",
+    "users_full.db": "oltp",
+    "groups_quick.db": "oltp",
+    "groups_full.db": "oltp",
+    "group_leaders.db": "secure",
+    "admins.db": "secure",
+}
+
+# Таблицы каждого файла БД
+DB_TABLES = {
+    "users_quick.db": ("users_quick", "sessions", "security_logs"),
+    "users_full.db": ("users_full",),
+    "groups_quick.db": ("groups_quick",),
+    "groups_full.db": ("groups_full",),
+    "group_leaders.db": ("group_leaders",),
+    "admins.db": ("admins",),
+}
+
+# Таблицы, доступные для просмотра и выгрузки: таблица -> логический файл БД
+EXPORT_TABLES = {table: db_name for db_name, tables in DB_TABLES.items() for table in tables}
+
+# Секретные столбцы выгружаются только с include_secrets=True
+EXPORT_SECRET_COLUMNS = {
+    "users_quick": ("password_hash", "salt"),
+    "sessions": ("session_id",),
+}
+
+# Режимы хранения:
+#   split    - шесть отдельных файлов, составные чтения собираются в Python
+#   attached - шесть файлов, соединения users_quick.db подключают остальные
+#              через ATTACH: профиль и регистрация - один запрос/одна транзакция
+#   unified  - все таблицы в одном файле UNIFIED_DB_NAME
+STORAGE_MODES = ("split", "attached", "unified")
+UNIFIED_DB_NAME = "uniportal.db"
+
+# Порядок важен: auto_vacuum (действует только для новых файлов) и
+# journal_mode до остальных, query_only последним
+_PRAGMA_ORDER = (
+    "auto_vacuum", "journal_mode", "synchronous", "cache_size", "mmap_size",
+    "temp_store", "busy_timeout", "secure_delete", "query_only",
+)
+
+
+# PRAGMA, действующие на соединение целиком, а не на отдельную схему
+_CONNECTION_PRAGMAS = {"temp_store", "busy_timeout", "query_only"}
+
+
+def apply_pragma_profile(conn, profile, schema=None):
+    """Применение профиля PRAGMA (имени или словаря) к соединению
+    
+    schema - имя подключенной через ATTACH базы: тогда применяются только
+    PRAGMA, относящиеся к отдельной схеме.
+    """
+    if isinstance(profile, str):
+        if profile not in PRAGMA_PROFILES:
+            raise ValueError(f"Неизвестный профиль PRAGMA: {profile}")
+        profile = PRAGMA_PROFILES[profile]
+    
+    unknown = set(profile) - set(_PRAGMA_ORDER)
+    if unknown:
+        raise ValueError(f"Недопустимые PRAGMA: {', '.join(sorted(unknown))}")
+    
+    for name in _PRAGMA_ORDER:
+        if name not in profile:
+            continue
+        value = profile[name]
+        # Значения подставляются в текст PRAGMA, поэтому только числа и слова
+        if not isinstance(value, int) and not str(value).isalpha():
+            raise ValueError(f"Недопустимое значение PRAGMA {name}: {value!r}")
+        if schema is None:
+            conn.execute(f"PRAGMA {name} = {value}").fetchall()
+        elif name not in _CONNECTION_PRAGMAS:
+            conn.execute(f"PRAGMA {schema}.{name} = {value}").fetchall()
+
+
+def _add_columns(table, columns):
+    """Шаг миграции: добавление столбцов, которых еще нет в таблице"""
+    def step(conn):
+        existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        for name, definition in columns:
+            if name not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+    return step
+
+
+def _rebuild_table(table, create_sql, indexes=()):
+    """Шаг миграции: пересоздание таблицы с новым определением и данными"""
+    def step(conn):
+        conn.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+        conn.execute(create_sql)
+        columns = ", ".join(
+            row[1] for row in conn.execute(f"PRAGMA table_info({table})")
+        )
+        conn.execute(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {table}_old")
+        conn.execute(f"DROP TABLE {table}_old")
+        for index_sql in indexes:
+            conn.execute(index_sql)
+    return step
+
+
+# Полнотекстовый поиск: unicode61 приводит к нижнему регистру и кириллицу,
+# remove_diacritics 2 убирает диакритику латиницы; префиксные индексы
+# ускоряют запросы вида "ив*" и "ива*"
+_FTS_OPTIONS = "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'"
+
+# Буквы, которые поиск не различает (unicode61 их не сводит): одна свертка
+# для FTS5 (_fts_text, fts_query) и справочника пользователей (_fold_name)
+_SEARCH_FOLDS = (("ё", "е"), ("й", "и"))
+
+
+def _fold_name(text):
+    """Ключ поиска без учета регистра и различий из _SEARCH_FOLDS"""
+    if not text:
+        return ""
+    text = text.casefold()
+    for letter, replacement in _SEARCH_FOLDS:
+        text = text.replace(letter, replacement)
+    return text
+
+
+def _fts_text(expr):
+    """SQL-выражение текста для индекса со сверткой _SEARCH_FOLDS"""
+    for letter, replacement in _SEARCH_FOLDS:
+        for case in (str.lower, str.upper):
+            expr = f"replace({expr}, '{case(letter)}', '{case(replacement)}')"
+    return expr
+
+
+def _fts_index(table, fts_table, columns):
+    """Шаги миграции: индекс FTS5 по столбцам таблицы и триггеры синхронизации
+
+    Индекс с внешним содержимым (текст хранится только в таблице) читает
+    представление {fts_table}_source со сверткой _fts_text; триггеры
+    передают в индекс тот же текст, поэтому 'rebuild' и 'delete' согласованы.
+    """
+    column_list = ", ".join(columns)
+    def values(row):
+        return ", ".join(_fts_text(f"{row}.{column}") for column in columns)
+    return [
+        f'''
+        CREATE VIEW IF NOT EXISTS {fts_table}_source AS
+        SELECT rowid AS doc_id, {", ".join(f"{_fts_text(column)} AS {column}" for column in columns)}
+        FROM {table}
+        ''',
+        f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5(
+            {column_list}, content='{fts_table}_source', content_rowid='doc_id', {_FTS_OPTIONS}
+        )
+        ''',
+        f"INSERT INTO {fts_table} ({fts_table}) VALUES ('rebuild')",
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{fts_table}_insert
+        AFTER INSERT ON {table}
+        BEGIN
+            INSERT INTO {fts_table} (rowid, {column_list}) VALUES (NEW.rowid, {values("NEW")});
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{fts_table}_delete
+        AFTER DELETE ON {table}
+        BEGIN
+            INSERT INTO {fts_table} ({fts_table}, rowid, {column_list})
+            VALUES ('delete', OLD.rowid, {values("OLD")});
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{fts_table}_update
+        AFTER UPDATE OF {column_list} ON {table}
+        BEGIN
+            INSERT INTO {fts_table} ({fts_table}, rowid, {column_list})
+            VALUES ('delete', OLD.rowid, {values("OLD")});
+            INSERT INTO {fts_table} (rowid, {column_list}) VALUES (NEW.rowid, {values("NEW")});
+        END
+        ''',
+    ]
+
+
+def _fts_refold(table, fts_table, columns):
+    """Шаги миграции: пересоздание представления и триггеров индекса после
+    изменения _SEARCH_FOLDS и перестроение индекса"""
+    return [
+        f"DROP VIEW IF EXISTS {fts_table}_source",
+        f"DROP TRIGGER IF EXISTS trg_{fts_table}_insert",
+        f"DROP TRIGGER IF EXISTS trg_{fts_table}_delete",
+        f"DROP TRIGGER IF EXISTS trg_{fts_table}_update",
+    ] + _fts_index(table, fts_table, columns)
+
+
+# Индексы поиска: вид -> (таблица FTS5, логическая база)
+SEARCH_INDEXES = {
+    "users": ("users_fts", "users_full.db"),
+    "groups": ("groups_fts", "groups_full.db"),
+}
+
+_FTS_TOKEN_RE = re.compile(r"\w+")
+
+
+def fts_query(text):
+    """Запрос FTS5 из пользовательского ввода: все слова как префиксы
+
+    Слова берутся в кавычки, поэтому операторы FTS5 (AND, NEAR, ^, :)
+    во вводе не интерпретируются. Возвращает None, если слов нет.
+    """
+    tokens = _FTS_TOKEN_RE.findall(_fold_name(text))
+    return " ".join(f'"{token}"*' for token in tokens) if tokens else None
+
+
+# Миграции схемы: файл БД -> список (версия, описание, шаги).
+# Шаг - SQL-строка или функция от соединения. Примененные версии
+# записываются в таблицу schema_migrations того же файла.
+SCHEMA_MIGRATIONS = {
+    "users_quick.db": [
+        (1, "базовая схема", [
+            '''
+            CREATE TABLE IF NOT EXISTS users_quick (
+                email TEXT PRIMARY KEY,
+                password_hash TEXT NOT NULL,
+                salt TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_login TIMESTAMP
+            )
+            ''',
+            'CREATE INDEX IF NOT EXISTS idx_email ON users_quick(email)',
+        ]),
+        (2, "сессии и журнал безопасности", [
+            '''
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                user_email TEXT NOT NULL,
+                ip_address TEXT,
+                user_agent TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                expires_at TIMESTAMP,
+                is_valid INTEGER DEFAULT 1,
+                FOREIGN KEY (user_email) REFERENCES users_quick(email) ON DELETE CASCADE
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS security_logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                ip_address TEXT,
+                event_type TEXT,
+                user_email TEXT,
+                success INTEGER,
+                error_message TEXT,
+                user_agent TEXT
+            )
+            ''',
+        ]),
+        (3, "счетчик неудачных входов и блокировка", [
+            _add_columns("users_quick", [
+                ("failed_attempts", "INTEGER DEFAULT 0"),
+                ("locked_until", "TIMESTAMP"),
+            ]),
+        ]),
+        (4, "индексы для проверки и очистки сессий", [
+            'CREATE INDEX IF NOT EXISTS idx_sessions_lookup ON sessions(session_id, is_valid, expires_at)',
+            'CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions(user_email)',
+            'CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions(expires_at)',
+            'CREATE INDEX IF NOT EXISTS idx_sessions_revoked ON sessions(session_id) WHERE is_valid = 0',
+        ]),
+        (5, "индексы журнала безопасности для расследований и архивации", [
+            'CREATE INDEX IF NOT EXISTS idx_security_logs_user_time ON security_logs(user_email, timestamp)',
+            'CREATE INDEX IF NOT EXISTS idx_security_logs_ip_time ON security_logs(ip_address, timestamp)',
+            'CREATE INDEX IF NOT EXISTS idx_security_logs_time ON security_logs(timestamp)',
+        ]),
+    ],
+    "users_full.db": [
+        (1, "базовая схема", [
+            '''
+            CREATE TABLE IF NOT EXISTS users_full (
+                email TEXT PRIMARY KEY,
+                nickname TEXT NOT NULL UNIQUE,
+                full_name TEXT,
+                avatar TEXT,
+                theme TEXT DEFAULT 'light',
+                notifications_enabled INTEGER DEFAULT 1,
+                bio TEXT,
+                settings_json TEXT DEFAULT '{}',
+                FOREIGN KEY (email) REFERENCES users_quick(email) ON DELETE CASCADE
+            )
+            ''',
+            'CREATE INDEX IF NOT EXISTS idx_nickname ON users_full(nickname)',
+        ]),
+        # SQLite не проверяет внешние ключи между файлами: ссылка на
+        # users_quick из другого файла делала любую вставку ошибкой
+        (2, "удаление внешнего ключа на другой файл", [
+            _rebuild_table("users_full", '''
+                CREATE TABLE users_full (
+                    email TEXT PRIMARY KEY,
+                    nickname TEXT NOT NULL UNIQUE,
+                    full_name TEXT,
+                    avatar TEXT,
+                    theme TEXT DEFAULT 'light',
+                    notifications_enabled INTEGER DEFAULT 1,
+                    bio TEXT,
+                    settings_json TEXT DEFAULT '{}'
+                )
+            ''', ['CREATE INDEX IF NOT EXISTS idx_nickname ON users_full(nickname)']),
+        ]),
+        (3, "полнотекстовый поиск пользователей",
+            _fts_index("users_full", "users_fts", ["full_name", "nickname", "bio"])),
+        (4, "поиск пользователей: й = и",
+            _fts_refold("users_full", "users_fts", ["full_name", "nickname", "bio"])),
+    ],
+    "groups_quick.db": [
+        (1, "базовая схема", [
+            '''
+            CREATE TABLE IF NOT EXISTS groups_quick (
+                user_email TEXT,
+                group_id TEXT NOT NULL,
+                PRIMARY KEY (user_email, group_id),
+                FOREIGN KEY (user_email) REFERENCES users_quick(email) ON DELETE CASCADE
+            )
+            ''',
+            'CREATE INDEX IF NOT EXISTS idx_user_group ON groups_quick(user_email, group_id)',
+        ]),
+        (2, "удаление внешнего ключа на другой файл", [
+            _rebuild_table("groups_quick", '''
+                CREATE TABLE groups_quick (
+                    user_email TEXT,
+                    group_id TEXT NOT NULL,
+                    PRIMARY KEY (user_email, group_id)
+                )
+            ''', ['CREATE INDEX IF NOT EXISTS idx_user_group ON groups_quick(user_email, group_id)']),
+        ]),
+        # idx_user_group повторял первичный ключ; для списков участников
+        # нужен индекс, начинающийся с group_id. Число участников ведут триггеры
+        # (в REPLACE триггеры удаления не срабатывают, поэтому вставки - OR IGNORE)
+        (3, "индекс по группе и счетчики участников", [
+            'DROP INDEX IF EXISTS idx_user_group',
+            'CREATE INDEX IF NOT EXISTS idx_groups_quick_group ON groups_quick(group_id, user_email)',
+            '''
+            CREATE TABLE IF NOT EXISTS group_member_counts (
+                group_id TEXT PRIMARY KEY,
+                member_count INTEGER NOT NULL DEFAULT 0
+            )
+            ''',
+            '''
+            INSERT OR REPLACE INTO group_member_counts (group_id, member_count)
+            SELECT group_id, COUNT(*) FROM groups_quick GROUP BY group_id
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS trg_groups_quick_count_insert
+            AFTER INSERT ON groups_quick
+            BEGIN
+                INSERT INTO group_member_counts (group_id, member_count) VALUES (NEW.group_id, 1)
+                ON CONFLICT (group_id) DO UPDATE SET member_count = member_count + 1;
+            END
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS trg_groups_quick_count_delete
+            AFTER DELETE ON groups_quick
+            BEGIN
+                UPDATE group_member_counts SET member_count = member_count - 1
+                WHERE group_id = OLD.group_id;
+            END
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS trg_groups_quick_count_update
+            AFTER UPDATE OF group_id ON groups_quick
+            WHEN OLD.group_id IS NOT NEW.group_id
+            BEGIN
+                UPDATE group_member_counts SET member_count = member_count - 1
+                WHERE group_id = OLD.group_id;
+                INSERT INTO group_member_counts (group_id, member_count) VALUES (NEW.group_id, 1)
+                ON CONFLICT (group_id) DO UPDATE SET member_count = member_count + 1;
+            END
+            ''',
+        ]),
+    ],
+    "groups_full.db": [
+        (1, "базовая схема", [
+            '''
+            CREATE TABLE IF NOT EXISTS groups_full (
+                group_id TEXT PRIMARY KEY,
+                group_name TEXT NOT NULL,
+                description TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                settings_json TEXT DEFAULT '{}'
+            )
+            ''',
+            'CREATE INDEX IF NOT EXISTS idx_group_name ON groups_full(group_name)',
+        ]),
+        # Запись групп - INSERT ... ON CONFLICT DO UPDATE: при REPLACE
+        # триггер удаления не срабатывает и индекс разошелся бы с таблицей
+        (2, "полнотекстовый поиск групп",
+            _fts_index("groups_full", "groups_fts", ["group_name", "description"])),
+        (3, "поиск групп: й = и",
+            _fts_refold("groups_full", "groups_fts", ["group_name", "description"])),
+    ],
+    "group_leaders.db": [
+        (1, "базовая схема", [
+            '''
+            CREATE TABLE IF NOT EXISTS group_leaders (
+                group_id TEXT NOT NULL,
+                leader_email TEXT NOT NULL,
+                PRIMARY KEY (group_id, leader_email),
+                FOREIGN KEY (group_id) REFERENCES groups_full(group_id) ON DELETE CASCADE,
+                FOREIGN KEY (leader_email) REFERENCES users_quick(email) ON DELETE CASCADE
+            )
+            ''',
+        ]),
+        (2, "удаление внешних ключей на другие файлы", [
+            _rebuild_table("group_leaders", '''
+                CREATE TABLE group_leaders (
+                    group_id TEXT NOT NULL,
+                    leader_email TEXT NOT NULL,
+                    PRIMARY KEY (group_id, leader_email)
+                )
+            '''),
+        ]),
+        (3, "индекс старост по email для проверки ролей", [
+            'CREATE INDEX IF NOT EXISTS idx_group_leaders_leader ON group_leaders(leader_email, group_id)',
+        ]),
+    ],
+    "admins.db": [
+        (1, "базовая схема", [
+            '''
+            CREATE TABLE IF NOT EXISTS admins (
+                admin_email TEXT PRIMARY KEY,
+                permissions_json TEXT DEFAULT '{}',
+                FOREIGN KEY (admin_email) REFERENCES users_quick(email) ON DELETE CASCADE
+            )
+            ''',
+        ]),
+        (2, "удаление внешнего ключа на другой файл", [
+            _rebuild_table("admins", '''
+                CREATE TABLE admins (
+                    admin_email TEXT PRIMARY KEY,
+                    permissions_json TEXT DEFAULT '{}'
+                )
+            '''),
+        ]),
+    ],
+}
+
+
+def apply_migrations(conn, db_name, migrations=None):
+    """Применение недостающих миграций к файлу БД, возвращает версию схемы"""
+    if migrations is None:
+        migrations = SCHEMA_MIGRATIONS.get(db_name, [])
+    
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            db_name TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (db_name, version)
+        )
+    ''')
+    conn.commit()
+    
+    def current_version():
+        row = conn.execute(
+            "SELECT MAX(version) FROM schema_migrations WHERE db_name = ?", (db_name,)
+        ).fetchone()
+        return row[0] or 0
+    
+    version = current_version()
+    pending = [m for m in migrations if m[0] > version]
+    if not pending:
+        return version
+    
+    # BEGIN IMMEDIATE сериализует миграцию между процессами
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = current_version()
+        for number, description, steps in sorted(migrations, key=lambda m: m[0]):
+            if number <= version:
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(
+                "INSERT INTO schema_migrations (db_name, version, description) VALUES (?, ?, ?)",
+                (db_name, number, description)
+            )
+            version = number
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return version
+
+
+def migrate_to_unified(db_dir="databases", target_name=UNIFIED_DB_NAME):
+    """Перенос данных из шести файлов БД в один файл для режима unified
+    
+    Схема исходных файлов и целевого файла сначала приводится к последней
+    версии. Уже существующие в целевом файле строки не перезаписываются.
+    Возвращает число перенесенных строк по таблицам.
+    """
+    conn = sqlite3.connect(os.path.join(db_dir, target_name))
+    counts = {}
+    try:
+        conn.execute("PRAGMA journal_mode = WAL").fetchall()
+        for db_name, tables in DB_TABLES.items():
+            apply_migrations(conn, db_name)
+            
+            source_path = os.path.join(db_dir, db_name)
+            if not os.path.exists(source_path):
+                continue
+            source = sqlite3.connect(source_path)
+            try:
+                apply_migrations(source, db_name)
+            finally:
+                source.close()
+            
+            conn.execute("ATTACH DATABASE ? AS source", (source_path,))
+            try:
+                with conn:
+                    for table in tables:
+                        columns = ", ".join(
+                            row[1] for row in conn.execute(f"PRAGMA main.table_info({table})")
+                        )
+                        cursor = conn.execute(
+                            f"INSERT OR IGNORE INTO main.{table} ({columns}) "
+                            f"SELECT {columns} FROM source.{table}"
+                        )
+                        counts[table] = cursor.rowcount
+            finally:
+                conn.execute("DETACH DATABASE source")
+    finally:
+        conn.close()
+    return counts
+
+
+# Реестр именованных запросов: имя -> (логическая база, SQL). Запросы
+# компилируются через EXPLAIN при первой проверке схемы файла, время и
+# число строк учитываются по имени (DatabaseManager.statement_stats)
+QUERIES = {
+    "users.email_exists": ("users_quick.db",
+        "SELECT email FROM users_quick WHERE email = ?"),
+    "users.nickname_exists": ("users_full.db",
+        "SELECT nickname FROM users_full WHERE nickname = ?"),
+    "users.directory_entry": ("users_full.db",
+        "SELECT email, nickname, full_name FROM users_full WHERE email = ?"),
+    "auth.credentials": ("users_quick.db", '''
+        SELECT email, password_hash, salt, failed_attempts, locked_until
+        FROM users_quick WHERE email = ?
+    '''),
+    "auth.login_ok": ("users_quick.db", '''
+        UPDATE users_quick
+        SET last_login = CURRENT_TIMESTAMP, failed_attempts = 0, locked_until = NULL
+        WHERE email = ?
+    '''),
+    "auth.login_ok_rehash": ("users_quick.db", '''
+        UPDATE users_quick
+        SET last_login = CURRENT_TIMESTAMP, failed_attempts = 0, locked_until = NULL,
+            password_hash = ?, salt = ?
+        WHERE email = ?
+    '''),
+    "auth.login_failed": ("users_quick.db",
+        "UPDATE users_quick SET failed_attempts = ? WHERE email = ?"),
+    "auth.lock": ("users_quick.db",
+        "UPDATE users_quick SET failed_attempts = ?, locked_until = ? WHERE email = ?"),
+    "sessions.insert": ("users_quick.db", '''
+        INSERT INTO sessions (session_id, user_email, ip_address, expires_at)
+        VALUES (?, ?, ?, datetime('now', '+24 hours'))
+    '''),
+    "sessions.load": ("users_quick.db", '''
+        SELECT s.user_email, s.ip_address, s.expires_at
+        FROM sessions s
+        JOIN users_quick u ON s.user_email = u.email
+        WHERE s.session_id = ?
+        AND s.is_valid = 1
+        AND s.expires_at > CURRENT_TIMESTAMP
+    '''),
+    "sessions.revoke": ("users_quick.db",
+        "UPDATE sessions SET is_valid = 0 WHERE session_id = ?"),
+    "sessions.revoke_user": ("users_quick.db",
+        "UPDATE sessions SET is_valid = 0 WHERE user_email = ? AND is_valid = 1"),
+    "security_logs.insert": ("users_quick.db", '''
+        INSERT INTO security_logs (ip_address, event_type, user_email, success, error_message)
+        VALUES (?, ?, ?, ?, ?)
+    '''),
+    "profile.full": ("users_full.db",
+        "SELECT * FROM users_full WHERE email = ?"),
+    "profile.joined": ("users_quick.db", '''
+        SELECT f.*,
+               (SELECT json_group_array(group_id) FROM (
+                    SELECT group_id FROM groups_quick
+                    WHERE user_email = f.email ORDER BY group_id
+               )) AS groups_json,
+               EXISTS (SELECT 1 FROM group_leaders WHERE leader_email = f.email) AS is_leader,
+               EXISTS (SELECT 1 FROM admins WHERE admin_email = f.email) AS is_admin
+        FROM users_full f
+        WHERE f.email = ?
+    '''),
+    "groups.user_groups": ("groups_quick.db",
+        "SELECT group_id FROM groups_quick WHERE user_email = ?"),
+    "groups.add_member": ("groups_quick.db",
+        "INSERT OR IGNORE INTO groups_quick (user_email, group_id) VALUES (?, ?)"),
+    "groups.member_count": ("groups_quick.db",
+        "SELECT member_count FROM group_member_counts WHERE group_id = ?"),
+    "groups.exists": ("groups_full.db",
+        "SELECT group_id FROM groups_full WHERE group_id = ?"),
+    "groups.create": ("groups_full.db",
+        "INSERT INTO groups_full (group_id, group_name) VALUES (?, ?)"),
+    "groups.upsert": ("groups_full.db", '''
+        INSERT INTO groups_full (group_id, group_name, description) VALUES (?, ?, ?)
+        ON CONFLICT (group_id) DO UPDATE
+        SET group_name = excluded.group_name, description = excluded.description
+    '''),
+    # bm25: меньше - лучше; веса столбцов в порядке объявления таблицы FTS5
+    "search.users": ("users_full.db", '''
+        SELECT f.email, f.nickname, f.full_name, bm25(users_fts, 10.0, 10.0, 1.0) AS score
+        FROM users_fts JOIN users_full f ON f.rowid = users_fts.rowid
+        WHERE users_fts MATCH ?
+        ORDER BY score, f.rowid
+        LIMIT ?
+    '''),
+    "search.groups": ("groups_full.db", '''
+        SELECT g.group_id, g.group_name, g.description, bm25(groups_fts, 10.0, 1.0) AS score
+        FROM groups_fts JOIN groups_full g ON g.rowid = groups_fts.rowid
+        WHERE groups_fts MATCH ?
+        ORDER BY score, g.rowid
+        LIMIT ?
+    '''),
+    "roles.all_admins": ("admins.db",
+        "SELECT admin_email, permissions_json FROM admins"),
+    "roles.all_leaders": ("group_leaders.db",
+        "SELECT leader_email, group_id FROM group_leaders"),
+    "roles.assign_admin": ("admins.db",
+        "INSERT OR REPLACE INTO admins (admin_email, permissions_json) VALUES (?, ?)"),
+    "roles.assign_leader": ("group_leaders.db",
+        "INSERT OR REPLACE INTO group_leaders (group_id, leader_email) VALUES (?, ?)"),
+    # Отчеты (REPORT_QUERIES): выполняются на снимках, а не на рабочих файлах
+    "report.group_sizes": ("groups_quick.db", '''
+        SELECT group_id, member_count FROM group_member_counts
+        WHERE member_count > 0
+        ORDER BY member_count DESC, group_id
+        LIMIT ?
+    '''),
+    "report.login_activity": ("users_quick.db", '''
+        SELECT date(timestamp) AS day,
+               SUM(event_type = 'login') AS logins,
+               SUM(event_type IN ('login_failed', 'login_attempt')) AS failures,
+               COUNT(DISTINCT user_email) AS users
+        FROM security_logs
+        WHERE timestamp >= datetime('now', ?) AND event_type LIKE 'login%'
+        GROUP BY day
+        ORDER BY day
+    '''),
+    "report.active_sessions": ("users_quick.db", '''
+        SELECT user_email, COUNT(*) AS sessions, MAX(created_at) AS last_created
+        FROM sessions
+        WHERE is_valid = 1 AND expires_at > datetime('now')
+        GROUP BY user_email
+        ORDER BY sessions DESC, user_email
+        LIMIT ?
+    '''),
+}
+
+# Запросы, которым нужны таблицы всех файлов (только режимы attached и unified)
+JOINED_QUERIES = {"profile.joined"}
+
+# Отчетные запросы: только чтение, выполняются на снимках (DatabaseManager.run_report)
+REPORT_QUERIES = {"report.group_sizes", "report.login_activity", "report.active_sessions"}
+
+
+def explain_errors(conn, names):
+    """Компиляция запросов реестра без выполнения: список (имя, текст ошибки)"""
+    errors = []
+    for name in names:
+        sql = QUERIES[name][1]
+        try:
+            conn.execute("EXPLAIN " + sql, (None,) * sql.count("?")).fetchall()
+        except sqlite3.Error as e:
+            errors.append((name, str(e)))
+    return errors
+
+
+class PoolTimeoutError(sqlite3.OperationalError):
+    """Не удалось получить соединение из пула за отведенное время"""
+
+
+class ConnectionPool:
+    """Пул соединений SQLite для одного файла БД
+
+    Соединение, выданное потоку, закрепляется за ним до возврата в пул:
+    повторный checkout из того же потока возвращает то же соединение
+    (счетчик вложенности), поэтому вложенные вызовы методов не занимают
+    лишних соединений. После возврата поток в первую очередь получает
+    свое прежнее соединение (affinity), если оно свободно.
+    """
+
+    def __init__(self, db_path, size=5, timeout=10.0, on_connect=None, cached_statements=128):
+        if size < 1:
+            raise ValueError("Размер пула должен быть не меньше 1")
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self.on_connect = on_connect
+        # Размер кэша подготовленных запросов каждого соединения
+        self.cached_statements = cached_statements
+
+        self._idle = []
+        self._opened = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self._stats = {
+            "checkouts": 0,
+            "reentrant": 0,
+            "hits": 0,
+            "affinity_hits": 0,
+            "created": 0,
+            "waits": 0,
+            "wait_time": 0.0,
+            "timeouts": 0,
+        }
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        conn.row_factory = sqlite3.Row
+        if self.on_connect:
+            self.on_connect(conn)
+        return conn
+
+    def current(self):
+        """Соединение, которое сейчас удерживает текущий поток (или None)"""
+        return getattr(self._local, "conn", None)
+
+    def checkout(self, timeout=None):
+        """Получение соединения из пула с ожиданием не дольше timeout секунд"""
+        local = self._local
+        held = getattr(local, "conn", None)
+        if held is not None:
+            local.depth += 1
+            with self._cond:
+                self._stats["reentrant"] += 1
+            return held
+
+        if timeout is None:
+            timeout = self.timeout
+
+        preferred = getattr(local, "preferred", None)
+        conn = None
+        create = False
+        waited_since = None
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise sqlite3.ProgrammingError("Пул соединений закрыт")
+
+                if self._idle:
+                    if preferred is not None and preferred in self._idle:
+                        self._idle.remove(preferred)
+                        conn = preferred
+                        self._stats["affinity_hits"] += 1
+                    else:
+                        conn = self._idle.pop()
+                    if waited_since is None:
+                        self._stats["hits"] += 1
+                    break
+
+                if self._opened < self.size:
+                    # Резервируем слот, само соединение открываем вне блокировки
+                    self._opened += 1
+                    create = True
+                    break
+
+                if waited_since is None:
+                    waited_since = time.monotonic()
+                    self._stats["waits"] += 1
+
+                remaining = timeout - (time.monotonic() - waited_since)
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    self._stats["wait_time"] += time.monotonic() - waited_since
+                    raise PoolTimeoutError(
+                        f"Нет свободных соединений с {os.path.basename(self.db_path)}"
+                    )
+                self._cond.wait(remaining)
+
+            if waited_since is not None:
+                self._stats["wait_time"] += time.monotonic() - waited_since
+            self._stats["checkouts"] += 1
+
+        if create:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._opened -= 1
+                    self._stats["checkouts"] -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._stats["created"] += 1
+
+        local.conn = conn
+        local.depth = 1
+        local.preferred = conn
+        return conn
+
+    def checkin(self, conn, force=False):
+        """Возврат соединения в пул (force - независимо от вложенности)"""
+        local = self._local
+        if getattr(local, "conn", None) is not conn:
+            raise sqlite3.ProgrammingError("Соединение не принадлежит текущему потоку")
+
+        local.depth = 0 if force else local.depth - 1
+        if local.depth > 0:
+            return
+        local.conn = None
+
+        # Незавершенная транзакция не должна перейти к другому потоку
+        if conn.in_transaction:
+            conn.rollback()
+
+        with self._cond:
+            if self._closed:
+                self._opened -= 1
+                conn.close()
+                return
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def release(self):
+        """Принудительный возврат соединения, закрепленного за текущим потоком"""
+        conn = self.current()
+        if conn is not None:
+            self.checkin(conn, force=True)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.checkout(timeout)
+        try:
+            yield conn
+        finally:
+            self.checkin(conn)
+
+    def stats(self):
+        """Статистика пула: ожидания, выдачи, доля выдач без ожидания"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats["size"] = self.size
+            stats["opened"] = self._opened
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = self._opened - len(self._idle)
+        checkouts = stats["checkouts"]
+        stats["hit_rate"] = stats["hits"] / checkouts if checkouts else 0.0
+        return stats
+
+    def close(self):
+        """Закрытие свободных соединений; занятые закроются при возврате"""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._opened -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            conn.close()
+
+
+# Незакрытые писатели журнала: при выходе их дописывает один обработчик
+# atexit, а закрытые и удаленные писатели из набора пропадают сами
+_OPEN_SECURITY_LOG_WRITERS = weakref.WeakSet()
+
+
+@atexit.register
+def _close_security_log_writers():
+    for writer in list(_OPEN_SECURITY_LOG_WRITERS):
+        writer.close()
+
+
+class SecurityEventWriter:
+    """Фоновая пакетная запись событий безопасности
+
+    События складываются в ограниченную очередь и записываются функцией
+    write_batch(rows) пачками: как только набралось batch_size событий или
+    прошло flush_interval секунд с первого события пачки. При полной
+    очереди submit ждет не дольше put_timeout, после чего событие
+    отбрасывается и учитывается в счетчике dropped.
+    """
+
+    _STOP = object()
+
+    def __init__(self, write_batch, max_queue=10000, batch_size=500,
+                 flush_interval=0.5, put_timeout=0.01):
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._stats = {
+            "submitted": 0,
+            "written": 0,
+            "dropped": 0,
+            "failed": 0,
+            "batches": 0,
+            "max_depth": 0,
+        }
+        self._thread = threading.Thread(
+            target=self._run, name="security-log-writer", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def submit(self, row):
+        """Постановка события в очередь; False, если событие отброшено"""
+        if self._closed:
+            return False
+        try:
+            if self.put_timeout:
+                self._queue.put(row, timeout=self.put_timeout)
+            else:
+                self._queue.put_nowait(row)
+        except queue.Full:
+            with self._lock:
+                self._stats["dropped"] += 1
+            return False
+
+        depth = self._queue.qsize()
+        with self._lock:
+            self._stats["submitted"] += 1
+            if depth > self._stats["max_depth"]:
+                self._stats["max_depth"] = depth
+        return True
+
+    def flush(self, timeout=None):
+        """Ожидание записи всех событий, поставленных до вызова"""
+        if self._closed or not self._thread.is_alive():
+            return False
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def close(self, timeout=None):
+        """Запись оставшихся событий и остановка фонового потока"""
+        if self._closed:
+            return
+        self._closed = True
+        _OPEN_SECURITY_LOG_WRITERS.discard(self)
+        self._queue.put(self._STOP)
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["queue_depth"] = self._queue.qsize()
+        return stats
+
+    def _write(self, batch):
+        if not batch:
+            return
+        try:
+            self.write_batch(batch)
+        except Exception as e:
+            with self._lock:
+                self._stats["failed"] += len(batch)
+            print(f"Security log error: {e}")
+            return
+        with self._lock:
+            self._stats["written"] += len(batch)
+            self._stats["batches"] += 1
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            batch = []
+            waiters = []
+            stop = False
+            deadline = time.monotonic() + self.flush_interval
+
+            # Собираем пачку до batch_size событий или до истечения интервала
+            while True:
+                if item is self._STOP:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+
+                if stop or waiters or len(batch) >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            if stop:
+                # Дописываем все, что успели поставить до остановки
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if isinstance(item, threading.Event):
+                        waiters.append(item)
+                    elif item is not self._STOP:
+                        batch.append(item)
+
+            for start in range(0, len(batch), self.batch_size):
+                self._write(batch[start:start + self.batch_size])
+            for waiter in waiters:
+                waiter.set()
+            if stop:
+                return
+
+
+# Количество итераций PBKDF2
+PBKDF2_ITERATIONS = 100000
+
+
+def _pbkdf2_hex(password, salt, iterations=PBKDF2_ITERATIONS):
+    """PBKDF2-SHA256 в hex; функция модуля, чтобы ее можно было передать в другой процесс"""
+    return hashlib.pbkdf2_hmac(
+        'sha256',
+        password.encode('utf-8'),
+        salt.encode('utf-8'),
+        iterations
+    ).hex()
+
+
+# Схемы хэширования паролей и стоимость по умолчанию. Хэш хранится как
+# "схема$стоимость$соль$hex"; у pbkdf2_sha256 стоимость - число итераций,
+# у scrypt - "n:r:p". Записи старого формата (только hex) читаются как
+# pbkdf2_sha256 со 100000 итераций и солью из колонки salt.
+PASSWORD_SCHEMES = {
+    "pbkdf2_sha256": str(PBKDF2_ITERATIONS),
+    "scrypt": "16384:8:1",
+}
+DEFAULT_PASSWORD_SCHEME = "pbkdf2_sha256"
+_LEGACY_PASSWORD_COST = "100000"
+
+
+def _password_hash_hex(password, salt, scheme, cost):
+    """Хэш пароля по схеме и стоимости в hex; функция модуля для пула процессов"""
+    if scheme == "pbkdf2_sha256":
+        return _pbkdf2_hex(password, salt, int(cost))
+    if scheme == "scrypt":
+        n, r, p = (int(part) for part in cost.split(":"))
+        return hashlib.scrypt(
+            password.encode('utf-8'),
+            salt=salt.encode('utf-8'),
+            n=n, r=r, p=p,
+            maxmem=128 * r * (n + p + 2) + 2 ** 20,
+            dklen=32
+        ).hex()
+    raise ValueError(f"Неизвестная схема хэширования: {scheme}")
+
+
+def normalize_password_cost(scheme, cost=None):
+    """Проверка схемы и приведение стоимости к строке формата хэша"""
+    if scheme not in PASSWORD_SCHEMES:
+        raise ValueError(f"Неизвестная схема хэширования: {scheme}")
+    if scheme == "scrypt" and not hasattr(hashlib, "scrypt"):
+        raise ValueError("hashlib собран без поддержки scrypt")
+    if cost is None:
+        return PASSWORD_SCHEMES[scheme]
+    if isinstance(cost, (tuple, list)):
+        cost = ":".join(map(str, cost))
+    cost = str(cost)
+
+    parts = cost.split(":")
+    if len(parts) != (3 if scheme == "scrypt" else 1) or not all(p.isdigit() and int(p) > 0 for p in parts):
+        raise ValueError(f"Некорректная стоимость {cost!r} для схемы {scheme}")
+    if scheme == "scrypt" and int(parts[0]) & (int(parts[0]) - 1):
+        raise ValueError("Параметр n для scrypt должен быть степенью двойки")
+    return cost
+
+
+def encode_password_hash(scheme, cost, salt, digest):
+    return f"{scheme}${cost}${salt}${digest}"
+
+
+def parse_password_hash(stored, salt=None):
+    """(схема, стоимость, соль, hex) из сохраненного хэша; ValueError для испорченного"""
+    if not isinstance(stored, str):
+        raise ValueError("Хэш пароля должен быть строкой")
+    if "$" not in stored:
+        return "pbkdf2_sha256", _LEGACY_PASSWORD_COST, salt, stored
+    parts = stored.split("$", 3)
+    if len(parts) != 4:
+        raise ValueError("Неверный формат хэша пароля")
+    scheme, cost, salt, digest = parts
+    return scheme, cost, salt, digest
+
+
+def calibrate_password_cost(scheme=DEFAULT_PASSWORD_SCHEME, target_seconds=0.1, samples=3):
+    """Подбор стоимости хэша, при которой одно хэширование занимает около target_seconds
+
+    Замер идет на текущей машине; для pbkdf2_sha256 число итераций
+    масштабируется линейно и округляется до тысяч, для scrypt n удваивается,
+    пока время не превысит цель (r=8, p=1). Возвращает словарь со схемой,
+    стоимостью и измеренным временем одного хэша.
+    """
+    normalize_password_cost(scheme)
+    salt = secrets.token_hex(16)
+
+    def measure(cost):
+        best = None
+        for _ in range(samples):
+            started = time.perf_counter()
+            _password_hash_hex("calibration-Password1", salt, scheme, cost)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    if scheme == "pbkdf2_sha256":
+        base = 10000
+        iterations = int(base * target_seconds / measure(str(base)))
+        cost = str(max(10000, round(iterations, -3)))
+    else:
+        n = 2 ** 12
+        while measure(f"{n * 2}:8:1") <= target_seconds:
+            n *= 2
+        cost = f"{n}:8:1"
+
+    return {"scheme": scheme, "cost": cost, "seconds": measure(cost)}
+
+
+class PasswordHasher:
+    """Пул для вычисления хэшей паролей вне вызывающего потока
+
+    executor - "thread" (hashlib отпускает GIL на время PBKDF2), "process"
+    или готовый Executor. max_concurrency ограничивает число задач,
+    переданных в пул одновременно; остальные ждут своей очереди.
+    """
+
+    def __init__(self, executor="thread", max_workers=None, max_concurrency=None):
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        self.max_workers = max_workers
+        self.max_concurrency = max_concurrency or max_workers * 2
+
+        if executor == "thread":
+            self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="password-hasher")
+        elif executor == "process":
+            self._executor = ProcessPoolExecutor(max_workers)
+        else:
+            self._executor = executor
+        self._owns_executor = isinstance(executor, str)
+
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._async_slots = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "errors": 0,
+            "waiting": 0,
+            "in_flight": 0,
+            "max_queue_depth": 0,
+            "wait_time": 0.0,
+            "run_time": 0.0,
+        }
+
+    def _enter(self, waited):
+        with self._lock:
+            self._stats["waiting"] -= 1
+            self._stats["in_flight"] += 1
+            self._stats["submitted"] += 1
+            self._stats["wait_time"] += waited
+            depth = self._queue_depth()
+            if depth > self._stats["max_queue_depth"]:
+                self._stats["max_queue_depth"] = depth
+
+    def _leave(self, elapsed, failed):
+        with self._lock:
+            self._stats["in_flight"] -= 1
+            self._stats["completed"] += 1
+            self._stats["run_time"] += elapsed
+            if failed:
+                self._stats["errors"] += 1
+
+    def _queue_depth(self):
+        # Ожидающие допуска плюс задачи, которым не хватило воркера
+        excess = max(0, self._stats["in_flight"] - self.max_workers)
+        return self._stats["waiting"] + excess
+
+    def run(self, fn, *args):
+        """Синхронное выполнение fn(*args) в пуле"""
+        with self._lock:
+            self._stats["waiting"] += 1
+        started = time.perf_counter()
+        self._slots.acquire()
+        self._enter(time.perf_counter() - started)
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = self._executor.submit(fn, *args).result()
+            failed = False
+            return result
+        finally:
+            self._slots.release()
+            self._leave(time.perf_counter() - started, failed)
+
+    async def run_async(self, fn, *args):
+        """Выполнение fn(*args) в пуле без блокировки цикла событий"""
+        loop = asyncio.get_running_loop()
+        slots = self._async_slots.get(loop)
+        if slots is None:
+            slots = self._async_slots[loop] = asyncio.Semaphore(self.max_concurrency)
+
+        with self._lock:
+            self._stats["waiting"] += 1
+        started = time.perf_counter()
+        async with slots:
+            self._enter(time.perf_counter() - started)
+            started = time.perf_counter()
+            failed = True
+            try:
+                result = await asyncio.wrap_future(self._executor.submit(fn, *args))
+                failed = False
+                return result
+            finally:
+                self._leave(time.perf_counter() - started, failed)
+
+    def stats(self):
+        """Метрики: очередь, задачи в работе, среднее время ожидания и расчета"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["queue_depth"] = self._queue_depth()
+        completed = stats["completed"]
+        stats["avg_wait_ms"] = stats["wait_time"] / completed * 1000 if completed else 0.0
+        stats["avg_run_ms"] = stats["run_time"] / completed * 1000 if completed else 0.0
+        return stats
+
+    def map(self, fn, *iterables):
+        """Параллельное выполнение fn над наборами аргументов (для массовых операций)"""
+        args = list(zip(*iterables))
+        if not args:
+            return []
+        # Процессам выгоднее отдавать задачи пачками
+        chunksize = max(1, len(args) // (self.max_workers * 4))
+        with self._lock:
+            self._stats["in_flight"] += len(args)
+            self._stats["submitted"] += len(args)
+        started = time.perf_counter()
+        failed = True
+        try:
+            if isinstance(self._executor, ProcessPoolExecutor):
+                results = list(self._executor.map(fn, *zip(*args), chunksize=chunksize))
+            else:
+                results = list(self._executor.map(fn, *zip(*args)))
+            failed = False
+            return results
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._stats["in_flight"] -= len(args)
+                self._stats["completed"] += len(args)
+                self._stats["run_time"] += elapsed
+                if failed:
+                    self._stats["errors"] += len(args)
+
+    def shutdown(self, wait=True):
+        if self._owns_executor:
+            self._executor.shutdown(wait=wait)
+
+
+class PeriodicTask:
+    """Фоновый поток, вызывающий fn() каждые interval секунд"""
+
+    def __init__(self, fn, interval, name="periodic-task"):
+        self.fn = fn
+        self.interval = interval
+        self.name = name
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {
+            "runs": 0,
+            "errors": 0,
+            "total_time": 0.0,
+            "last_run_at": None,
+            "last_duration": None,
+            "last_result": None,
+        }
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def run_once(self):
+        started = time.perf_counter()
+        result, failed = None, False
+        try:
+            result = self.fn()
+        except Exception as e:
+            failed = True
+            print(f"{self._thread.name} error: {e}")
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._stats["runs"] += 1
+            self._stats["errors"] += failed
+            self._stats["total_time"] += elapsed
+            self._stats["last_run_at"] = time.time()
+            self._stats["last_duration"] = elapsed
+            self._stats["last_result"] = result
+        return result
+
+    @property
+    def running(self):
+        return self._thread.is_alive() and not self._stop.is_set()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if threading.current_thread() is not self._thread:
+            self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+class SlidingWindowRateLimiter:
+    """Ограничитель частоты запросов в памяти процесса
+
+    Скользящее окно приближается двумя счетчиками (текущее и предыдущее
+    окно), поэтому проверка - O(1) по времени и памяти на ключ. Ключи,
+    к которым давно не обращались, вытесняются при превышении max_keys.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"allowed": 0, "rejected": 0, "evictions": 0}
+
+    @staticmethod
+    def _estimate(bucket, now, window):
+        """Сдвиг окна и оценка числа запросов за последние window секунд"""
+        window_start = now - now % window
+        if bucket[0] != window_start:
+            # Предыдущее окно учитывается, только если оно непосредственно перед текущим
+            bucket[2] = bucket[1] if window_start - bucket[0] == window else 0
+            bucket[1] = 0
+            bucket[0] = window_start
+        weight = 1 - (now - window_start) / window
+        return bucket[2] * weight + bucket[1]
+
+    def hit(self, key, limit, window):
+        """Учет запроса; False, если лимит limit за window секунд исчерпан"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [now - now % window, 0, 0]
+            else:
+                self._buckets.move_to_end(key)
+
+            if self._estimate(bucket, now, window) >= limit:
+                self._stats["rejected"] += 1
+                return False
+
+            bucket[1] += 1
+            self._stats["allowed"] += 1
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+                self._stats["evictions"] += 1
+            return True
+
+    def reset(self, key=None):
+        with self._lock:
+            if key is None:
+                self._buckets.clear()
+            else:
+                self._buckets.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["keys"] = len(self._buckets)
+        return stats
+
+
+class SQLiteRateLimiter(SlidingWindowRateLimiter):
+    """Тот же алгоритм со счетчиками в файле SQLite, общем для процессов-воркеров"""
+
+    def __init__(self, db_path, max_keys=100000, pool_size=5):
+        # Счетчики в файле, поэтому _buckets базового класса не нужны
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._stats = {"allowed": 0, "rejected": 0, "evictions": 0}
+        self.db_path = db_path
+        self.pool_size = pool_size
+        self._pool = None
+        self._hits_since_prune = 0
+        with self._connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS rate_limits (
+                    key TEXT PRIMARY KEY,
+                    window_start REAL NOT NULL,
+                    current INTEGER NOT NULL,
+                    previous INTEGER NOT NULL,
+                    touched REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_rate_limits_touched ON rate_limits(touched)')
+            conn.commit()
+
+    def _connection(self):
+        """Соединение из пула; после close() пул открывается заново при обращении"""
+        with self._lock:
+            if self._pool is None:
+                self._pool = ConnectionPool(
+                    self.db_path, size=self.pool_size,
+                    on_connect=lambda conn: apply_pragma_profile(conn, "bulk-load")
+                )
+            pool = self._pool
+        return pool.connection()
+
+    def hit(self, key, limit, window):
+        # Время общее для всех процессов, поэтому time.time(), а не monotonic
+        now = time.time()
+        key = "\x1f".join(map(str, key)) if isinstance(key, tuple) else str(key)
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT window_start, current, previous FROM rate_limits WHERE key = ?", (key,)
+                ).fetchone()
+                bucket = list(row) if row else [now - now % window, 0, 0]
+                allowed = self._estimate(bucket, now, window) < limit
+                if allowed:
+                    bucket[1] += 1
+                conn.execute('''
+                    INSERT OR REPLACE INTO rate_limits (key, window_start, current, previous, touched)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (key, bucket[0], bucket[1], bucket[2], now))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+        with self._lock:
+            self._stats["allowed" if allowed else "rejected"] += 1
+            self._hits_since_prune += 1
+            prune = self._hits_since_prune >= 1000
+            if prune:
+                self._hits_since_prune = 0
+        if prune:
+            self._prune()
+        return allowed
+
+    def _prune(self):
+        """Удаление самых давно не использованных ключей сверх max_keys"""
+        with self._connection() as conn:
+            with conn:
+                deleted = conn.execute('''
+                    DELETE FROM rate_limits WHERE key IN (
+                        SELECT key FROM rate_limits ORDER BY touched DESC LIMIT -1 OFFSET ?
+                    )
+                ''', (self.max_keys,)).rowcount
+        with self._lock:
+            self._stats["evictions"] += deleted
+
+    def reset(self, key=None):
+        with self._connection() as conn:
+            with conn:
+                if key is None:
+                    conn.execute("DELETE FROM rate_limits")
+                else:
+                    key = "\x1f".join(map(str, key)) if isinstance(key, tuple) else str(key)
+                    conn.execute("DELETE FROM rate_limits WHERE key = ?", (key,))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        with self._connection() as conn:
+            stats["keys"] = conn.execute("SELECT COUNT(*) FROM rate_limits").fetchone()[0]
+        return stats
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+
+
+class InvalidationChannel:
+    """Канал сброса кэшей между процессами через таблицу изменений SQLite
+
+    publish() добавляет запись (вид, ключ, значение); poll() возвращает
+    записи других процессов, появившиеся после предыдущего опроса.
+    Записи старше retention секунд удаляются при опросе раз в prune_every
+    вызовов. Новый канал начинает с текущего конца таблицы: кэши нового
+    процесса пусты, старые изменения ему не нужны.
+    """
+
+    def __init__(self, db_path, retention=600.0, prune_every=100):
+        self.db_path = db_path
+        self.retention = retention
+        self.prune_every = prune_every
+        self.origin = secrets.token_hex(8)
+        self._pool = None
+        self._lock = threading.Lock()
+        self._poll_lock = threading.Lock()
+        self._polls = 0
+        self._stats = {"published": 0, "received": 0, "polls": 0, "pruned": 0}
+
+        with self._connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS cache_changes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    origin TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    key TEXT,
+                    value TEXT,
+                    created REAL NOT NULL
+                )
+            ''')
+            conn.commit()
+            self._last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM cache_changes").fetchone()[0]
+
+    def _connection(self):
+        """Соединение из пула; после close() пул открывается заново при обращении"""
+        with self._lock:
+            if self._pool is None:
+                self._pool = ConnectionPool(
+                    self.db_path, size=2,
+                    on_connect=lambda conn: apply_pragma_profile(conn, "oltp")
+                )
+            pool = self._pool
+        return pool.connection()
+
+    def publish(self, kind, key=None, value=None):
+        with self._connection() as conn:
+            with conn:
+                conn.execute('''
+                    INSERT INTO cache_changes (origin, kind, key, value, created)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (self.origin, kind, key, value, time.time()))
+        with self._lock:
+            self._stats["published"] += 1
+
+    def poll(self):
+        """Изменения других процессов: список (вид, ключ, значение)"""
+        with self._poll_lock:
+            # Записи упорядочены по id: SQLite выполняет записи по одной
+            with self._connection() as conn:
+                rows = conn.execute('''
+                    SELECT id, origin, kind, key, value FROM cache_changes
+                    WHERE id > ? ORDER BY id
+                ''', (self._last_id,)).fetchall()
+            if rows:
+                self._last_id = rows[-1][0]
+
+            self._polls += 1
+            if self._polls % self.prune_every == 0:
+                self._prune()
+
+        changes = [(kind, key, value) for _, origin, kind, key, value in rows if origin != self.origin]
+        with self._lock:
+            self._stats["polls"] += 1
+            self._stats["received"] += len(changes)
+        return changes
+
+    def _prune(self):
+        with self._connection() as conn:
+            with conn:
+                pruned = conn.execute(
+                    "DELETE FROM cache_changes WHERE created < ?", (time.time() - self.retention,)
+                ).rowcount
+        with self._lock:
+            self._stats["pruned"] += pruned
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["last_id"] = self._last_id
+        return stats
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+
+
+class ReadSnapshot:
+    """Снимок файла БД только для чтения для отчетных запросов
+
+    refresh() копирует исходный файл через sqlite3 backup API в новый файл
+    <каталог>/<имя>.<время>.snapshot и переключает на него пул соединений
+    с профилем read-only-replica; начатые отчеты дочитывают прежний снимок.
+    Копирование идет одним шагом на отдельном соединении: в режиме WAL это
+    одна транзакция чтения, она не блокирует запись в исходный файл, а
+    снимок получается согласованным. Файл заменяется новым, а не
+    перезаписывается: у открытых соединений WAL свои файлы -wal и -shm.
+    Время снятия записывается в таблицу snapshot_meta самого снимка, поэтому
+    другие процессы подхватывают свежий снимок (adopt_latest) с его возрастом.
+    """
+
+    def __init__(self, source_path, directory, pool_size=2, keep=2):
+        self.source_path = source_path
+        self.directory = directory
+        self.pool_size = pool_size
+        self.keep = keep
+        self.name = os.path.basename(source_path)
+        self.path = None
+        self.taken_at = None
+        self._pool = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._stats = {"refreshes": 0, "adopted": 0, "failures": 0, "last_duration_s": 0.0}
+
+    @property
+    def age(self):
+        """Возраст снимка в секундах (None, если снимка нет)"""
+        return None if self.taken_at is None else max(0.0, time.time() - self.taken_at)
+
+    def _files(self):
+        """Файлы снимков этого источника, новые первыми"""
+        pattern = os.path.join(glob.escape(self.directory), glob.escape(self.name) + ".*.snapshot")
+        def generation(path):
+            stamp = os.path.basename(path)[len(self.name) + 1:-len(".snapshot")]
+            return int(stamp) if stamp.isdigit() else 0
+        return sorted(glob.glob(pattern), key=generation, reverse=True)
+
+    def refresh(self):
+        """Новый снимок исходного файла, возвращает его время"""
+        with self._refresh_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"{self.name}.{time.time_ns()}.snapshot")
+            started = time.perf_counter()
+            taken_at = time.time()
+            try:
+                source = sqlite3.connect(self.source_path, timeout=30.0)
+                try:
+                    target = sqlite3.connect(path)
+                    try:
+                        source.backup(target)
+                        target.execute("CREATE TABLE snapshot_meta (source TEXT, taken_at REAL)")
+                        target.execute("INSERT INTO snapshot_meta VALUES (?, ?)", (self.name, taken_at))
+                        target.commit()
+                    finally:
+                        target.close()
+                finally:
+                    source.close()
+            except sqlite3.Error:
+                self._remove(path)
+                with self._lock:
+                    self._stats["failures"] += 1
+                raise
+
+            self._install(path, taken_at)
+            with self._lock:
+                self._stats["refreshes"] += 1
+                self._stats["last_duration_s"] = round(time.perf_counter() - started, 4)
+            self._prune()
+            return taken_at
+
+    def adopt_latest(self):
+        """Переключение на более свежий снимок другого процесса; True, если он нашелся"""
+        for path in self._files():
+            if path == self.path:
+                return False
+            try:
+                conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+                try:
+                    taken_at = conn.execute("SELECT taken_at FROM snapshot_meta").fetchone()[0]
+                finally:
+                    conn.close()
+            except (sqlite3.Error, TypeError):
+                # Файл еще пишется или уже удален
+                continue
+            if self.taken_at is not None and taken_at <= self.taken_at:
+                return False
+            self._install(path, taken_at)
+            with self._lock:
+                self._stats["adopted"] += 1
+            return True
+        return False
+
+    def _install(self, path, taken_at):
+        pool = ConnectionPool(
+            path, size=self.pool_size,
+            on_connect=lambda conn: apply_pragma_profile(conn, "read-only-replica")
+        )
+        with self._lock:
+            old, self._pool = self._pool, pool
+            self.path = path
+            self.taken_at = taken_at
+        if old is not None:
+            old.close()
+
+    @staticmethod
+    def _remove(path):
+        for suffix in ("", "-wal", "-shm", "-journal"):
+            try:
+                os.remove(path + suffix)
+            except OSError:
+                pass
+
+    def _prune(self):
+        """Удаление старых снимков, кроме keep последних и текущего"""
+        for path in self._files()[self.keep:]:
+            if path != self.path:
+                self._remove(path)
+
+    @contextmanager
+    def connection(self):
+        """Соединение с текущим снимком"""
+        while True:
+            with self._lock:
+                pool = self._pool
+            if pool is None:
+                raise sqlite3.OperationalError(f"Нет снимка {self.name}")
+            try:
+                conn = pool.checkout()
+                break
+            except sqlite3.ProgrammingError:
+                # Пул закрыт при переключении на новый снимок
+                continue
+        try:
+            yield conn
+        finally:
+            pool.checkin(conn)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            path = self.path
+        stats["path"] = path
+        stats["taken_at"] = (datetime.fromtimestamp(self.taken_at).isoformat(timespec="seconds")
+                             if self.taken_at is not None else None)
+        age = self.age
+        stats["age_s"] = round(age, 1) if age is not None else None
+        try:
+            stats["size_bytes"] = os.path.getsize(path) if path else 0
+        except OSError:
+            stats["size_bytes"] = 0
+        return stats
+
+    def close(self, remove_files=False):
+        with self._lock:
+            pool, self._pool = self._pool, None
+            self.path = None
+            self.taken_at = None
+        if pool is not None:
+            pool.close()
+        if remove_files:
+            for path in self._files():
+                self._remove(path)
+
+
+# Лимиты по умолчанию: (число запросов, окно в минутах) с одного IP.
+# Рассчитаны на одного пользователя за адресом; за общим NAT (кампус,
+# общежитие) все делят один IP - для таких установок лимиты задаются
+# параметром rate_limits конструктора DatabaseManager
+RATE_LIMITS = {
+    "login": (20, 15),
+    "register": (5, 15),
+}
+
+# Ответы при превышении лимита (по ним API отличает отказ от ошибки данных)
+RATE_LIMIT_MESSAGES = {
+    "login": "Слишком много попыток входа. Попробуйте позже.",
+    "register": "Слишком много запросов. Попробуйте позже.",
+}
+
+
+class LRUCache:
+    """Потокобезопасный LRU-кэш с ограниченным временем жизни записей"""
+
+    _MISSING = object()
+
+    def __init__(self, max_size=1024, ttl=60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+        }
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, self._MISSING)
+            if entry is self._MISSING:
+                self._stats["misses"] += 1
+                return default
+            value, expires = entry
+            if expires is not None and expires <= now:
+                del self._data[key]
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return default
+            self._data.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def stamp(self):
+        """Метка для set(): запись не сохранится, если после метки была инвалидация"""
+        return self._generation
+
+    def set(self, key, value, ttl=None, stamp=None):
+        if ttl is None:
+            ttl = self.ttl
+        expires = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            if stamp is not None and stamp != self._generation:
+                return False
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self._stats["evictions"] += 1
+        return True
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            if self._data.pop(key, self._MISSING) is not self._MISSING:
+                self._stats["invalidations"] += 1
+
+    def discard_if(self, predicate):
+        """Удаление записей, для которых predicate(key, value) истинно"""
+        with self._lock:
+            self._generation += 1
+            doomed = [key for key, (value, _) in self._data.items() if predicate(key, value)]
+            for key in doomed:
+                del self._data[key]
+            self._stats["invalidations"] += len(doomed)
+        return len(doomed)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._stats["invalidations"] += len(self._data)
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._data)
+        stats["max_size"] = self.max_size
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+class RoleIndex:
+    """Роли пользователей в памяти: администраторы и старосты
+
+    Хранит только пользователей с ролями: email -> строка JSON прав для
+    администраторов и email -> кортеж групп для старост. Загружается
+    целиком (load) и обновляется точечно при назначении ролей. Загрузка,
+    начатая до очередного обновления, не устанавливается (счетчик поколений).
+    Роли, выданные другим процессом, видны только после перезагрузки:
+    через max_age секунд после load индекс считается незагруженным
+    (None - без срока, если изменения приходят по каналу сброса кэшей).
+    """
+
+    def __init__(self, max_age=None):
+        self.max_age = max_age
+        self._admins = {}
+        self._leaders = {}
+        self._loaded = False
+        self._loaded_at = None
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "loads": 0, "updates": 0}
+
+    @property
+    def loaded(self):
+        if self.max_age is not None and self._loaded:
+            return time.monotonic() - self._loaded_at < self.max_age
+        return self._loaded
+
+    @property
+    def generation(self):
+        return self._generation
+
+    @staticmethod
+    def record(permissions_json, groups):
+        """Словарь ролей одного пользователя"""
+        return {
+            "is_admin": permissions_json is not None,
+            "permissions": json.loads(permissions_json or "{}") if permissions_json is not None else None,
+            "is_leader": bool(groups),
+            "led_groups": sorted(groups),
+        }
+
+    def load(self, admins, leaders, generation):
+        """Установка ролей из строк (email, permissions_json) и (email, group_id)
+
+        Возвращает False, если с момента generation роли менялись.
+        """
+        admin_map = {email: permissions_json or "{}" for email, permissions_json in admins}
+        leader_map = {}
+        for email, group_id in leaders:
+            leader_map.setdefault(email, []).append(group_id)
+        leader_map = {email: tuple(groups) for email, groups in leader_map.items()}
+
+        with self._lock:
+            if generation != self._generation:
+                return False
+            self._admins = admin_map
+            self._leaders = leader_map
+            self._loaded = True
+            self._loaded_at = time.monotonic()
+            self._stats["loads"] += 1
+        return True
+
+    def set_admin(self, email, permissions_json):
+        with self._lock:
+            self._generation += 1
+            self._stats["updates"] += 1
+            if self._loaded:
+                self._admins[email] = permissions_json or "{}"
+
+    def add_leader(self, email, group_id):
+        with self._lock:
+            self._generation += 1
+            self._stats["updates"] += 1
+            if self._loaded:
+                groups = self._leaders.get(email, ())
+                if group_id not in groups:
+                    self._leaders[email] = groups + (group_id,)
+
+    def invalidate(self):
+        """Сброс: следующее обращение загрузит роли заново"""
+        with self._lock:
+            self._generation += 1
+            self._loaded = False
+            self._admins = {}
+            self._leaders = {}
+
+    def lookup(self, emails):
+        with self._lock:
+            self._stats["lookups"] += len(emails)
+            found = [(email, self._admins.get(email), self._leaders.get(email, ())) for email in emails]
+        return {email: self.record(permissions_json, groups) for email, permissions_json, groups in found}
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["loaded"] = self._loaded
+            stats["admins"] = len(self._admins)
+            stats["leaders"] = len(self._leaders)
+        return stats
+
+
+_WORD_START = re.compile(r"\s+(?=\S)")
+
+
+def _word_offsets(text):
+    """Позиции начала слов text, кроме первого"""
+    return [match.end() for match in _WORD_START.finditer(text)] if text else []
+
+
+class _DirectoryEntry:
+    __slots__ = ("email", "nickname", "full_name")
+
+    def __init__(self, email, nickname, full_name):
+        self.email = email
+        self.nickname = nickname
+        self.full_name = full_name
+
+
+class UserDirectory:
+    """Справочник пользователей в памяти для поиска по префиксу
+
+    Записи __slots__ (email, nickname, full_name) хранятся в трех списках,
+    отсортированных по ключу _fold_name своего поля; запись по email
+    находится бинарным поиском в списке email. Чтобы фамилия находилась
+    внутри полного имени, для каждого слова full_name после первого есть
+    пара (запись, позиция слова) в отдельном списке, отсортированном по
+    остатку имени с этой позиции. Свернутые ключи не хранятся, а
+    вычисляются при поиске (bisect с key), поэтому на пользователя
+    приходятся только исходные строки, запись, три ссылки и пара на
+    каждое следующее слово имени: около 425 байт при кириллических именах
+    из двух слов, бюджет - 450 байт, т.е. до 450 МБ на 1 млн пользователей
+    (benchmarks/bench_user_directory.py).
+    Вставка в середину списков - O(n): около 3 мс на 1 млн, для
+    регистраций по одной этого достаточно.
+    """
+
+    FIELDS = ("nickname", "email", "full_name")
+    BYTES_PER_USER_BUDGET = 450
+
+    _KEYS = {field: (lambda entry, field=field: _fold_name(getattr(entry, field))) for field in FIELDS}
+
+    @staticmethod
+    def _word_key(item):
+        entry, offset = item
+        return _fold_name(entry.full_name[offset:])
+
+    def __init__(self):
+        self._sorted = {field: [] for field in self.FIELDS}
+        self._words = []
+        self._loaded = False
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._stats = {"searches": 0, "loads": 0, "updates": 0}
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def load(self, rows, generation):
+        """Установка справочника из строк (email, nickname, full_name)
+
+        Возвращает False, если с момента generation справочник менялся.
+        """
+        entries = [_DirectoryEntry(email, nickname, full_name) for email, nickname, full_name in rows]
+        ordered = {field: sorted(entries, key=key) for field, key in self._KEYS.items()}
+        words = sorted(((entry, offset) for entry in entries for offset in _word_offsets(entry.full_name)),
+                       key=self._word_key)
+        with self._lock:
+            if generation != self._generation:
+                return False
+            self._sorted = ordered
+            self._words = words
+            self._loaded = True
+            self._stats["loads"] += 1
+        return True
+
+    def _find(self, email):
+        ordered = self._sorted["email"]
+        key = self._KEYS["email"]
+        folded = _fold_name(email)
+        index = bisect.bisect_left(ordered, folded, key=key)
+        while index < len(ordered) and key(ordered[index]) == folded:
+            if ordered[index].email == email:
+                return ordered[index]
+            index += 1
+        return None
+
+    def _insert(self, entry):
+        for field, key in self._KEYS.items():
+            bisect.insort(self._sorted[field], entry, key=key)
+        for offset in _word_offsets(entry.full_name):
+            bisect.insort(self._words, (entry, offset), key=self._word_key)
+
+    def _remove(self, entry):
+        for field, key in self._KEYS.items():
+            ordered = self._sorted[field]
+            index = bisect.bisect_left(ordered, key(entry), key=key)
+            # Одинаковые ключи (например, полные имена) идут подряд
+            while ordered[index] is not entry:
+                index += 1
+            del ordered[index]
+        for offset in _word_offsets(entry.full_name):
+            index = bisect.bisect_left(self._words, self._word_key((entry, offset)), key=self._word_key)
+            while self._words[index][0] is not entry:
+                index += 1
+            del self._words[index]
+
+    def put(self, email, nickname, full_name):
+        """Добавление или обновление пользователя"""
+        with self._lock:
+            self._generation += 1
+            self._stats["updates"] += 1
+            if not self._loaded:
+                return
+            entry = self._find(email)
+            if entry is not None:
+                if entry.nickname == nickname and entry.full_name == full_name:
+                    return
+                self._remove(entry)
+            self._insert(_DirectoryEntry(email, nickname, full_name))
+
+    def remove(self, email):
+        with self._lock:
+            self._generation += 1
+            self._stats["updates"] += 1
+            entry = self._find(email) if self._loaded else None
+            if entry is not None:
+                self._remove(entry)
+
+    def invalidate(self):
+        """Сброс: следующее обращение загрузит справочник заново"""
+        with self._lock:
+            self._generation += 1
+            self._loaded = False
+            self._sorted = {field: [] for field in self.FIELDS}
+            self._words = []
+
+    @staticmethod
+    def _scan(ordered, key, folded, found, limit):
+        index = bisect.bisect_left(ordered, folded, key=key)
+        while index < len(ordered) and len(found) < limit:
+            item = ordered[index]
+            if not key(item).startswith(folded):
+                break
+            entry = item[0] if isinstance(item, tuple) else item
+            found.setdefault(entry.email, entry)
+            index += 1
+
+    def search(self, prefix, fields=None, limit=20):
+        """Пользователи, у которых одно из полей fields начинается с prefix
+
+        full_name совпадает и по началу любого слова: сначала идут имена,
+        начинающиеся с prefix, затем совпавшие по следующим словам.
+        Результаты идут по полям в порядке fields, внутри поля - по
+        алфавиту, без повторов; не больше limit записей.
+        """
+        folded = _fold_name(prefix)
+        found = {}
+        with self._lock:
+            self._stats["searches"] += 1
+            for field in fields or self.FIELDS:
+                self._scan(self._sorted[field], self._KEYS[field], folded, found, limit)
+                if field == "full_name":
+                    self._scan(self._words, self._word_key, folded, found, limit)
+        return [
+            {"email": entry.email, "nickname": entry.nickname, "full_name": entry.full_name}
+            for entry in found.values()
+        ]
+
+    def __len__(self):
+        return len(self._sorted["email"])
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["loaded"] = self._loaded
+            stats["users"] = len(self._sorted["email"])
+        return stats
+
+
+class StatementStats:
+    """Счетчики именованных запросов: вызовы, суммарное и максимальное время, строки, ошибки"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def record(self, name, elapsed, rows, failed=False):
+        with self._lock:
+            entry = self._data.get(name)
+            if entry is None:
+                entry = self._data[name] = [0, 0.0, 0.0, 0, 0]
+            entry[0] += 1
+            entry[1] += elapsed
+            if elapsed > entry[2]:
+                entry[2] = elapsed
+            entry[3] += rows
+            if failed:
+                entry[4] += 1
+
+    def reset(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """Счетчики по именам, по убыванию суммарного времени"""
+        with self._lock:
+            items = [(name, list(entry)) for name, entry in self._data.items()]
+        items.sort(key=lambda item: item[1][1], reverse=True)
+        return {
+            name: {
+                "calls": calls,
+                "total_ms": round(total * 1000, 3),
+                "mean_ms": round(total * 1000 / calls, 4),
+                "max_ms": round(longest * 1000, 3),
+                "rows": rows,
+                "errors": errors,
+            }
+            for name, (calls, total, longest, rows, errors) in items
+        }
+
 
 class DatabaseManager:
-    def __init__(self, db_dir="databases"):
+    # Отрицательная запись кэша сессий
+    _NO_SESSION = object()
+    
+    # Компоненты файлов БД, схема которых уже проверена в этом процессе
+    _migrated = set()
+    _migrated_lock = threading.Lock()
+    
+    def __init__(self, db_dir="databases", pool_size=5, pool_timeout=10.0, pragma_profiles=None,
+                 async_security_log=True, security_log_options=None, password_hasher=None,
+                 profile_cache_size=10000, profile_cache_ttl=30.0,
+                 session_cache_size=100000, session_cache_ttl=60.0, session_negative_ttl=5.0,
+                 storage="split", rate_limiter="memory",
+                 password_scheme=DEFAULT_PASSWORD_SCHEME, password_cost=None,
+                 role_index=True, user_directory=True, seed_demo_data=False, statement_cache_size=256,
+                 invalidation=None, invalidation_interval=0.25,
+                 report_snapshots=True, snapshot_max_age=300.0, snapshot_interval=None,
+                 role_index_ttl=5.0, rate_limits=None):
         self.db_dir = db_dir
         if not os.path.exists(db_dir):
             os.makedirs(db_dir)
         
-        self.conns = {}
-        self.init_databases()
+        if storage not in STORAGE_MODES:
+            raise ValueError(f"Неизвестный режим хранения: {storage}")
+        self.storage = storage
+        
+        # Профиль PRAGMA для каждого файла: умолчания + переопределения
+        self.pragma_profiles = dict(DEFAULT_DB_PROFILES)
+        self.pragma_profiles.update(pragma_profiles or {})
+        for profile in self.pragma_profiles.values():
+            if isinstance(profile, str) and profile not in PRAGMA_PROFILES:
+                raise ValueError(f"Неизвестный профиль PRAGMA: {profile}")
+        
+        self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        
+        # Кэш подготовленных запросов на соединение (у sqlite3 по умолчанию 128)
+        # и счетчики именованных запросов из QUERIES
+        self.statement_cache_size = max(statement_cache_size, len(QUERIES))
+        self._statement_stats = StatementStats()
+        self.pools = {}
+        self._pools_lock = threading.Lock()
+        
+        # Журнал безопасности пишется фоновым потоком пачками
+        self.async_security_log = async_security_log
+        self.security_log_options = dict(security_log_options or {})
+        self._security_log_writer = None
+        self._security_log_lock = threading.Lock()
+        
+        # Схема и стоимость для новых хэшей; старые пересчитываются при входе
+        self.password_scheme = password_scheme
+        self.password_cost = normalize_password_cost(password_scheme, password_cost)
+        
+        # Пул хэширования для асинхронного API: PasswordHasher или
+        # словарь параметров для него; создается при первом обращении
+        self._password_hasher = password_hasher
+        self._password_hasher_lock = threading.Lock()
+        
+        # Ограничитель запросов: "memory" - в процессе, "sqlite" - общий
+        # для процессов файл rate_limits.db, None - без ограничений.
+        # rate_limits - {действие: (запросов, минут)} поверх RATE_LIMITS
+        self.rate_limits = {**RATE_LIMITS, **(rate_limits or {})}
+        if rate_limiter == "memory":
+            rate_limiter = SlidingWindowRateLimiter()
+        elif rate_limiter == "sqlite":
+            rate_limiter = SQLiteRateLimiter(os.path.join(db_dir, "rate_limits.db"))
+        self.rate_limiter = rate_limiter
+        
+        # Роли в памяти для get_roles, is_admin, is_group_leader; None - всегда из БД.
+        # Роли из других процессов (CLI, воркеры) видны не позже чем через
+        # role_index_ttl секунд; None - без срока, только с каналом invalidation
+        self._role_index = RoleIndex(role_index_ttl) if role_index else None
+        
+        # Справочник для search_users; загружается при первом поиске
+        self._user_directory = UserDirectory() if user_directory else None
+        
+        # Кэш собранных профилей get_user_info. Запись сбрасывают изменения
+        # этого процесса (и других - только через канал invalidation), поэтому
+        # без канала при нескольких процессах profile_cache_ttl - предел
+        # устаревания профиля; не делайте его большим или нулевым (без срока)
+        self.profile_cache = LRUCache(profile_cache_size, profile_cache_ttl)
+        
+        # Кэш сессий по хэшу токена; промахи кэшируются на session_negative_ttl
+        self.session_cache = LRUCache(session_cache_size, session_cache_ttl)
+        self.session_negative_ttl = session_negative_ttl
+        
+        # Фоновая очистка сессий (start_session_sweeper)
+        self._session_sweeper = None
+        self._session_sweep_stats = {
+            "runs": 0,
+            "expired_purged": 0,
+            "revoked_purged": 0,
+            "vacuumed_pages": 0,
+            "time_spent": 0.0,
+        }
+        self._session_sweep_lock = threading.Lock()
+        
+        # Архив журнала безопасности: помесячные файлы .jsonl.gz
+        self.archive_dir = os.path.join(db_dir, "archive")
+        self._log_archiver = None
+        self._log_archive_lock = threading.Lock()
+        
+        # Сброс кэшей между процессами-воркерами: "sqlite" - таблица изменений
+        # в cache_changes.db, которую каждый процесс опрашивает раз в
+        # invalidation_interval секунд (столько же кэши могут быть устаревшими)
+        if invalidation == "sqlite":
+            invalidation = InvalidationChannel(os.path.join(db_dir, "cache_changes.db"))
+        self._invalidation = invalidation
+        self.invalidation_interval = invalidation_interval
+        self._invalidation_listener = None
+        if invalidation is not None:
+            self.start_invalidation_listener(invalidation_interval)
+        
+        # Снимки для отчетов (REPORT_QUERIES) в db_dir/snapshots: снимок старше
+        # snapshot_max_age секунд обновляется перед отчетом, а при заданном
+        # snapshot_interval - еще и фоновой задачей. False - отчеты по рабочим файлам
+        self.report_snapshots = report_snapshots
+        self.snapshot_max_age = snapshot_max_age
+        self.snapshot_dir = os.path.join(db_dir, "snapshots")
+        self._snapshots = {}
+        self._snapshots_lock = threading.Lock()
+        self._snapshot_refresher = None
+        if report_snapshots and snapshot_interval:
+            self.start_snapshot_refresher(snapshot_interval)
+        
+        # Схема проверяется при первом обращении к файлу БД (get_pool):
+        # конструктор не открывает соединений и не пишет в базу
+        self._schema_ready = set()
+        
+        if seed_demo_data:
+            self.create_demo_data()
         # XSS Protection - sanitize all inputs
 
     @staticmethod
@@ -34,23 +2458,25 @@ class DatabaseManager:
         # Remove HTML tags
         sanitized = html.escape(sanitized)
         
-        # Remove SQL injection patterns
-        sql_patterns = [
-            r'(\s*;\s*|\s*--\s*|\s*/\*\s*|\s*\*/\s*|\s*union\s+select\s*|\s*drop\s+table\s*|\s*delete\s+from\s*|\s*insert\s+into\s*|\s*update\s+set\s*)',
-            r'(\s*or\s+1\s*=\s*1\s*|\s*and\s+1\s*=\s*1\s*)',
-            r'(\s*exec\s*\(|\s*xp_cmdshell\s*)',
-            r'(\s*<script\b[^>]*>.*?</script\s*>|\s*javascript:|\s*on\w+\s*=)',
-            r'(\s*alert\s*\(|\s*prompt\s*\(|\s*confirm\s*\()'
-        ]
-        
-        for pattern in sql_patterns:
-            sanitized = re.sub(pattern, '', sanitized, flags=re.IGNORECASE)
+        # Remove SQL injection patterns. Шаблоны применяются по очереди, как
+        # и раньше (удаление одного может открыть совпадение для следующего),
+        # но только если общая альтернатива нашла хоть одно совпадение
+        if _SANITIZE_ANY.search(sanitized):
+            for pattern in _SANITIZE_PATTERNS:
+                sanitized = pattern.sub('', sanitized)
         
         # Remove control characters
-        sanitized = ''.join(char for char in sanitized if ord(char) >= 32)
+        if _CONTROL_CHARS_RE.search(sanitized):
+            sanitized = sanitized.translate(_CONTROL_CHARS)
         
         return sanitized.strip()
     
+    @staticmethod
+    def sanitize_many(values, max_length=255):
+        """Очистка набора значений (для массовых операций)"""
+        sanitize = DatabaseManager.sanitize_input
+        return [sanitize(value, max_length) for value in values]
+    
     # Email validation
     @staticmethod
     def validate_email(email):
@@ -85,61 +2511,195 @@ class DatabaseManager:
         """Генерация безопасного токена сессии"""
         return secrets.token_urlsafe(32)
     
-    # Rate limiting (simplified)
-    @staticmethod
-    def check_rate_limit(ip_address, action, limit=5, window_minutes=15):
-        """Проверка ограничения запросов"""
-        # В реальном приложении здесь была бы проверка в Redis/Memcached
-        # Для демо всегда возвращаем True
-        return True
+    # Rate limiting
+    def check_rate_limit(self, ip_address, action, limit=None, window_minutes=None):
+        """Проверка ограничения запросов
+        
+        Лимит по умолчанию берется из rate_limits конструктора (RATE_LIMITS,
+        иначе 5 запросов за 15 минут). Вызовы без IP (консоль, внутренние
+        операции) не ограничиваются.
+        """
+        if not ip_address or self.rate_limiter is None:
+            return True
+        
+        default_limit, default_window = self.rate_limits.get(action, (5, 15))
+        if limit is None:
+            limit = default_limit
+        if window_minutes is None:
+            window_minutes = default_window
+        
+        return self.rate_limiter.hit((ip_address, action), limit, window_minutes * 60)
+    
+    def rate_limit_stats(self):
+        """Счетчики ограничителя запросов: пропущено, отклонено, ключей в памяти"""
+        return self.rate_limiter.stats() if self.rate_limiter is not None else {}
+    
+    @property
+    def joins_available(self):
+        """Доступны ли все таблицы через одно соединение users_quick.db"""
+        return self.storage != "split"
+    
+    def _physical_name(self, db_name):
+        """Файл, в котором в текущем режиме хранения лежат таблицы db_name"""
+        if self.storage == "unified" and db_name in DB_TABLES:
+            return UNIFIED_DB_NAME
+        return db_name
+    
+    def _configure_connection(self, db_name, conn):
+        """Настройка нового соединения пула"""
+        # Включаем foreign keys
+        conn.execute("PRAGMA foreign_keys = ON")
+        
+        # Журнал, синхронизация, кэш и прочее - по профилю файла
+        apply_pragma_profile(conn, self.pragma_profiles.get(db_name, "oltp"))
+        
+        # Основное соединение в режиме attached видит все файлы
+        if self.storage == "attached" and db_name == "users_quick.db":
+            for other in DB_TABLES:
+                if other == db_name:
+                    continue
+                schema = other[:-len(".db")]
+                conn.execute("ATTACH DATABASE ? AS " + schema, (os.path.join(self.db_dir, other),))
+                apply_pragma_profile(conn, self.pragma_profiles.get(other, "oltp"), schema=schema)
+    
+    def get_pool(self, db_name):
+        """Пул соединений для файла БД (создается при первом обращении)
+        
+        При первом обращении к файлу его схема приводится к последней версии.
+        """
+        db_name = self._physical_name(db_name)
+        pool = self._open_pool(db_name)
+        if db_name not in self._schema_ready:
+            self._ensure_schema(db_name)
+        return pool
+    
+    def _open_pool(self, db_name):
+        """Пул соединений физического файла без проверки схемы"""
+        pool = self.pools.get(db_name)
+        if pool is not None:
+            return pool
+        
+        # Проверяем путь к файлу
+        if '..' in db_name or '/' in db_name or '\\' in db_name:
+            raise ValueError("Недопустимое имя базы данных")
+        
+        with self._pools_lock:
+            if db_name not in self.pools:
+                self.pools[db_name] = ConnectionPool(
+                    os.path.join(self.db_dir, db_name),
+                    size=self.pool_size,
+                    timeout=self.pool_timeout,
+                    cached_statements=self.statement_cache_size,
+                    on_connect=lambda conn, name=db_name: self._configure_connection(name, conn)
+                )
+            return self.pools[db_name]
+    
+    def connection(self, db_name, timeout=None):
+        """Контекстный менеджер: соединение из пула на время блока"""
+        return self.get_pool(db_name).connection(timeout)
     
     def get_connection(self, db_name):
-        """Безопасное получение соединения с БД"""
-        if db_name not in self.conns:
-            db_path = os.path.join(self.db_dir, db_name)
-            
-            # Проверяем путь к файлу
-            if '..' in db_name or '/' in db_name or '\\' in db_name:
-                raise ValueError("Недопустимое имя базы данных")
-            
-            self.conns[db_name] = sqlite3.connect(db_path)
-            self.conns[db_name].row_factory = sqlite3.Row
-            
-            # Включаем foreign keys
-            self.conns[db_name].execute("PRAGMA foreign_keys = ON")
-            
-            # Устанавливаем безопасные настройки
-            self.conns[db_name].execute("PRAGMA secure_delete = ON")
+        """Безопасное получение соединения с БД
+        
+        Внутри блока connection() возвращает уже выданное потоку соединение.
+        Иначе соединение закрепляется за потоком до release_connections()
+        и занимает место в пуле - такой вызов устарел, используйте connection().
+        """
+        pool = self.get_pool(db_name)
+        conn = pool.current()
+        if conn is None:
+            warnings.warn(
+                "get_connection() вне блока connection() занимает соединение пула "
+                "до release_connections(); используйте 'with db.connection(db_name)'",
+                DeprecationWarning, stacklevel=2)
+            conn = pool.checkout()
+        return conn
+    
+    def release_connections(self):
+        """Возврат в пулы всех соединений, закрепленных за текущим потоком"""
+        for pool in list(self.pools.values()):
+            pool.release()
+    
+    def pool_stats(self):
+        """Статистика пулов соединений по файлам БД"""
+        return {db_name: pool.stats() for db_name, pool in list(self.pools.items())}
+    
+    def get_password_hasher(self):
+        """Пул хэширования паролей для асинхронного API"""
+        hasher = self._password_hasher
+        if isinstance(hasher, PasswordHasher):
+            return hasher
+        with self._password_hasher_lock:
+            if not isinstance(self._password_hasher, PasswordHasher):
+                self._password_hasher = PasswordHasher(**(self._password_hasher or {}))
+            return self._password_hasher
+    
+    def password_hasher_stats(self):
+        """Метрики пула хэширования паролей"""
+        hasher = self._password_hasher
+        return hasher.stats() if isinstance(hasher, PasswordHasher) else {}
+    
+    def close(self):
+        """Закрытие всех соединений"""
+        # Останавливаем фоновые задачи
+        self.stop_session_sweeper()
+        self.stop_log_archiver()
+        self.stop_invalidation_listener()
+        if self._invalidation is not None:
+            self._invalidation.close()
+        self.stop_snapshot_refresher()
+        with self._snapshots_lock:
+            snapshots = list(self._snapshots.values())
+        for snapshot in snapshots:
+            snapshot.close()
         
-        return self.conns[db_name]
+        # Сначала дописываем журнал безопасности, пока соединения доступны
+        writer = self._security_log_writer
+        if writer is not None:
+            writer.close()
+        
+        self.release_connections()
+        if hasattr(self.rate_limiter, "close"):
+            self.rate_limiter.close()
+        with self._pools_lock:
+            pools, self.pools = self.pools, {}
+        for pool in pools.values():
+            pool.close()
     
     def safe_execute(self, db_name, query, params=()):
-        """Безопасное выполнение SQL запроса с параметрами"""
-        conn = self.get_connection(db_name)
-        cursor = conn.cursor()
+        """Безопасное выполнение SQL запроса с параметрами
         
-        try:
-            # Используем параметризованные запросы для защиты от SQL инъекций
-            cursor.execute(query, params)
-            conn.commit()
-            return cursor
-        except sqlite3.Error as e:
-            conn.rollback()
-            # Логируем ошибку без деталей для безопасности
-            print(f"Database error: {e}")
-            raise
+        Результат SELECT нужно читать внутри блока connection() того же
+        файла БД: вне его соединение возвращается в пул сразу после запроса.
+        """
+        with self.connection(db_name) as conn:
+            cursor = conn.cursor()
+            
+            try:
+                # Используем параметризованные запросы для защиты от SQL инъекций
+                cursor.execute(query, params)
+                conn.commit()
+                return cursor
+            except sqlite3.Error as e:
+                conn.rollback()
+                # Логируем ошибку без деталей для безопасности
+                print(f"Database error: {e}")
+                raise
     
     # Остальные методы остаются, но используют safe_execute
-    def register_user(self, email, password, nickname, full_name=None, group_id=None, ip_address=None):
-        """Безопасная регистрация пользователя"""
+    def _prepare_registration(self, email, password, nickname, full_name, ip_address):
+        """Проверки регистрации до хэширования пароля
         
+        Возвращает (ошибка, email, nickname, full_name); ошибка None, если
+        регистрацию можно продолжать.
+        """
         # Проверка rate limiting
         if not self.check_rate_limit(ip_address, "register"):
-            return False, "Слишком много запросов. Попробуйте позже."
+            return RATE_LIMIT_MESSAGES["register"], email, nickname, full_name
         
         # Валидация и очистка данных
         if not self.validate_email(email):
-            return False, "Неверный формат email"
+            return "Неверный формат email", email, nickname, full_name
         
         email = email.lower().strip()
         email = self.sanitize_input(email, 100)
@@ -152,55 +2712,60 @@ class DatabaseManager:
         # Валидация пароля
         is_valid, msg = self.validate_password(password)
         if not is_valid:
-            return False, msg
+            return msg, email, nickname, full_name
         
         # Проверяем существование email (параметризованный запрос)
         try:
-            cursor = self.safe_execute("users_quick.db", 
-                "SELECT email FROM users_quick WHERE email = ?", (email,))
-            
-            if cursor.fetchone():
-                return False, "Пользователь с таким email уже существует"
+            if self.query_one("users.email_exists", (email,)):
+                return "Пользователь с таким email уже существует", email, nickname, full_name
         except:
-            return False, "Ошибка базы данных"
+            return "Ошибка базы данных", email, nickname, full_name
         
         # Проверяем существование никнейма
         try:
-            cursor = self.safe_execute("users_full.db",
-                "SELECT nickname FROM users_full WHERE nickname = ?", (nickname,))
-            
-            if cursor.fetchone():
-                return False, "Пользователь с таким никнеймом уже существует"
+            if self.query_one("users.nickname_exists", (nickname,)):
+                return "Пользователь с таким никнеймом уже существует", email, nickname, full_name
         except:
-            return False, "Ошибка базы данных"
-        
-        # Хэшируем пароль с солью
-        salt = secrets.token_hex(16)
-        password_hash, _ = self.hash_password(password, salt)
+            return "Ошибка базы данных", email, nickname, full_name
         
+        return None, email, nickname, full_name
+    
+    def _store_registration(self, email, password_hash, salt, nickname, full_name, group_id, ip_address):
+        """Запись нового пользователя после хэширования пароля"""
         # Добавляем в базы данных
         try:
-            # Начинаем транзакцию
-            quick_conn = self.get_connection("users_quick.db")
-            full_conn = self.get_connection("users_full.db")
-            
-            # Используем контекстный менеджер для транзакций
-            with quick_conn:
-                quick_conn.execute('''
-                    INSERT INTO users_quick (email, password_hash, salt)
-                    VALUES (?, ?, ?)
-                ''', (email, password_hash, salt))
-            
-            with full_conn:
-                full_conn.execute('''
-                    INSERT INTO users_full (email, nickname, full_name)
-                    VALUES (?, ?, ?)
-                ''', (email, nickname, full_name or nickname))
-            
-            # Если указана группа
             if group_id:
                 group_id = self.sanitize_input(group_id, 50)
-                self.add_user_to_group(email, group_id)
+            
+            if self.joins_available:
+                # Все таблицы видны через одно соединение: одна транзакция
+                self._write_import_batch([{
+                    "email": email, "password_hash": password_hash, "salt": salt,
+                    "nickname": nickname, "full_name": full_name, "group_id": group_id,
+                }])
+                self.invalidate_user_info(email)
+            else:
+                # Начинаем транзакцию
+                with self.connection("users_quick.db") as quick_conn, \
+                        self.connection("users_full.db") as full_conn:
+                    
+                    # Используем контекстный менеджер для транзакций
+                    with quick_conn:
+                        quick_conn.execute('''
+                            INSERT INTO users_quick (email, password_hash, salt)
+                            VALUES (?, ?, ?)
+                        ''', (email, password_hash, salt))
+                    
+                    with full_conn:
+                        full_conn.execute('''
+                            INSERT INTO users_full (email, nickname, full_name)
+                            VALUES (?, ?, ?)
+                        ''', (email, nickname, full_name or nickname))
+                
+                # Если указана группа
+                if group_id:
+                    self.add_user_to_group(email, group_id)
+                self._directory_added([(email, nickname, full_name or nickname)])
             
             # Логируем регистрацию (без паролей!)
             self.log_security_event(ip_address, "register", email, success=True)
@@ -212,12 +2777,298 @@ class DatabaseManager:
             self.log_security_event(ip_address, "register", email, success=False, error=str(e))
             return False, f"Ошибка регистрации"
     
-    def authenticate_user(self, email, password, ip_address=None):
-        """Безопасная аутентификация пользователя"""
+    def register_user(self, email, password, nickname, full_name=None, group_id=None, ip_address=None):
+        """Безопасная регистрация пользователя"""
+        error, email, nickname, full_name = self._prepare_registration(
+            email, password, nickname, full_name, ip_address)
+        if error:
+            return False, error
+        
+        # Хэшируем пароль с солью
+        salt = secrets.token_hex(16)
+        password_hash, _ = self.make_password_hash(password, salt)
+        
+        return self._store_registration(email, password_hash, salt, nickname, full_name, group_id, ip_address)
+    
+    async def register_user_async(self, email, password, nickname, full_name=None, group_id=None, ip_address=None):
+        """Регистрация без блокировки цикла событий: хэш считается в пуле хэширования"""
+        loop = asyncio.get_running_loop()
+        error, email, nickname, full_name = await loop.run_in_executor(
+            None, self._prepare_registration, email, password, nickname, full_name, ip_address)
+        if error:
+            return False, error
+        
+        salt = secrets.token_hex(16)
+        digest = await self.get_password_hasher().run_async(
+            _password_hash_hex, password, salt, self.password_scheme, self.password_cost)
+        password_hash = encode_password_hash(self.password_scheme, self.password_cost, salt, digest)
+        
+        return await loop.run_in_executor(
+            None, self._store_registration,
+            email, password_hash, salt, nickname, full_name, group_id, ip_address)
+    
+    # Массовый импорт пользователей
+    @staticmethod
+    def _iter_import_rows(source, fmt=None):
+        """Построчное чтение CSV/JSONL: (номер строки, словарь или текст ошибки)"""
+        if isinstance(source, (str, os.PathLike)):
+            path = os.fspath(source)
+            if fmt is None:
+                fmt = "jsonl" if path.lower().endswith((".jsonl", ".ndjson", ".json")) else "csv"
+            with open(path, encoding="utf-8-sig", newline="") as f:
+                yield from DatabaseManager._iter_import_rows(f, fmt)
+            return
+        
+        if fmt == "csv":
+            reader = csv.DictReader(source)
+            for row in reader:
+                yield reader.line_num, row
+        elif fmt == "jsonl":
+            for line_num, line in enumerate(source, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    yield line_num, "Некорректный JSON"
+                    continue
+                yield line_num, row if isinstance(row, dict) else "Ожидался JSON-объект"
+        elif fmt is None:
+            # Уже разобранные записи (словари)
+            for line_num, row in enumerate(source, 1):
+                yield line_num, row
+        else:
+            raise ValueError(f"Неизвестный формат импорта: {fmt}")
+    
+    def _existing_keys(self, db_name, table, column, values):
+        """Какие из values уже есть в столбце таблицы (запросы по 500 значений)"""
+        found = set()
+        values = list(values)
+        with self.connection(db_name) as conn:
+            for start in range(0, len(values), 500):
+                chunk = values[start:start + 500]
+                placeholders = ", ".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT {column} FROM {table} WHERE {column} IN ({placeholders})", chunk
+                ).fetchall()
+                found.update(row[0] for row in rows)
+        return found
+    
+    def _write_import_batch(self, batch):
+        """Запись пачки проверенных пользователей
+        
+        В режимах attached и unified - одна транзакция на всю пачку,
+        в режиме split - одна транзакция на каждый файл БД. Если в режиме
+        split падает один из шагов, строки пачки из уже записанных файлов
+        удаляются, чтобы повтор по одному не упирался в них.
+        """
+        memberships = [(u["email"], u["group_id"]) for u in batch if u["group_id"]]
+        groups = [(group_id, f"Группа {group_id}") for group_id in sorted({g for _, g in memberships})]
+        
+        steps = [
+            ("users_quick.db", '''
+                INSERT INTO users_quick (email, password_hash, salt)
+                VALUES (?, ?, ?)
+            ''', [(u["email"], u["password_hash"], u["salt"]) for u in batch]),
+            ("users_full.db", '''
+                INSERT INTO users_full (email, nickname, full_name)
+                VALUES (?, ?, ?)
+            ''', [(u["email"], u["nickname"], u["full_name"] or u["nickname"]) for u in batch]),
+            ("groups_full.db", '''
+                INSERT OR IGNORE INTO groups_full (group_id, group_name)
+                VALUES (?, ?)
+            ''', groups),
+            ("groups_quick.db", '''
+                INSERT OR IGNORE INTO groups_quick (user_email, group_id)
+                VALUES (?, ?)
+            ''', memberships),
+        ]
+        
+        if self.joins_available:
+            with self.connection("users_quick.db") as conn:
+                with conn:
+                    for _, query, rows in steps:
+                        if rows:
+                            conn.executemany(query, rows)
+        else:
+            emails = [(u["email"],) for u in batch]
+            # Откат записанных шагов; groups_full не трогаем: INSERT OR IGNORE
+            # не говорит, какие группы новые, а пустая группа безвредна
+            undo = {
+                "users_quick.db": ("DELETE FROM users_quick WHERE email = ?", emails),
+                "users_full.db": ("DELETE FROM users_full WHERE email = ?", emails),
+                "groups_quick.db": ("DELETE FROM groups_quick WHERE user_email = ? AND group_id = ?", memberships),
+            }
+            written = []
+            try:
+                for db_name, query, rows in steps:
+                    if rows:
+                        with self.connection(db_name) as conn:
+                            with conn:
+                                conn.executemany(query, rows)
+                        written.append(db_name)
+            except sqlite3.Error:
+                for db_name in reversed(written):
+                    if db_name in undo:
+                        query, rows = undo[db_name]
+                        with self.connection(db_name) as conn:
+                            with conn:
+                                conn.executemany(query, rows)
+                raise
+        
+        self._directory_added([(u["email"], u["nickname"], u["full_name"] or u["nickname"]) for u in batch])
+    
+    def import_users(self, source, fmt=None, batch_size=1000, ip_address=None, max_errors=None):
+        """Массовый импорт пользователей из CSV или JSONL
         
+        source - путь к файлу, открытый файл или итерируемое словарей с полями
+        email, password, nickname, full_name, group_id. Файл читается потоково,
+        пароли хэшируются параллельно в пуле хэширования, каждая пачка
+        записывается одной транзакцией на файл БД. Вместо password можно
+        передать готовые password_hash и salt (как в export_table с
+        include_secrets): такой хэш не пересчитывается, а при входе
+        переводится на текущую схему. Возвращает отчет со списком ошибок
+        по строкам (не более max_errors, если задано).
+        """
+        started = time.perf_counter()
+        report = {"total": 0, "imported": 0, "failed": 0, "errors": []}
+        seen_emails = set()
+        seen_nicknames = set()
+        hasher = self.get_password_hasher()
+        
+        def fail(line_num, email, error):
+            report["failed"] += 1
+            if max_errors is None or len(report["errors"]) < max_errors:
+                report["errors"].append({"line": line_num, "email": email, "error": error})
+        
+        def flush(pending):
+            if not pending:
+                return
+            
+            # Проверяем, кто уже есть в базе, одним запросом на 500 записей
+            taken_emails = self._existing_keys(
+                "users_quick.db", "users_quick", "email", [u["email"] for u in pending])
+            taken_nicknames = self._existing_keys(
+                "users_full.db", "users_full", "nickname", [u["nickname"] for u in pending])
+            
+            batch = []
+            for user in pending:
+                if user["email"] in taken_emails:
+                    fail(user["line"], user["email"], "Пользователь с таким email уже существует")
+                elif user["nickname"] in taken_nicknames:
+                    fail(user["line"], user["email"], "Пользователь с таким никнеймом уже существует")
+                else:
+                    batch.append(user)
+            if not batch:
+                return
+            
+            # Хэшируем пароли параллельно (кроме пришедших с готовым хэшем)
+            to_hash = [u for u in batch if u["password_hash"] is None]
+            hashes = hasher.map(_password_hash_hex,
+                                [u["password"] for u in to_hash],
+                                [u["salt"] for u in to_hash],
+                                [self.password_scheme] * len(to_hash),
+                                [self.password_cost] * len(to_hash))
+            for user, digest in zip(to_hash, hashes):
+                user["password_hash"] = encode_password_hash(
+                    self.password_scheme, self.password_cost, user["salt"], digest)
+                user["password"] = None
+            
+            try:
+                self._write_import_batch(batch)
+                report["imported"] += len(batch)
+            except sqlite3.Error:
+                # Пачка не записалась целиком: пишем по одному, чтобы найти виновника
+                for user in batch:
+                    try:
+                        self._write_import_batch([user])
+                        report["imported"] += 1
+                    except sqlite3.Error as e:
+                        fail(user["line"], user["email"], f"Ошибка базы данных: {e}")
+        
+        pending = []
+        for line_num, row in self._iter_import_rows(source, fmt):
+            report["total"] += 1
+            if isinstance(row, str):
+                fail(line_num, None, row)
+                continue
+            
+            email = str(row.get("email") or "").strip()
+            password = str(row.get("password") or "")
+            password_hash = row.get("password_hash") or None
+            salt = row.get("salt") or None
+            nickname = row.get("nickname")
+            full_name = row.get("full_name")
+            group_id = row.get("group_id")
+            
+            if not self.validate_email(email):
+                fail(line_num, email, "Неверный формат email")
+                continue
+            email = self.sanitize_input(email.lower(), 100)
+            
+            nickname = self.sanitize_input(nickname, 50)
+            if not nickname:
+                fail(line_num, email, "Не указан никнейм")
+                continue
+            full_name = self.sanitize_input(full_name, 100) if full_name else None
+            group_id = self.sanitize_input(group_id, 50) if group_id else None
+            
+            if password_hash is not None:
+                try:
+                    _, _, salt, _ = parse_password_hash(str(password_hash), salt)
+                except ValueError:
+                    salt = None
+                if not salt:
+                    fail(line_num, email, "Неверный формат хэша пароля")
+                    continue
+                password_hash = str(password_hash)
+            else:
+                is_valid, msg = self.validate_password(password)
+                if not is_valid:
+                    fail(line_num, email, msg)
+                    continue
+                salt = secrets.token_hex(16)
+            
+            if email in seen_emails:
+                fail(line_num, email, "Повтор email в файле импорта")
+                continue
+            if nickname in seen_nicknames:
+                fail(line_num, email, "Повтор никнейма в файле импорта")
+                continue
+            seen_emails.add(email)
+            seen_nicknames.add(nickname)
+            
+            pending.append({
+                "line": line_num,
+                "email": email,
+                "password": password,
+                "password_hash": password_hash,
+                "salt": salt,
+                "nickname": nickname,
+                "full_name": full_name,
+                "group_id": group_id,
+            })
+            if len(pending) >= batch_size:
+                flush(pending)
+                pending = []
+        
+        flush(pending)
+        
+        report["errors"].sort(key=lambda error: error["line"])
+        report["elapsed"] = time.perf_counter() - started
+        self.log_security_event(ip_address, "bulk_import", None, success=report["failed"] == 0,
+                                error=f"imported={report['imported']} failed={report['failed']}")
+        return report
+    
+    def _load_credentials(self, email, ip_address):
+        """Шаги входа до проверки пароля
+        
+        Возвращает (email, запись users_quick, готовый ответ). Если ответ
+        не None, пароль проверять не нужно.
+        """
         # Проверка rate limiting
         if not self.check_rate_limit(ip_address, "login"):
-            return False, None, "Слишком много попыток входа. Попробуйте позже."
+            return email, None, (False, None, None, RATE_LIMIT_MESSAGES["login"])
         
         # Очистка и валидация
         email = email.lower().strip()
@@ -225,30 +3076,35 @@ class DatabaseManager:
         
         try:
             # Получаем данные пользователя
-            cursor = self.safe_execute("users_quick.db", '''
-                SELECT email, password_hash, salt, failed_attempts, locked_until 
-                FROM users_quick WHERE email = ?
-            ''', (email,))
-            
-            user = cursor.fetchone()
+            user = self.query_one("auth.credentials", (email,))
             
             if not user:
                 # Пользователь не найден, но логируем попытку
                 self.log_security_event(ip_address, "login_attempt", email, success=False)
-                return False, None, "Неверные учетные данные"
+                return email, None, (False, None, None, "Неверные учетные данные")
             
             # Проверяем блокировку
             if user['locked_until'] and datetime.strptime(user['locked_until'], '%Y-%m-%d %H:%M:%S') > datetime.now():
-                return False, None, "Аккаунт временно заблокирован"
+                return email, None, (False, None, None, "Аккаунт временно заблокирован")
+            
+            return email, user, None
             
-            # Проверяем пароль
-            if self.verify_password(password, user['password_hash'], user['salt']):
+        except Exception as e:
+            self.log_security_event(ip_address, "login_error", email, success=False, error=str(e))
+            return email, None, (False, None, None, "Ошибка сервера")
+    
+    def _complete_login(self, email, user, password_ok, ip_address, rehashed=None):
+        """Шаги входа после проверки пароля
+        
+        rehashed - новая пара (хэш, соль), если хэш пароля устарел.
+        """
+        try:
+            if password_ok:
                 # Сброс счетчика неудачных попыток
-                self.safe_execute("users_quick.db", '''
-                    UPDATE users_quick 
-                    SET last_login = CURRENT_TIMESTAMP, failed_attempts = 0, locked_until = NULL
-                    WHERE email = ?
-                ''', (email,))
+                if rehashed:
+                    self.execute_statement("auth.login_ok_rehash", (rehashed[0], rehashed[1], email))
+                else:
+                    self.execute_statement("auth.login_ok", (email,))
                 
                 # Получаем информацию о пользователе
                 user_info = self.get_user_info(email)
@@ -269,21 +3125,13 @@ class DatabaseManager:
                 
                 if failed_attempts >= 5:
                     # Блокируем на 15 минут
-                    lock_until = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    self.safe_execute("users_quick.db", '''
-                        UPDATE users_quick 
-                        SET failed_attempts = ?, locked_until = ?
-                        WHERE email = ?
-                    ''', (failed_attempts, lock_until, email))
+                    lock_until = (datetime.now() + timedelta(minutes=15)).strftime('%Y-%m-%d %H:%M:%S')
+                    self.execute_statement("auth.lock", (failed_attempts, lock_until, email))
                     
                     self.log_security_event(ip_address, "account_locked", email, success=False)
                     return False, None, None, "Слишком много неудачных попыток. Аккаунт заблокирован на 15 минут."
                 else:
-                    self.safe_execute("users_quick.db", '''
-                        UPDATE users_quick 
-                        SET failed_attempts = ?
-                        WHERE email = ?
-                    ''', (failed_attempts, email))
+                    self.execute_statement("auth.login_failed", (failed_attempts, email))
                     
                     self.log_security_event(ip_address, "login_failed", email, success=False)
                     return False, None, None, "Неверные учетные данные"
@@ -292,88 +3140,480 @@ class DatabaseManager:
             self.log_security_event(ip_address, "login_error", email, success=False, error=str(e))
             return False, None, None, "Ошибка сервера"
     
+    def authenticate_user(self, email, password, ip_address=None):
+        """Безопасная аутентификация пользователя
+        
+        Возвращает (успех, информация о пользователе, токен сессии, сообщение).
+        """
+        email, user, result = self._load_credentials(email, ip_address)
+        if result is not None:
+            return result
+        
+        # Проверяем пароль
+        password_ok = self.verify_password(password, user['password_hash'], user['salt'])
+        
+        # Пароль известен только при входе: тогда и переводим хэш на текущую схему
+        rehashed = None
+        if password_ok and self.needs_rehash(user['password_hash']):
+            rehashed = self.make_password_hash(password)
+        return self._complete_login(email, user, password_ok, ip_address, rehashed)
+    
+    async def authenticate_user_async(self, email, password, ip_address=None):
+        """Аутентификация без блокировки цикла событий: хэш считается в пуле хэширования"""
+        loop = asyncio.get_running_loop()
+        email, user, result = await loop.run_in_executor(
+            None, self._load_credentials, email, ip_address)
+        if result is not None:
+            return result
+        
+        hasher = self.get_password_hasher()
+        try:
+            scheme, cost, salt, digest = parse_password_hash(user['password_hash'], user['salt'])
+            new_digest = await hasher.run_async(_password_hash_hex, password, salt, scheme, cost)
+            password_ok = hmac.compare_digest(new_digest, digest)
+        except (ValueError, TypeError):
+            password_ok = False
+        
+        rehashed = None
+        if password_ok and self.needs_rehash(user['password_hash']):
+            salt = secrets.token_hex(16)
+            new_digest = await hasher.run_async(
+                _password_hash_hex, password, salt, self.password_scheme, self.password_cost)
+            rehashed = encode_password_hash(self.password_scheme, self.password_cost, salt, new_digest), salt
+        
+        return await loop.run_in_executor(
+            None, self._complete_login, email, user, password_ok, ip_address, rehashed)
+    
     def save_session(self, email, session_token, ip_address):
         """Сохранение сессии в БД"""
         try:
-            # Создаем таблицу сессий если ее нет
-            self.safe_execute("users_quick.db", '''
-                CREATE TABLE IF NOT EXISTS sessions (
-                    session_id TEXT PRIMARY KEY,
-                    user_email TEXT NOT NULL,
-                    ip_address TEXT,
-                    user_agent TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    expires_at TIMESTAMP,
-                    is_valid INTEGER DEFAULT 1,
-                    FOREIGN KEY (user_email) REFERENCES users_quick(email) ON DELETE CASCADE
-                )
-            ''')
-            
             # Устанавливаем время жизни сессии (24 часа)
-            expires_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            
-            self.safe_execute("users_quick.db", '''
-                INSERT INTO sessions (session_id, user_email, ip_address, expires_at)
-                VALUES (?, ?, ?, datetime('now', '+24 hours'))
-            ''', (session_token, email, ip_address))
+            self.execute_statement("sessions.insert", (session_token, email, ip_address))
             
         except Exception as e:
             print(f"Session save error: {e}")
+        finally:
+            # Убираем возможную отрицательную запись для этого токена
+            self.session_cache.invalidate(self._session_key(session_token))
+    
+    @staticmethod
+    def _session_key(session_token):
+        """Ключ кэша сессий: сам токен в памяти не хранится"""
+        return hashlib.sha256(str(session_token).encode('utf-8')).hexdigest()
+    
+    def _load_session(self, session_token):
+        """Чтение действующей сессии из БД: (email, ip, истечение в epoch) или None"""
+        session = self.query_one("sessions.load", (session_token,))
+        
+        if not session:
+            return None
+        
+        # expires_at хранится в UTC, как и CURRENT_TIMESTAMP
+        expires = calendar.timegm(time.strptime(session['expires_at'], '%Y-%m-%d %H:%M:%S'))
+        return session['user_email'], session['ip_address'], expires
+    
+    def validate_session(self, session_token, ip_address=None):
+        """Валидация сессии"""
+        if not session_token:
+            return False, None
+        
+        key = self._session_key(session_token)
+        try:
+            session = self.session_cache.get(key)
+            if session is None:
+                stamp = self.session_cache.stamp()
+                session = self._load_session(session_token)
+                if session is None:
+                    # Кэшируем промах ненадолго: поток поддельных токенов не дойдет до SQLite
+                    self.session_cache.set(key, self._NO_SESSION,
+                                           ttl=self.session_negative_ttl, stamp=stamp)
+                    return False, None
+                ttl = min(self.session_cache.ttl, session[2] - time.time())
+                if ttl > 0:
+                    self.session_cache.set(key, session, ttl=ttl, stamp=stamp)
+            
+            if session is self._NO_SESSION:
+                return False, None
+            
+            user_email, session_ip, expires = session
+            if expires <= time.time():
+                self.session_cache.invalidate(key)
+                return False, None
+            
+            # Проверяем IP (опционально)
+            if ip_address and session_ip and session_ip != ip_address:
+                # Логируем подозрительную активность
+                self.log_security_event(ip_address, "session_ip_mismatch", user_email, success=False)
+                # Можно не блокировать, но логировать нужно
+            
+            return True, user_email
+            
+        except Exception as e:
+            print(f"Session validation error: {e}")
+            return False, None
+    
+    def revoke_session(self, session_token):
+        """Отзыв сессии (выход из системы)"""
+        try:
+            return self.execute_statement("sessions.revoke", (session_token,)) > 0
+        except Exception as e:
+            print(f"Session revoke error: {e}")
+            return False
+        finally:
+            self._invalidate("session", self._session_key(session_token))
+    
+    def revoke_user_sessions(self, user_email):
+        """Отзыв всех сессий пользователя, возвращает число отозванных"""
+        try:
+            return self.execute_statement("sessions.revoke_user", (user_email,))
+        except Exception as e:
+            print(f"Session revoke error: {e}")
+            return 0
+        finally:
+            self._invalidate("user_sessions", user_email)
+    
+    def session_cache_stats(self):
+        """Счетчики кэша сессий"""
+        return self.session_cache.stats()
+    
+    # Очистка сессий
+    def purge_sessions(self, batch_size=1000, max_batches=None, vacuum_pages=1000):
+        """Удаление истекших и отозванных сессий пачками по batch_size строк
+        
+        Каждая пачка - отдельная транзакция, поэтому вход пользователей не
+        ждет окончания всей очистки. Истекшие и отозванные сессии удаляются
+        по очереди, по пачке за шаг, из общего бюджета max_batches: большой
+        хвост истекших сессий не мешает удалять отозванные, каждая фаза
+        получает не меньше половины бюджета. Если для файла включен
+        auto_vacuum = INCREMENTAL, освобождается до vacuum_pages страниц.
+        """
+        started = time.perf_counter()
+        purged = {"expired_purged": 0, "revoked_purged": 0}
+        queries = (
+            ("expired_purged", '''
+                DELETE FROM sessions WHERE rowid IN (
+                    SELECT rowid FROM sessions WHERE expires_at <= CURRENT_TIMESTAMP LIMIT ?
+                )
+            '''),
+            ("revoked_purged", '''
+                DELETE FROM sessions WHERE rowid IN (
+                    SELECT rowid FROM sessions INDEXED BY idx_sessions_revoked
+                    WHERE is_valid = 0 LIMIT ?
+                )
+            '''),
+        )
+        
+        batches = 0
+        vacuumed = 0
+        with self.connection("users_quick.db") as conn:
+            # Фаза выбывает, когда ее пачка оказалась неполной
+            active = list(queries)
+            while active and (max_batches is None or batches < max_batches):
+                for phase in list(active):
+                    if max_batches is not None and batches >= max_batches:
+                        break
+                    counter, query = phase
+                    with conn:
+                        deleted = conn.execute(query, (batch_size,)).rowcount
+                    batches += 1
+                    purged[counter] += deleted
+                    if deleted < batch_size:
+                        active.remove(phase)
+            
+            if vacuum_pages and conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                if free_pages:
+                    conn.execute(f"PRAGMA incremental_vacuum({int(vacuum_pages)})").fetchall()
+                    vacuumed = min(free_pages, int(vacuum_pages))
+        
+        elapsed = time.perf_counter() - started
+        with self._session_sweep_lock:
+            self._session_sweep_stats["runs"] += 1
+            self._session_sweep_stats["expired_purged"] += purged["expired_purged"]
+            self._session_sweep_stats["revoked_purged"] += purged["revoked_purged"]
+            self._session_sweep_stats["vacuumed_pages"] += vacuumed
+            self._session_sweep_stats["time_spent"] += elapsed
+        
+        return dict(purged, vacuumed_pages=vacuumed, batches=batches, elapsed=elapsed)
+    
+    def enable_incremental_vacuum(self, db_name="users_quick.db"):
+        """Перевод существующего файла БД на auto_vacuum = INCREMENTAL
+        
+        Новые файлы создаются сразу в этом режиме (профиль oltp); для старых
+        нужен однократный полный VACUUM, который блокирует файл на время работы.
+        """
+        with self.connection(db_name) as conn:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                return False
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+        # VACUUM может перенумеровать rowid, на которые ссылаются индексы поиска
+        self.rebuild_search_index()
+        return True
+    
+    def start_session_sweeper(self, interval=300.0, batch_size=1000, max_batches=100, vacuum_pages=1000):
+        """Запуск фоновой очистки сессий каждые interval секунд"""
+        if self._session_sweeper is not None and self._session_sweeper.running:
+            return self._session_sweeper
+        
+        def sweep():
+            try:
+                return self.purge_sessions(batch_size, max_batches, vacuum_pages)
+            finally:
+                self.release_connections()
+        
+        self._session_sweeper = PeriodicTask(sweep, interval, name="session-sweeper")
+        return self._session_sweeper
+    
+    def stop_session_sweeper(self):
+        if self._session_sweeper is not None:
+            self._session_sweeper.stop()
+            self._session_sweeper = None
+    
+    def session_sweep_stats(self):
+        """Метрики очистки сессий: удалено строк, освобождено страниц, затрачено времени"""
+        with self._session_sweep_lock:
+            return dict(self._session_sweep_stats)
+    
+    def _write_security_events(self, rows):
+        """Запись пачки событий безопасности одной транзакцией"""
+        with self.connection("users_quick.db") as conn:
+            with conn:
+                conn.executemany('''
+                    INSERT INTO security_logs (timestamp, ip_address, event_type, user_email, success, error_message)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', rows)
+    
+    def _get_security_log_writer(self):
+        writer = self._security_log_writer
+        if writer is None or writer.closed:
+            with self._security_log_lock:
+                writer = self._security_log_writer
+                if writer is None or writer.closed:
+                    writer = SecurityEventWriter(
+                        self._write_security_events, **self.security_log_options
+                    )
+                    _OPEN_SECURITY_LOG_WRITERS.add(writer)
+                    self._security_log_writer = writer
+        return writer
+    
+    def flush_security_events(self, timeout=None):
+        """Ожидание записи журнала безопасности на диск"""
+        writer = self._security_log_writer
+        if writer is not None:
+            writer.flush(timeout)
+    
+    def security_log_stats(self):
+        """Счетчики фоновой записи журнала безопасности"""
+        writer = self._security_log_writer
+        return writer.stats() if writer is not None else {}
+    
+    # Архивация журнала безопасности
+    _SECURITY_LOG_COLUMNS = ("id", "timestamp", "ip_address", "event_type",
+                             "user_email", "success", "error_message", "user_agent")
+    
+    @staticmethod
+    def _log_timestamp(value):
+        """Граница периода для журнала: datetime или строка 'ГГГГ-ММ-ДД[ ЧЧ:ММ:СС]' (UTC)"""
+        if value is None or isinstance(value, str):
+            return value
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    
+    def _archive_path(self, month):
+        return os.path.join(self.archive_dir, f"security_logs-{month}.jsonl.gz")
+    
+    def archive_security_logs(self, older_than_days=30, max_hot_rows=None, batch_size=5000):
+        """Перенос старых записей security_logs в помесячные архивы .jsonl.gz
+        
+        В архив уходят записи старше older_than_days дней, а если задан
+        max_hot_rows - еще и самые старые записи сверх этого числа. Пачка
+        сначала дописывается в архив и только потом удаляется из таблицы;
+        после сбоя между этими шагами запись может попасть в архив дважды,
+        query_security_logs такие повторы отбрасывает. Архивация идет под
+        блокировкой файла archive_dir/.archive.lock (flock), чтобы процессы
+        с общим db_dir (воркеры --processes, CLI) не дописывали один архив
+        одновременно.
+        """
+        started = time.perf_counter()
+        cutoff = time.strftime('%Y-%m-%d %H:%M:%S',
+                               time.gmtime(time.time() - older_than_days * 86400))
+        columns = ", ".join(self._SECURITY_LOG_COLUMNS)
+        archived = 0
+        months = set()
+        
+        with self._archive_lock(), self.connection("users_quick.db") as conn:
+            # Граница по id для ограничения размера горячей таблицы
+            max_id = None
+            if max_hot_rows is not None:
+                row = conn.execute(
+                    "SELECT id FROM security_logs ORDER BY id DESC LIMIT 1 OFFSET ?",
+                    (max_hot_rows,)
+                ).fetchone()
+                max_id = row[0] if row else None
+            
+            # Сначала записи старше границы (по индексу времени), затем лишние по id
+            phases = [(f'''
+                SELECT {columns} FROM security_logs
+                WHERE timestamp < ? ORDER BY timestamp LIMIT ?
+            ''', cutoff)]
+            if max_id is not None:
+                phases.append((f'''
+                    SELECT {columns} FROM security_logs
+                    WHERE id <= ? ORDER BY id LIMIT ?
+                ''', max_id))
+            
+            for query, bound in phases:
+                while True:
+                    rows = conn.execute(query, (bound, batch_size)).fetchall()
+                    if not rows:
+                        break
+                
+                    by_month = {}
+                    for row in rows:
+                        month = (row["timestamp"] or "0000-00")[:7]
+                        by_month.setdefault(month, []).append(dict(row))
+                
+                    for month, records in by_month.items():
+                        # Дозапись добавляет к gzip новый поток; gzip читает потоки подряд
+                        with gzip.open(self._archive_path(month), "at", encoding="utf-8") as f:
+                            for record in records:
+                                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                        months.add(month)
+                
+                    with conn:
+                        conn.executemany("DELETE FROM security_logs WHERE id = ?",
+                                         [(row["id"],) for row in rows])
+                    archived += len(rows)
+                    if len(rows) < batch_size:
+                        break
+        
+        return {
+            "archived": archived,
+            "months": sorted(months),
+            "elapsed": time.perf_counter() - started,
+        }
+    
+    @contextmanager
+    def _archive_lock(self):
+        """Блокировка архивации для потоков этого процесса и других процессов"""
+        with self._log_archive_lock:
+            os.makedirs(self.archive_dir, exist_ok=True)
+            with open(os.path.join(self.archive_dir, ".archive.lock"), "a") as lock_file:
+                # Блокировка снимается при закрытии файла
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                yield
+    
+    def _iter_archived_logs(self, since=None, until=None):
+        """Чтение архивов за месяцы, пересекающиеся с периодом"""
+        for path in sorted(glob.glob(os.path.join(self.archive_dir, "security_logs-*.jsonl.gz"))):
+            month = os.path.basename(path)[len("security_logs-"):-len(".jsonl.gz")]
+            if since and month < since[:7]:
+                continue
+            if until and month > until[:7]:
+                continue
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+    
+    def query_security_logs(self, user_email=None, ip_address=None, event_type=None,
+                            since=None, until=None, limit=100, include_archive=True):
+        """Поиск событий безопасности в горячей таблице и архивах
+        
+        Возвращает до limit записей от новых к старым; since включительно,
+        until - не включительно.
+        """
+        since = self._log_timestamp(since)
+        until = self._log_timestamp(until)
+        
+        conditions, params = [], []
+        for column, value in (("user_email", user_email), ("ip_address", ip_address),
+                              ("event_type", event_type)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if since:
+            conditions.append("timestamp >= ?")
+            params.append(since)
+        if until:
+            conditions.append("timestamp < ?")
+            params.append(until)
+        where = " AND ".join(conditions) or "1"
+        
+        with self.connection("users_quick.db") as conn:
+            hot = [dict(row) for row in conn.execute(f'''
+                SELECT {", ".join(self._SECURITY_LOG_COLUMNS)} FROM security_logs
+                WHERE {where} ORDER BY timestamp DESC, id DESC LIMIT ?
+            ''', (*params, limit))]
+        
+        if not include_archive:
+            return hot
+        
+        def matches(record):
+            return ((user_email is None or record["user_email"] == user_email)
+                    and (ip_address is None or record["ip_address"] == ip_address)
+                    and (event_type is None or record["event_type"] == event_type)
+                    and (not since or (record["timestamp"] or "") >= since)
+                    and (not until or (record["timestamp"] or "") < until))
+        
+        def best(records):
+            # Повторы одной записи (сбой между дозаписью архива и удалением)
+            # одинаковы целиком, поэтому их достаточно убрать внутри окна
+            unique = {record["id"]: record for record in records}
+            return heapq.nlargest(limit, unique.values(), key=lambda r: (r["timestamp"] or "", r["id"]))
+        
+        # Архив читается потоково; в памяти держим не больше 4 * limit записей.
+        # Сверяем только с id горячих записей (их не больше limit)
+        hot_ids = {record["id"] for record in hot}
+        archived = []
+        for record in self._iter_archived_logs(since, until):
+            if record["id"] in hot_ids or not matches(record):
+                continue
+            archived.append(record)
+            if len(archived) > limit * 4:
+                archived = best(archived)
+        
+        return best(hot + archived)
+    
+    def start_log_archiver(self, interval=3600.0, older_than_days=30, max_hot_rows=None):
+        """Запуск периодической архивации журнала безопасности"""
+        if self._log_archiver is not None and self._log_archiver.running:
+            return self._log_archiver
+        
+        def archive():
+            try:
+                return self.archive_security_logs(older_than_days, max_hot_rows)
+            finally:
+                self.release_connections()
+        
+        self._log_archiver = PeriodicTask(archive, interval, name="security-log-archiver")
+        return self._log_archiver
     
-    def validate_session(self, session_token, ip_address=None):
-        """Валидация сессии"""
-        try:
-            cursor = self.safe_execute("users_quick.db", '''
-                SELECT s.*, u.email 
-                FROM sessions s
-                JOIN users_quick u ON s.user_email = u.email
-                WHERE s.session_id = ? 
-                AND s.is_valid = 1 
-                AND s.expires_at > CURRENT_TIMESTAMP
-            ''', (session_token,))
-            
-            session = cursor.fetchone()
-            
-            if not session:
-                return False, None
-            
-            # Проверяем IP (опционально)
-            if ip_address and session['ip_address'] and session['ip_address'] != ip_address:
-                # Логируем подозрительную активность
-                self.log_security_event(ip_address, "session_ip_mismatch", session['user_email'], success=False)
-                # Можно не блокировать, но логировать нужно
-            
-            return True, session['user_email']
-            
-        except Exception as e:
-            print(f"Session validation error: {e}")
-            return False, None
+    def stop_log_archiver(self):
+        if self._log_archiver is not None:
+            self._log_archiver.stop()
+            self._log_archiver = None
     
     def log_security_event(self, ip_address, event_type, user_email=None, success=True, error=None):
         """Логирование событий безопасности"""
+        if self.async_security_log:
+            # Время события фиксируем сейчас, а не в момент записи пачки
+            timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+            self._get_security_log_writer().submit(
+                (timestamp, ip_address, event_type, user_email, 1 if success else 0, error)
+            )
+            return
+        
         try:
-            self.safe_execute("users_quick.db", '''
-                CREATE TABLE IF NOT EXISTS security_logs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    ip_address TEXT,
-                    event_type TEXT,
-                    user_email TEXT,
-                    success INTEGER,
-                    error_message TEXT,
-                    user_agent TEXT
-                )
-            ''')
-            
-            self.safe_execute("users_quick.db", '''
-                INSERT INTO security_logs (ip_address, event_type, user_email, success, error_message)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (ip_address, event_type, user_email, 1 if success else 0, error))
+            self.execute_statement("security_logs.insert",
+                                   (ip_address, event_type, user_email, 1 if success else 0, error))
             
         except Exception as e:
             print(f"Security log error: {e}")
     
-    def init_databases(self):
+    def init_databases(self, demo_data=False):
+        """Проверка схемы всех файлов БД сразу (иначе - при первом обращении)"""
         # 1. Quick users database
         self.init_users_quick()
         
@@ -392,259 +3632,801 @@ class DatabaseManager:
         # 6. Admins database
         self.init_admins()
         
-        # 7. Demo data
-        self.create_demo_data()
+        # 7. Demo data (только по явному запросу)
+        if demo_data:
+            self.create_demo_data()
     
-    def init_users_quick(self):
-        conn = self.get_connection("users_quick.db")
-        cursor = conn.cursor()
+    def _schema_components(self, physical):
+        """Логические базы, таблицы которых лежат в физическом файле"""
+        return [db_name for db_name in DB_TABLES if self._physical_name(db_name) == physical]
+    
+    def _schema_target(self, physical):
+        """Ожидаемый PRAGMA user_version файла: сумма последних версий миграций его баз"""
+        return sum(
+            max((number for number, _, _ in SCHEMA_MIGRATIONS.get(db_name, [])), default=0)
+            for db_name in self._schema_components(physical)
+        )
+    
+    def _ensure_schema(self, physical):
+        """Приведение схемы файла к последней версии (один раз за процесс)
         
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users_quick (
-                email TEXT PRIMARY KEY,
-                password_hash TEXT NOT NULL,
-                salt TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_login TIMESTAMP
-            )
-        ''')
+        Быстрая проверка - одно чтение PRAGMA user_version; таблица
+        schema_migrations читается, только если версия отстает. В режиме
+        attached проверяются сразу все файлы: соединения users_quick.db
+        обращаются к их таблицам через ATTACH.
+        """
+        if self.storage == "attached":
+            targets = sorted({self._physical_name(db_name) for db_name in DB_TABLES})
+        else:
+            targets = [physical]
         
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_email ON users_quick(email)')
-        conn.commit()
+        with DatabaseManager._migrated_lock:
+            checked = []
+            for name in targets:
+                if name in self._schema_ready:
+                    continue
+                path = os.path.abspath(os.path.join(self.db_dir, name))
+                components = self._schema_components(name)
+                if not all((path, db_name) in DatabaseManager._migrated for db_name in components):
+                    target = self._schema_target(name)
+                    with self._open_pool(name).connection() as conn:
+                        if conn.execute("PRAGMA user_version").fetchone()[0] < target:
+                            for db_name in components:
+                                apply_migrations(conn, db_name)
+                            conn.execute(f"PRAGMA user_version = {int(target)}")
+                    DatabaseManager._migrated.update((path, db_name) for db_name in components)
+                    checked.append(name)
+                self._schema_ready.add(name)
+            
+            # Запросы реестра проверяем после миграции всех файлов режима
+            errors = []
+            for name in checked:
+                with self._open_pool(name).connection() as conn:
+                    errors += explain_errors(conn, self._statement_names(name))
+            if errors:
+                for name in checked:
+                    self._schema_ready.discard(name)
+                raise sqlite3.OperationalError(
+                    "Некорректные запросы в реестре: "
+                    + "; ".join(f"{name}: {error}" for name, error in errors))
     
-    def init_users_full(self):
-        conn = self.get_connection("users_full.db")
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users_full (
-                email TEXT PRIMARY KEY,
-                nickname TEXT NOT NULL UNIQUE,
-                full_name TEXT,
-                avatar TEXT,
-                theme TEXT DEFAULT 'light',
-                notifications_enabled INTEGER DEFAULT 1,
-                bio TEXT,
-                settings_json TEXT DEFAULT '{}',
-                FOREIGN KEY (email) REFERENCES users_quick(email) ON DELETE CASCADE
-            )
-        ''')
+    def _statement_names(self, physical):
+        """Запросы реестра, которые выполняются на соединениях физического файла"""
+        return [
+            name for name, (db_name, _) in QUERIES.items()
+            if self._physical_name(db_name) == physical
+            and (self.joins_available or name not in JOINED_QUERIES)
+        ]
+    
+    def validate_queries(self):
+        """Проверка всех запросов реестра на текущей схеме: список (имя, ошибка)"""
+        errors = []
+        for physical in sorted({self._physical_name(db_name) for db_name in DB_TABLES}):
+            with self.connection(physical) as conn:
+                errors += explain_errors(conn, self._statement_names(physical))
+        return errors
+    
+    # Именованные запросы
+    def _run_statement(self, name, params, fetch, max_age=None):
+        db_name, sql = QUERIES[name]
+        # Отчеты идут на снимок; первая проверка схемы или снятие снимка
+        # не должны попасть во время запроса
+        snapshot = self._fresh_snapshot(db_name, max_age) if name in REPORT_QUERIES else None
+        if snapshot is None:
+            self.get_pool(db_name)
+        started = time.perf_counter()
+        try:
+            if snapshot is not None:
+                with snapshot.connection() as conn:
+                    result, rows = self._fetch(conn.execute(sql, params), fetch)
+            elif fetch is not None:
+                # Чтение - без commit и печати ошибки: ее учитывает statement_stats
+                with self.connection(db_name) as conn:
+                    result, rows = self._fetch(conn.execute(sql, params), fetch)
+            else:
+                with self.connection(db_name):
+                    result, rows = self._fetch(self.safe_execute(db_name, sql, params), fetch)
+        except Exception:
+            self._statement_stats.record(name, time.perf_counter() - started, 0, failed=True)
+            raise
+        self._statement_stats.record(name, time.perf_counter() - started, rows)
+        return result
+    
+    @staticmethod
+    def _fetch(cursor, fetch):
+        """(результат, число строк) для _run_statement"""
+        if fetch == "all":
+            result = cursor.fetchall()
+            return result, len(result)
+        if fetch == "one":
+            result = cursor.fetchone()
+            return result, 0 if result is None else 1
+        return cursor.rowcount, max(cursor.rowcount, 0)
+    
+    def query_all(self, name, params=()):
+        """Все строки именованного запроса SELECT"""
+        return self._run_statement(name, params, "all")
+    
+    def query_one(self, name, params=()):
+        """Первая строка именованного запроса SELECT (или None)"""
+        return self._run_statement(name, params, "one")
+    
+    def execute_statement(self, name, params=()):
+        """Выполнение именованного запроса на изменение, возвращает rowcount"""
+        return self._run_statement(name, params, None)
+    
+    def statement_stats(self):
+        """Время, вызовы и строки по именованным запросам (самые дорогие первыми)"""
+        return self._statement_stats.stats()
+    
+    def reset_statement_stats(self):
+        self._statement_stats.reset()
+    
+    # Снимки для отчетов
+    def _snapshot(self, db_name):
+        """Объект снимка физического файла логической базы db_name"""
+        physical = self._physical_name(db_name)
+        with self._snapshots_lock:
+            snapshot = self._snapshots.get(physical)
+            if snapshot is None:
+                snapshot = self._snapshots[physical] = ReadSnapshot(
+                    os.path.join(self.db_dir, physical), self.snapshot_dir)
+        return snapshot
+    
+    def _fresh_snapshot(self, db_name, max_age=None):
+        """Снимок не старше max_age секунд (None, если снимки выключены)"""
+        if not self.report_snapshots:
+            return None
+        if max_age is None:
+            max_age = self.snapshot_max_age
+        snapshot = self._snapshot(db_name)
+        age = snapshot.age
+        if age is None or age > max_age:
+            snapshot.adopt_latest()
+            age = snapshot.age
+            if age is None or age > max_age:
+                self._refresh_snapshot(db_name, snapshot)
+        return snapshot
+    
+    def _refresh_snapshot(self, db_name, snapshot):
+        # Схема источника приводится к последней версии до копирования,
+        # буфер журнала безопасности дописывается, чтобы попасть в снимок
+        self.get_pool(db_name)
+        if self._physical_name(db_name) == self._physical_name("users_quick.db"):
+            self.flush_security_events()
+        return snapshot.refresh()
+    
+    def refresh_snapshots(self):
+        """Обновление снимков всех файлов с отчетами: имя файла -> время снятия"""
+        taken = {}
+        for db_name in sorted({QUERIES[name][0] for name in REPORT_QUERIES}):
+            snapshot = self._snapshot(db_name)
+            if snapshot.name not in taken:
+                taken[snapshot.name] = self._refresh_snapshot(db_name, snapshot)
+        return taken
+    
+    def start_snapshot_refresher(self, interval=300.0):
+        """Фоновое обновление снимков каждые interval секунд"""
+        if self._snapshot_refresher is not None and self._snapshot_refresher.running:
+            return self._snapshot_refresher
+        self._snapshot_refresher = PeriodicTask(self.refresh_snapshots, interval, name="snapshot-refresh")
+        return self._snapshot_refresher
+    
+    def stop_snapshot_refresher(self):
+        if self._snapshot_refresher is not None:
+            self._snapshot_refresher.stop()
+            self._snapshot_refresher = None
+    
+    def run_report(self, name, params=(), max_age=None):
+        """Отчетный запрос из REPORT_QUERIES на снимке
         
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_nickname ON users_full(nickname)')
-        conn.commit()
+        max_age - допустимый возраст снимка в секундах (по умолчанию
+        snapshot_max_age). Возвращает словарь {report, rows, taken_at,
+        snapshot_age_s}; rows - список словарей. При report_snapshots=False
+        запрос выполняется на рабочем файле и возраст равен 0.
+        """
+        if name not in REPORT_QUERIES:
+            raise ValueError(f"Неизвестный отчет: {name}")
+        db_name = QUERIES[name][0]
+        rows = [dict(row) for row in self._run_statement(name, params, "all", max_age)]
+        if not self.report_snapshots:
+            return {"report": name, "rows": rows, "taken_at": None, "snapshot_age_s": 0.0}
+        info = self._snapshot(db_name).stats()
+        return {"report": name, "rows": rows, "taken_at": info["taken_at"], "snapshot_age_s": info["age_s"]}
+    
+    def report_group_sizes(self, limit=50, max_age=None):
+        """Крупнейшие группы по числу участников"""
+        return self.run_report("report.group_sizes", (limit,), max_age)
+    
+    def report_login_activity(self, days=7, max_age=None):
+        """Входы, неудачные попытки и число пользователей по дням"""
+        return self.run_report("report.login_activity", (f"-{int(days)} days",), max_age)
+    
+    def report_active_sessions(self, limit=50, max_age=None):
+        """Пользователи с наибольшим числом действующих сессий"""
+        return self.run_report("report.active_sessions", (limit,), max_age)
+    
+    def snapshot_stats(self):
+        """Снимки по именам файлов: путь, время, возраст, размер, обновления"""
+        with self._snapshots_lock:
+            snapshots = list(self._snapshots.values())
+        return {snapshot.name: snapshot.stats() for snapshot in snapshots}
+    
+    def migrate_database(self, db_name):
+        """Приведение схемы файла БД к последней версии (один раз за процесс)"""
+        physical = self._physical_name(db_name)
+        if physical not in self._schema_ready:
+            self._ensure_schema(physical)
+    
+    def init_users_quick(self):
+        self.migrate_database("users_quick.db")
+    
+    def init_users_full(self):
+        self.migrate_database("users_full.db")
     
     def init_groups_quick(self):
-        conn = self.get_connection("groups_quick.db")
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS groups_quick (
-                user_email TEXT,
-                group_id TEXT NOT NULL,
-                PRIMARY KEY (user_email, group_id),
-                FOREIGN KEY (user_email) REFERENCES users_quick(email) ON DELETE CASCADE
-            )
-        ''')
-        
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_group ON groups_quick(user_email, group_id)')
-        conn.commit()
+        self.migrate_database("groups_quick.db")
     
     def init_groups_full(self):
-        conn = self.get_connection("groups_full.db")
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS groups_full (
-                group_id TEXT PRIMARY KEY,
-                group_name TEXT NOT NULL,
-                description TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                settings_json TEXT DEFAULT '{}'
-            )
-        ''')
-        
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_group_name ON groups_full(group_name)')
-        conn.commit()
+        self.migrate_database("groups_full.db")
     
     def init_group_leaders(self):
-        conn = self.get_connection("group_leaders.db")
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS group_leaders (
-                group_id TEXT NOT NULL,
-                leader_email TEXT NOT NULL,
-                PRIMARY KEY (group_id, leader_email),
-                FOREIGN KEY (group_id) REFERENCES groups_full(group_id) ON DELETE CASCADE,
-                FOREIGN KEY (leader_email) REFERENCES users_quick(email) ON DELETE CASCADE
-            )
-        ''')
-        conn.commit()
+        self.migrate_database("group_leaders.db")
     
     def init_admins(self):
-        conn = self.get_connection("admins.db")
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS admins (
-                admin_email TEXT PRIMARY KEY,
-                permissions_json TEXT DEFAULT '{}',
-                FOREIGN KEY (admin_email) REFERENCES users_quick(email) ON DELETE CASCADE
-            )
-        ''')
-        conn.commit()
+        self.migrate_database("admins.db")
     
     # Хэширование пароля с солью
     @staticmethod
     def hash_password(password, salt=None):
+        """Хэш прежнего формата (hex PBKDF2, 100000 итераций) и соль
+        
+        Оставлен для совместимости: verify_password его принимает, при
+        входе он переводится на текущую схему. Новые хэши - make_password_hash().
+        """
+        if salt is None:
+            salt = secrets.token_hex(16)
+        return _password_hash_hex(password, salt, "pbkdf2_sha256", _LEGACY_PASSWORD_COST), salt
+    
+    def make_password_hash(self, password, salt=None):
+        """Хэш в формате "схема$стоимость$соль$hex" по текущим настройкам и соль"""
         if salt is None:
             salt = secrets.token_hex(16)
         
-        # Используем PBKDF2 для надежного хэширования
-        password_hash = hashlib.pbkdf2_hmac(
-            'sha256',
-            password.encode('utf-8'),
-            salt.encode('utf-8'),
-            100000  # Количество итераций
-        ).hex()
-        
-        return password_hash, salt
+        digest = _password_hash_hex(password, salt, self.password_scheme, self.password_cost)
+        return encode_password_hash(self.password_scheme, self.password_cost, salt, digest), salt
+    
+    def needs_rehash(self, password_hash):
+        """True, если хэш старого формата, испорчен или посчитан с другой схемой/стоимостью"""
+        try:
+            if "$" not in password_hash:
+                return True
+            scheme, cost, _, _ = parse_password_hash(password_hash)
+        except (ValueError, TypeError):
+            return True
+        return (scheme, cost) != (self.password_scheme, self.password_cost)
     
     # Проверка пароля
     @staticmethod
     def verify_password(password, password_hash, salt):
-        new_hash, _ = DatabaseManager.hash_password(password, salt)
-        return new_hash == password_hash
+        """False и для испорченного хэша (неизвестная схема, неверная стоимость)"""
+        try:
+            scheme, cost, salt, digest = parse_password_hash(password_hash, salt)
+            new_digest = _password_hash_hex(password, salt, scheme, cost)
+        except (ValueError, TypeError):
+            return False
+        return hmac.compare_digest(new_digest, digest)
 
     # Получение информации о пользователе
     def get_user_info(self, email):
-        conn = self.get_connection("users_full.db")
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT * FROM users_full WHERE email = ?
-        ''', (email,))
-        
-        user = cursor.fetchone()
-        if user:
-            # Получаем группы пользователя
-            groups = self.get_user_groups(email)
-            
-            # Получаем роли
-            is_leader = self.is_group_leader(email)
-            is_admin = self.is_admin(email)
-            
-            user_dict = dict(user)
-            user_dict['groups'] = groups
-            user_dict['is_leader'] = is_leader
-            user_dict['is_admin'] = is_admin
-            
-            # Добавляем настройки из JSON
-            if user_dict['settings_json']:
-                user_dict['settings'] = json.loads(user_dict['settings_json'])
-            else:
-                user_dict['settings'] = {}
+        """Профиль пользователя с группами и ролями (из кэша, если есть)"""
+        user_dict = self.profile_cache.get(email)
+        if user_dict is None:
+            stamp = self.profile_cache.stamp()
+            user_dict = self._load_user_info(email)
+            if user_dict is None:
+                return None
+            self.profile_cache.set(email, user_dict, stamp=stamp)
+        
+        # Копия, чтобы вызывающий код не мог изменить запись кэша
+        return copy.deepcopy(user_dict)
+    
+    def invalidate_user_info(self, email=None):
+        """Сброс кэша профиля пользователя (или всех профилей)"""
+        if email is None:
+            self.profile_cache.clear()
+        else:
+            self.profile_cache.invalidate(email)
+    
+    # Сброс кэшей между процессами
+    def _apply_invalidation(self, kind, key=None, value=None):
+        """Сброс кэшей этого процесса после изменения вида kind"""
+        if kind == "profile":
+            self.invalidate_user_info(key)
+        elif kind == "session":
+            self.session_cache.invalidate(key)
+        elif kind == "user_sessions":
+            self.session_cache.discard_if(
+                lambda cache_key, session: session is not self._NO_SESSION and session[0] == key
+            )
+        elif kind in ("admin", "leader"):
+            if self._role_index is not None:
+                if kind == "admin":
+                    self._role_index.set_admin(key, value)
+                else:
+                    self._role_index.add_leader(key, value)
+            self.invalidate_user_info(key)
+        elif kind == "user":
+            self._sync_directory_entry(key)
+        elif kind == "directory":
+            if self._user_directory is not None:
+                self._user_directory.invalidate()
+        elif kind == "all":
+            self.invalidate_user_info()
+            self.session_cache.clear()
+            if self._role_index is not None:
+                self._role_index.invalidate()
+            if self._user_directory is not None:
+                self._user_directory.invalidate()
+    
+    def _invalidate(self, kind, key=None, value=None):
+        """Сброс кэшей у себя и, если есть канал, в остальных процессах"""
+        self._apply_invalidation(kind, key, value)
+        self._publish(kind, key, value)
+    
+    def _publish(self, kind, key=None, value=None):
+        """Рассылка изменения остальным процессам (если есть канал)"""
+        if self._invalidation is not None:
+            try:
+                self._invalidation.publish(kind, key, value)
+            except sqlite3.Error as e:
+                print(f"Cache invalidation publish error: {e}")
+    
+    def apply_remote_invalidations(self):
+        """Применение изменений других процессов, возвращает их число"""
+        if self._invalidation is None:
+            return 0
+        changes = self._invalidation.poll()
+        for kind, key, value in changes:
+            self._apply_invalidation(kind, key, value)
+        return len(changes)
+    
+    def start_invalidation_listener(self, interval=0.25):
+        """Запуск опроса канала сброса кэшей каждые interval секунд"""
+        if self._invalidation is None:
+            return None
+        if self._invalidation_listener is not None and self._invalidation_listener.running:
+            return self._invalidation_listener
+        self._invalidation_listener = PeriodicTask(
+            self.apply_remote_invalidations, interval, name="cache-invalidation")
+        return self._invalidation_listener
+    
+    def stop_invalidation_listener(self):
+        if self._invalidation_listener is not None:
+            self._invalidation_listener.stop()
+            self._invalidation_listener = None
+    
+    def invalidation_stats(self):
+        """Счетчики канала сброса кэшей (пустой словарь, если канала нет)"""
+        return self._invalidation.stats() if self._invalidation is not None else {}
+    
+    def profile_cache_stats(self):
+        """Счетчики кэша профилей: попадания, промахи, вытеснения"""
+        return self.profile_cache.stats()
+    
+    def _load_user_info(self, email):
+        if self.joins_available:
+            return self._load_user_info_joined(email)
+        
+        with self.connection("users_full.db"):
+            user = self.query_one("profile.full", (email,))
+            if user:
+                # Получаем группы пользователя
+                groups = self.get_user_groups(email)
             
-            return user_dict
-        return None
+                # Получаем роли
+                is_leader = self.is_group_leader(email)
+                is_admin = self.is_admin(email)
+            
+                user_dict = dict(user)
+                user_dict['groups'] = groups
+                user_dict['is_leader'] = is_leader
+                user_dict['is_admin'] = is_admin
+            
+                # Добавляем настройки из JSON
+                if user_dict['settings_json']:
+                    user_dict['settings'] = json.loads(user_dict['settings_json'])
+                else:
+                    user_dict['settings'] = {}
+            
+                return user_dict
+            return None
+    
+    def _load_user_info_joined(self, email):
+        """Профиль, группы и роли одним запросом (режимы attached и unified)"""
+        user = self.query_one("profile.joined", (email,))
+        
+        if not user:
+            return None
+        
+        user_dict = dict(user)
+        is_leader = bool(user_dict.pop('is_leader'))
+        is_admin = bool(user_dict.pop('is_admin'))
+        user_dict['groups'] = json.loads(user_dict.pop('groups_json'))
+        user_dict['is_leader'] = is_leader
+        user_dict['is_admin'] = is_admin
+        
+        # Добавляем настройки из JSON
+        if user_dict['settings_json']:
+            user_dict['settings'] = json.loads(user_dict['settings_json'])
+        else:
+            user_dict['settings'] = {}
+        
+        return user_dict
     
     # Добавление пользователя в группу
     def add_user_to_group(self, user_email, group_id, group_name=None):
         # Сначала проверяем существование группы
-        conn_full = self.get_connection("groups_full.db")
-        cursor_full = conn_full.cursor()
-        
-        cursor_full.execute("SELECT group_id FROM groups_full WHERE group_id = ?", (group_id,))
-        if not cursor_full.fetchone():
+        if not self.query_one("groups.exists", (group_id,)):
             # Создаем группу, если она не существует
             if not group_name:
                 group_name = f"Группа {group_id}"
             
-            cursor_full.execute('''
-                INSERT INTO groups_full (group_id, group_name)
-                VALUES (?, ?)
-            ''', (group_id, group_name))
-            conn_full.commit()
+            self.execute_statement("groups.create", (group_id, group_name))
         
         # Добавляем пользователя в группу
-        conn_quick = self.get_connection("groups_quick.db")
-        cursor_quick = conn_quick.cursor()
-        
         try:
-            cursor_quick.execute('''
-                INSERT OR REPLACE INTO groups_quick (user_email, group_id)
-                VALUES (?, ?)
-            ''', (user_email, group_id))
-            conn_quick.commit()
+            self.execute_statement("groups.add_member", (user_email, group_id))
+            self._invalidate("profile", user_email)
             return True
         except:
             return False
     
     # Получение групп пользователя
     def get_user_groups(self, user_email):
-        conn = self.get_connection("groups_quick.db")
-        cursor = conn.cursor()
+        return [row['group_id'] for row in self.query_all("groups.user_groups", (user_email,))]
+    
+    # Список участников группы
+    def get_group_members(self, group_id, cursor=None, limit=50):
+        """Страница участников группы в порядке email
+        
+        cursor - email последнего участника предыдущей страницы (None для
+        первой). Возвращает словарь с участниками (email, nickname, full_name,
+        avatar), next_cursor (None на последней странице) и total - общим
+        числом участников из счетчика group_member_counts.
+        """
+        limit = max(1, min(int(limit), 500))
+        after = cursor if cursor is not None else ""
+        
+        if self.joins_available:
+            with self.connection("users_quick.db") as conn:
+                rows = conn.execute('''
+                    SELECT g.user_email AS email, f.nickname, f.full_name, f.avatar
+                    FROM groups_quick g INDEXED BY idx_groups_quick_group
+                    LEFT JOIN users_full f ON f.email = g.user_email
+                    WHERE g.group_id = ? AND g.user_email > ?
+                    ORDER BY g.user_email
+                    LIMIT ?
+                ''', (group_id, after, limit + 1)).fetchall()
+                total = conn.execute(
+                    "SELECT member_count FROM group_member_counts WHERE group_id = ?", (group_id,)
+                ).fetchone()
+            members = [dict(row) for row in rows]
+        else:
+            with self.connection("groups_quick.db") as conn:
+                emails = [row[0] for row in conn.execute('''
+                    SELECT user_email FROM groups_quick INDEXED BY idx_groups_quick_group
+                    WHERE group_id = ? AND user_email > ?
+                    ORDER BY user_email
+                    LIMIT ?
+                ''', (group_id, after, limit + 1))]
+                total = conn.execute(
+                    "SELECT member_count FROM group_member_counts WHERE group_id = ?", (group_id,)
+                ).fetchone()
+            
+            profiles = {}
+            if emails:
+                placeholders = ", ".join("?" * len(emails))
+                with self.connection("users_full.db") as conn:
+                    for row in conn.execute(f'''
+                        SELECT email, nickname, full_name, avatar FROM users_full
+                        WHERE email IN ({placeholders})
+                    ''', emails):
+                        profiles[row['email']] = dict(row)
+            members = [
+                profiles.get(email) or {"email": email, "nickname": None, "full_name": None, "avatar": None}
+                for email in emails
+            ]
         
-        cursor.execute('''
-            SELECT group_id FROM groups_quick WHERE user_email = ?
-        ''', (user_email,))
+        next_cursor = None
+        if len(members) > limit:
+            members = members[:limit]
+            next_cursor = members[-1]["email"]
         
-        return [row['group_id'] for row in cursor.fetchall()]
+        return {
+            "group_id": group_id,
+            "members": members,
+            "next_cursor": next_cursor,
+            "total": total[0] if total else 0,
+        }
+    
+    def get_group_member_count(self, group_id):
+        """Число участников группы (поддерживается триггерами, без подсчета строк)"""
+        row = self.query_one("groups.member_count", (group_id,))
+        return row[0] if row else 0
     
     # Проверка, является ли пользователь старостой
     def is_group_leader(self, user_email):
-        conn = self.get_connection("group_leaders.db")
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT group_id FROM group_leaders WHERE leader_email = ?
-        ''', (user_email,))
-        
-        return len(cursor.fetchall()) > 0
+        return self.get_roles([user_email])[user_email]["is_leader"]
     
     # Проверка, является ли пользователь администратором
     def is_admin(self, user_email):
-        conn = self.get_connection("admins.db")
-        cursor = conn.cursor()
+        return self.get_roles([user_email])[user_email]["is_admin"]
+    
+    # Роли для списка пользователей
+    def _query_roles(self, emails):
+        """Строки (email, permissions_json) и (email, group_id) из БД
+        
+        Запросы IN по 500 адресов на файл БД (основа - запросы реестра roles.all_*).
+        """
+        chunks = [emails[start:start + 500] for start in range(0, len(emails), 500)]
+        
+        def fetch(name, key_column):
+            db_name, query = QUERIES[name]
+            rows = []
+            with self.connection(db_name) as conn:
+                for chunk in chunks:
+                    placeholders = ", ".join("?" * len(chunk))
+                    rows.extend(tuple(row) for row in conn.execute(
+                        f"{query} WHERE {key_column} IN ({placeholders})", chunk))
+            return rows
+        
+        return fetch("roles.all_admins", "admin_email"), fetch("roles.all_leaders", "leader_email")
+    
+    def refresh_role_index(self):
+        """Загрузка ролей в индекс; False, если роли менялись во время загрузки"""
+        index = self._role_index
+        if index is None:
+            return False
+        generation = index.generation
+        admins = [tuple(row) for row in self.query_all("roles.all_admins")]
+        leaders = [tuple(row) for row in self.query_all("roles.all_leaders")]
+        return index.load(admins, leaders, generation)
+    
+    def get_roles(self, emails):
+        """Роли пользователей: email -> {is_admin, permissions, is_leader, led_groups}
+        
+        permissions - словарь прав администратора (None, если не администратор),
+        led_groups - отсортированный список групп, где пользователь староста.
+        """
+        emails = list(dict.fromkeys(emails))
+        index = self._role_index
+        if index is not None:
+            if not index.loaded:
+                self.refresh_role_index()
+            if index.loaded:
+                return index.lookup(emails)
+        
+        admins, leaders = self._query_roles(emails)
+        permissions = dict(admins)
+        groups = {}
+        for email, group_id in leaders:
+            groups.setdefault(email, []).append(group_id)
+        return {
+            email: RoleIndex.record(permissions.get(email), groups.get(email, ()))
+            for email in emails
+        }
+    
+    def role_index_stats(self):
+        """Счетчики индекса ролей (пустой словарь, если индекс выключен)"""
+        return self._role_index.stats() if self._role_index is not None else {}
+    
+    # Справочник пользователей
+    def refresh_user_directory(self):
+        """Загрузка справочника из users_full; False, если он менялся во время загрузки"""
+        directory = self._user_directory
+        if directory is None:
+            return False
+        generation = directory.generation
+        chunks = self.iter_table_chunks("users_full", ["email", "nickname", "full_name"], chunk_size=10000)
+        return directory.load((row for rows in chunks for row in rows), generation)
+    
+    def _directory_added(self, users):
+        """Новые пользователи (email, nickname, full_name) в справочник этого и других процессов"""
+        directory = self._user_directory
+        if directory is not None:
+            for email, nickname, full_name in users:
+                directory.put(email, nickname, full_name)
+        # Пачку импорта другие процессы перечитывают целиком
+        if len(users) == 1:
+            self._publish("user", users[0][0])
+        elif users:
+            self._publish("directory")
+    
+    def _sync_directory_entry(self, email):
+        """Перечитывание одного пользователя справочника из БД"""
+        directory = self._user_directory
+        if directory is None:
+            return
+        if not directory.loaded:
+            # Сдвигает поколение: идущая загрузка не установится
+            directory.remove(email)
+            return
+        row = self.query_one("users.directory_entry", (email,))
+        if row is None:
+            directory.remove(email)
+        else:
+            directory.put(*row)
+    
+    def search_users(self, prefix, fields=None, limit=20):
+        """Поиск пользователей по началу nickname, email или full_name
+        
+        Без учета регистра (в том числе кириллицы), "ё" и "е", "й" и "и" не
+        различаются (как в search);
+        full_name совпадает и по началу любого слова (фамилия внутри имени).
+        fields - подмножество UserDirectory.FIELDS (по умолчанию все).
+        Возвращает список словарей {email, nickname, full_name}.
+        """
+        fields = tuple(fields or UserDirectory.FIELDS)
+        unknown = set(fields) - set(UserDirectory.FIELDS)
+        if unknown:
+            raise ValueError(f"Неизвестные поля поиска: {', '.join(sorted(unknown))}")
+        prefix = (prefix or "").strip()
+        if not prefix or limit <= 0:
+            return []
+        
+        directory = self._user_directory
+        if directory is not None:
+            if not directory.loaded:
+                self.refresh_user_directory()
+            if directory.loaded:
+                return directory.search(prefix, fields, limit)
         
-        cursor.execute('''
-            SELECT admin_email FROM admins WHERE admin_email = ?
-        ''', (user_email,))
+        # Без справочника - полный просмотр таблицы
+        folded = _fold_name(prefix)
+        matches = {field: [] for field in fields}
+        word_matches = []
+        for rows in self.iter_table_chunks("users_full", ["email", "nickname", "full_name"], chunk_size=10000):
+            for email, nickname, full_name in rows:
+                entry = {"email": email, "nickname": nickname, "full_name": full_name}
+                for field in fields:
+                    if _fold_name(entry[field]).startswith(folded):
+                        matches[field].append(entry)
+                if "full_name" in fields:
+                    for offset in _word_offsets(full_name):
+                        key = _fold_name(full_name[offset:])
+                        if key.startswith(folded):
+                            word_matches.append((key, entry))
+        found = {}
+        for field in fields:
+            ordered = sorted(matches[field], key=lambda entry: _fold_name(entry[field]))
+            if field == "full_name":
+                # Как в UserDirectory.search: совпадения по следующим словам - после
+                ordered += [entry for _, entry in sorted(word_matches, key=lambda item: item[0])]
+            for entry in ordered:
+                if len(found) >= limit:
+                    break
+                found.setdefault(entry["email"], entry)
+        return list(found.values())
+    
+    def user_directory_stats(self):
+        """Счетчики справочника пользователей (пустой словарь, если он выключен)"""
+        return self._user_directory.stats() if self._user_directory is not None else {}
+    
+    # Полнотекстовый поиск
+    def search(self, query, kinds=None, limit=20, cursor=None):
+        """Поиск пользователей (full_name, nickname, bio) и групп (group_name, description)
+        
+        query - слова через пробел, каждое ищется как начало слова, все
+        обязательны. kinds - подмножество SEARCH_INDEXES (по умолчанию все).
+        Результаты упорядочены по bm25 (score: меньше - лучше); cursor -
+        значение next_cursor предыдущей страницы. Возвращает словарь
+        {query, results, next_cursor}; в results у каждого результата
+        поле kind ("users" или "groups").
+        """
+        kinds = tuple(kinds or SEARCH_INDEXES)
+        unknown = set(kinds) - set(SEARCH_INDEXES)
+        if unknown:
+            raise ValueError(f"Неизвестные виды поиска: {', '.join(sorted(unknown))}")
+        limit = max(1, min(int(limit), 100))
+        offset = max(0, int(cursor or 0))
+        
+        match = fts_query(query)
+        if match is None:
+            return {"query": query, "results": [], "next_cursor": None}
         
-        return cursor.fetchone() is not None
+        # Оценки bm25 разных таблиц сопоставимы по порядку величины;
+        # страница offset..offset+limit собирается слиянием по score
+        wanted = offset + limit + 1
+        results = []
+        if "users" in kinds:
+            results += [
+                {"kind": "users", "email": email, "nickname": nickname, "full_name": full_name, "score": score}
+                for email, nickname, full_name, score in self.query_all("search.users", (match, wanted))
+            ]
+        if "groups" in kinds:
+            results += [
+                {"kind": "groups", "group_id": group_id, "group_name": group_name,
+                 "description": description, "score": score}
+                for group_id, group_name, description, score in self.query_all("search.groups", (match, wanted))
+            ]
+        results.sort(key=lambda result: result["score"])
+        
+        page = results[offset:offset + limit]
+        next_cursor = str(offset + limit) if len(results) > offset + limit else None
+        for result in page:
+            result["score"] = round(result["score"], 4)
+        return {"query": query, "results": page, "next_cursor": next_cursor}
+    
+    def rebuild_search_index(self, kinds=None):
+        """Перестроение индексов поиска по содержимому таблиц"""
+        for kind in kinds or SEARCH_INDEXES:
+            table, db_name = SEARCH_INDEXES[kind]
+            with self.connection(db_name) as conn:
+                with conn:
+                    conn.execute(f"INSERT INTO {table} ({table}) VALUES ('rebuild')")
     
     # Назначение старосты
     def assign_group_leader(self, group_id, leader_email):
-        conn = self.get_connection("group_leaders.db")
-        cursor = conn.cursor()
-        
         try:
-            cursor.execute('''
-                INSERT OR REPLACE INTO group_leaders (group_id, leader_email)
-                VALUES (?, ?)
-            ''', (group_id, leader_email))
-            conn.commit()
+            self.execute_statement("roles.assign_leader", (group_id, leader_email))
+            self._invalidate("leader", leader_email, group_id)
             return True
         except:
             return False
     
     # Назначение администратора
     def assign_admin(self, admin_email, permissions=None):
-        conn = self.get_connection("admins.db")
-        cursor = conn.cursor()
-        
         permissions_json = json.dumps(permissions or {})
         
         try:
-            cursor.execute('''
-                INSERT OR REPLACE INTO admins (admin_email, permissions_json)
-                VALUES (?, ?)
-            ''', (admin_email, permissions_json))
-            conn.commit()
+            self.execute_statement("roles.assign_admin", (admin_email, permissions_json))
+            self._invalidate("admin", admin_email, permissions_json)
             return True
         except:
             return False
     
+    # Обновление профиля пользователя
+    def update_user_profile(self, email, **fields):
+        """Обновление полей профиля: nickname, full_name, avatar, theme,
+        notifications_enabled, bio, settings (словарь)"""
+        limits = {"nickname": 50, "full_name": 100, "avatar": 255, "theme": 20, "bio": 500}
+        
+        updates = {}
+        for name, value in fields.items():
+            if name in limits:
+                updates[name] = self.sanitize_input(value, limits[name]) if value else None
+            elif name == "notifications_enabled":
+                updates[name] = 1 if value else 0
+            elif name == "settings":
+                updates["settings_json"] = json.dumps(value or {})
+            else:
+                return False, f"Недопустимое поле профиля: {name}"
+        
+        if not updates:
+            return False, "Нет данных для обновления"
+        if "nickname" in updates and not updates["nickname"]:
+            return False, "Никнейм не может быть пустым"
+        
+        # Имена столбцов взяты из белого списка выше
+        assignments = ", ".join(f"{name} = ?" for name in updates)
+        try:
+            cursor = self.safe_execute("users_full.db",
+                f"UPDATE users_full SET {assignments} WHERE email = ?",
+                (*updates.values(), email))
+        except sqlite3.IntegrityError:
+            return False, "Пользователь с таким никнеймом уже существует"
+        except sqlite3.Error:
+            return False, "Ошибка базы данных"
+        finally:
+            self._invalidate("profile", email)
+        
+        if cursor.rowcount == 0:
+            return False, "Пользователь не найден"
+        if "nickname" in updates or "full_name" in updates:
+            self._invalidate("user", email)
+        return True, "Профиль обновлен"
+    
     # Создание демо-данных
     def create_demo_data(self):
         print("Создание демо-данных...")
@@ -668,13 +4450,38 @@ class DatabaseManager:
             ("admin@uniportal.ru", "admin123", "АдминСистемы", "Администратор", "IT-101")
         ]
         
-        # Регистрируем пользователей
-        for email, password, nickname, full_name, group_id in demo_users:
-            success, message = self.register_user(email, password, nickname, full_name, group_id)
-            if success:
-                print(f"✓ Создан пользователь: {email}")
+        # Еще несколько студентов
+        demo_users += [
+            (f"student{i}@uniportal.ru", "student123", f"Студент{i}", f"Студент {i}", "IT-101")
+            for i in range(1, 6)
+        ]
+        
+        # Регистрируем только отсутствующих: повторный запуск ничего не хэширует.
+        # Демо-пароли не проходят validate_password, поэтому пишем их напрямую
+        existing = self._existing_keys("users_quick.db", "users_quick", "email",
+                                       [user[0] for user in demo_users])
+        batch = [{
+            "email": email, "password": password, "salt": secrets.token_hex(16),
+            "nickname": nickname, "full_name": full_name, "group_id": group_id,
+        } for email, password, nickname, full_name, group_id in demo_users if email not in existing]
+        
+        hashes = self.get_password_hasher().map(
+            _password_hash_hex,
+            [user["password"] for user in batch],
+            [user["salt"] for user in batch],
+            [self.password_scheme] * len(batch),
+            [self.password_cost] * len(batch))
+        for user, digest in zip(batch, hashes):
+            user["password_hash"] = encode_password_hash(
+                self.password_scheme, self.password_cost, user["salt"], digest)
+        if batch:
+            self._write_import_batch(batch)
+        
+        for email, *_ in demo_users:
+            if email in existing:
+                print(f"• Уже существует: {email}")
             else:
-                print(f"✗ Ошибка создания {email}: {message}")
+                print(f"✓ Создан пользователь: {email}")
         
         # Назначаем старосту
         self.assign_group_leader("IT-101", "leader@uniportal.ru")
@@ -689,18 +4496,6 @@ class DatabaseManager:
         })
         print("✓ Назначен администратор")
         
-        # Создаем еще нескольких студентов
-        for i in range(1, 6):
-            email = f"student{i}@uniportal.ru"
-            nickname = f"Студент{i}"
-            full_name = f"Студент {i}"
-            
-            success, message = self.register_user(
-                email, "student123", nickname, full_name, "IT-101"
-            )
-            if success:
-                print(f"✓ Создан студент: {nickname}")
-        
         print("\n✅ Демо-данные успешно созданы!")
         print("\nДемо-аккаунты:")
         print("1. Студент: student@uniportal.ru / student123")
@@ -709,45 +4504,145 @@ class DatabaseManager:
     
     # Вспомогательная функция для создания группы
     def add_group(self, group_id, group_name, description=None):
-        conn = self.get_connection("groups_full.db")
-        cursor = conn.cursor()
-        
         try:
-            cursor.execute('''
-                INSERT OR REPLACE INTO groups_full (group_id, group_name, description)
-                VALUES (?, ?, ?)
-            ''', (group_id, group_name, description))
-            conn.commit()
+            self.execute_statement("groups.upsert", (group_id, group_name, description))
             return True
         except Exception as e:
             print(f"Ошибка создания группы: {e}")
             return False
     
     # Утилиты для просмотра данных
-    def view_table(self, db_name, table_name, limit=10):
-        conn = self.get_connection(db_name)
-        cursor = conn.cursor()
+    # Постраничное чтение и выгрузка таблиц
+    def table_columns(self, table, include_secrets=False):
+        """Столбцы таблицы из белого списка EXPORT_TABLES"""
+        if table not in EXPORT_TABLES:
+            raise ValueError(f"Таблица недоступна для выгрузки: {table}")
+        with self.connection(EXPORT_TABLES[table]) as conn:
+            columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+        if not include_secrets:
+            hidden = EXPORT_SECRET_COLUMNS.get(table, ())
+            columns = [column for column in columns if column not in hidden]
+        return columns
+    
+    def _export_columns(self, table, columns, include_secrets):
+        """Запрошенные столбцы, проверенные по table_columns (None - все доступные)"""
+        allowed = self.table_columns(table, include_secrets)
+        if columns is None:
+            return allowed
+        unknown = [column for column in columns if column not in allowed]
+        if unknown:
+            raise ValueError(f"Столбцы недоступны для выгрузки из {table}: {', '.join(unknown)}")
+        return list(columns)
+    
+    def fetch_table_page(self, table, after=None, limit=1000, columns=None, include_secrets=False):
+        """Страница строк по возрастанию rowid: (список кортежей, курсор следующей страницы)
+        
+        after - курсор, который вернула предыдущая страница (None для первой);
+        на последней странице курсор равен None. Каждая страница читается
+        отдельным коротким запросом, поэтому выгрузка не держит соединение
+        и снимок WAL открытыми. columns - подмножество table_columns(),
+        иначе ValueError (секретные столбцы - только с include_secrets).
+        """
+        return self._fetch_page(table, after, limit, self._export_columns(table, columns, include_secrets))
+    
+    def _fetch_page(self, table, after, limit, columns):
+        column_list = ", ".join(f'"{column}"' for column in columns)
         
-        cursor.execute(f"SELECT * FROM {table_name} LIMIT {limit}")
-        rows = cursor.fetchall()
+        with self.connection(EXPORT_TABLES[table]) as conn:
+            if after is None:
+                rows = conn.execute(
+                    f"SELECT rowid, {column_list} FROM {table} ORDER BY rowid LIMIT ?", (limit,)
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    f"SELECT rowid, {column_list} FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                    (after, limit)
+                ).fetchall()
+        
+        next_cursor = rows[-1][0] if len(rows) == limit else None
+        return [tuple(row)[1:] for row in rows], next_cursor
+    
+    def iter_table_chunks(self, table, columns=None, chunk_size=1000, limit=None, include_secrets=False):
+        """Генератор пачек строк (кортежей) таблицы; в памяти не больше одной пачки"""
+        columns = self._export_columns(table, columns, include_secrets)
+        after = None
+        remaining = limit
+        while remaining is None or remaining > 0:
+            size = chunk_size if remaining is None else min(chunk_size, remaining)
+            rows, after = self._fetch_page(table, after, size, columns)
+            if rows:
+                yield rows
+            if remaining is not None:
+                remaining -= len(rows)
+            if after is None:
+                return
+    
+    def iter_table(self, table, chunk_size=1000, limit=None, include_secrets=False):
+        """Генератор строк таблицы в виде словарей"""
+        columns = self.table_columns(table, include_secrets)
+        for rows in self.iter_table_chunks(table, columns, chunk_size, limit, include_secrets):
+            for row in rows:
+                yield dict(zip(columns, row))
+    
+    def export_table(self, table, out=None, fmt="jsonl", chunk_size=1000, limit=None,
+                     include_secrets=False):
+        """Потоковая выгрузка таблицы в JSONL или CSV
+        
+        out - путь к файлу, открытый текстовый файл или None (stdout).
+        Возвращает число выгруженных строк.
+        """
+        if fmt not in ("jsonl", "csv"):
+            raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+        if isinstance(out, (str, os.PathLike)):
+            with open(out, "w", encoding="utf-8", newline="") as f:
+                return self.export_table(table, f, fmt, chunk_size, limit, include_secrets)
+        if out is None:
+            out = sys.stdout
+        
+        columns = self.table_columns(table, include_secrets)
+        if fmt == "csv":
+            writer = csv.writer(out)
+            writer.writerow(columns)
+        
+        exported = 0
+        for rows in self.iter_table_chunks(table, columns, chunk_size, limit, include_secrets):
+            if fmt == "csv":
+                writer.writerows(rows)
+            else:
+                out.write("".join(
+                    json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=str) + "\n"
+                    for row in rows
+                ))
+            exported += len(rows)
+        return exported
+    
+    def export_all(self, out_dir, fmt="jsonl", chunk_size=1000, include_secrets=False):
+        """Выгрузка всех таблиц в out_dir/<таблица>.<формат>, возвращает число строк по таблицам"""
+        os.makedirs(out_dir, exist_ok=True)
+        return {
+            table: self.export_table(table, os.path.join(out_dir, f"{table}.{fmt}"), fmt,
+                                     chunk_size, include_secrets=include_secrets)
+            for table in EXPORT_TABLES
+        }
+    
+    def view_table(self, db_name, table_name, limit=10):
+        if EXPORT_TABLES.get(table_name) != db_name:
+            print(f"❌ Таблица {db_name}.{table_name} недоступна для просмотра")
+            return
         
-        print(f"\n=== {db_name}.{table_name} (первые {len(rows)} записей) ===")
-        for row in rows:
-            print(dict(row))
+        print(f"\n=== {db_name}.{table_name} (первые {limit} записей) ===")
+        for row in self.iter_table(table_name, chunk_size=limit, limit=limit):
+            print(row)
         print("=" * 50)
     
-    def view_all_data(self):
+    def view_all_data(self, limit=10):
         print("\n" + "="*60)
         print("ПРОСМОТР ВСЕХ БАЗ ДАННЫХ")
         print("="*60)
         
         # Показываем все таблицы
-        self.view_table("users_quick.db", "users_quick")
-        self.view_table("users_full.db", "users_full")
-        self.view_table("groups_quick.db", "groups_quick")
-        self.view_table("groups_full.db", "groups_full")
-        self.view_table("group_leaders.db", "group_leaders")
-        self.view_table("admins.db", "admins")
+        for table_name, db_name in EXPORT_TABLES.items():
+            self.view_table(db_name, table_name, limit)
     
     # Очистка всех данных
     def clear_all_data(self):
@@ -756,28 +4651,41 @@ class DatabaseManager:
             print("Операция отменена")
             return
         
-        databases = [
-            "users_quick.db",
-            "users_full.db", 
-            "groups_quick.db",
-            "groups_full.db",
-            "group_leaders.db",
-            "admins.db"
-        ]
+        # Файлы, которые использует текущий режим хранения
+        databases = sorted({self._physical_name(db_name) for db_name in DB_TABLES})
+        
+        # close() останавливает фоновые задачи: работавшие запустим заново
+        # с теми же функциями и интервалами после пересоздания баз
+        tasks = {}
+        for attr in ("_session_sweeper", "_log_archiver", "_invalidation_listener", "_snapshot_refresher"):
+            task = getattr(self, attr)
+            if task is not None and task.running:
+                tasks[attr] = task
+        
+        # Закрываем соединения до удаления файлов
+        self.close()
+        self._invalidate("all")
+        
+        # Снимки удаленных данных не должны попасть в отчеты
+        for path in glob.glob(os.path.join(glob.escape(self.snapshot_dir), "*.snapshot*")):
+            os.remove(path)
         
         for db_name in databases:
             db_path = os.path.join(self.db_dir, db_name)
             if os.path.exists(db_path):
                 os.remove(db_path)
                 print(f"🗑️  Удалена база данных: {db_name}")
-        
-        # Закрываем соединения
-        for conn in self.conns.values():
-            conn.close()
-        self.conns = {}
+            for suffix in ("-wal", "-shm"):
+                if os.path.exists(db_path + suffix):
+                    os.remove(db_path + suffix)
+            for component in DB_TABLES:
+                DatabaseManager._migrated.discard((os.path.abspath(db_path), component))
+        self._schema_ready.clear()
         
         # Пересоздаем базы
         self.init_databases()
+        for attr, task in tasks.items():
+            setattr(self, attr, PeriodicTask(task.fn, task.interval, name=task.name))
         print("✅ Все базы данных пересозданы")
 
 def main():
@@ -796,9 +4704,16 @@ def main():
         print("7. Добавить пользователя в группу")
         print("8. Очистить все данные и пересоздать")
         print("9. Выход")
+        print("10. Импорт пользователей из CSV/JSONL")
+        print("11. Перенести данные в единый файл БД")
+        print("12. Выгрузить таблицу в JSONL/CSV")
+        print("13. Создать демо-данные")
+        print("14. Поиск пользователей")
+        print("15. Полнотекстовый поиск")
+        print("16. Отчеты (по снимкам БД)")
         print("="*60)
         
-        choice = input("Выберите действие (1-9): ").strip()
+        choice = input("Выберите действие (1-16): ").strip()
         
         if choice == "1":
             db_manager.view_all_data()
@@ -826,7 +4741,7 @@ def main():
             email = input("Email: ").strip()
             password = getpass.getpass("Пароль: ").strip()
             
-            success, user_info, message = db_manager.authenticate_user(email, password)
+            success, user_info, _, message = db_manager.authenticate_user(email, password)
             if success:
                 print(f"✅ {message}")
                 print(f"Информация о пользователе:")
@@ -887,12 +4802,79 @@ def main():
         elif choice == "8":
             db_manager.clear_all_data()
         
+        elif choice == "10":
+            print("\n--- Импорт пользователей ---")
+            path = input("Путь к файлу (.csv или .jsonl): ").strip()
+            
+            if not os.path.isfile(path):
+                print("❌ Файл не найден")
+                continue
+            
+            report = db_manager.import_users(path, max_errors=20)
+            print(f"✅ Импортировано: {report['imported']} из {report['total']} "
+                  f"за {report['elapsed']:.1f} с")
+            if report["failed"]:
+                print(f"❌ Ошибок: {report['failed']}")
+                for error in report["errors"]:
+                    print(f"  строка {error['line']}: {error['email']} - {error['error']}")
+        
+        elif choice == "11":
+            print(f"\n--- Перенос данных в {UNIFIED_DB_NAME} ---")
+            db_manager.flush_security_events()
+            counts = migrate_to_unified(db_manager.db_dir)
+            for table, count in counts.items():
+                print(f"  {table}: {count}")
+            print("✅ Данные перенесены. Запуск в едином режиме: DatabaseManager(storage=\"unified\")")
+        
+        elif choice == "12":
+            print("\n--- Выгрузка таблицы ---")
+            print("Таблицы: " + ", ".join(EXPORT_TABLES))
+            table = input("Таблица: ").strip()
+            fmt = input("Формат (jsonl/csv) [jsonl]: ").strip().lower() or "jsonl"
+            path = input("Файл (пусто - вывод на экран): ").strip() or None
+            
+            try:
+                db_manager.flush_security_events()
+                count = db_manager.export_table(table, path, fmt)
+                print(f"✅ Выгружено строк: {count}")
+            except (ValueError, OSError) as e:
+                print(f"❌ {e}")
+        
+        elif choice == "13":
+            db_manager.create_demo_data()
+        
+        elif choice == "14":
+            prefix = input("\nНачало никнейма, email или имени: ").strip()
+            users = db_manager.search_users(prefix)
+            if not users:
+                print("Никого не найдено")
+            for user in users:
+                print(f"  {user['nickname']:<20} {user['email']:<30} {user['full_name'] or ''}")
+        
+        elif choice == "15":
+            query = input("\nПоиск по пользователям и группам: ").strip()
+            results = db_manager.search(query)["results"]
+            if not results:
+                print("Ничего не найдено")
+            for result in results:
+                if result["kind"] == "users":
+                    print(f"  👤 {result['nickname']:<20} {result['full_name'] or ''} ({result['email']})")
+                else:
+                    print(f"  👥 {result['group_id']:<20} {result['group_name']}")
+        
+        elif choice == "16":
+            for report in (db_manager.report_group_sizes(10), db_manager.report_login_activity(7),
+                           db_manager.report_active_sessions(10)):
+                print(f"\n--- {report['report']} (снимок {report['taken_at']}, "
+                      f"возраст {report['snapshot_age_s']} с) ---")
+                for row in report["rows"]:
+                    print("  " + "  ".join(f"{key}={value}" for key, value in row.items()))
+        
         elif choice == "9":
             print("\nВыход из программы")
             
             # Закрываем все соединения
-            for conn in db_manager.conns.values():
-                conn.close()
+            db_manager.close()
             
             break
         
@@ -0,0 +1,47 @@
+"""Полная очистка данных"""
+from database_manager import DatabaseManager
+
+
+def clear(db, monkeypatch):
+    monkeypatch.setattr("builtins.input", lambda prompt="": "yes")
+    db.clear_all_data()
+
+
+def test_clear_all_data_restarts_running_tasks(tmp_path, monkeypatch):
+    db = DatabaseManager(str(tmp_path), invalidation="sqlite", invalidation_interval=30.0)
+    try:
+        db.start_session_sweeper(interval=600.0)
+        db.start_log_archiver(interval=7200.0)
+
+        clear(db, monkeypatch)
+
+        assert db._session_sweeper.running and db._session_sweeper.interval == 600.0
+        assert db._log_archiver.running and db._log_archiver.interval == 7200.0
+        assert db._invalidation_listener.running and db._invalidation_listener.interval == 30.0
+    finally:
+        db.close()
+
+
+def test_clear_all_data_keeps_stopped_tasks_stopped(tmp_path, monkeypatch):
+    db = DatabaseManager(str(tmp_path), invalidation="sqlite")
+    try:
+        db.stop_invalidation_listener()
+
+        clear(db, monkeypatch)
+
+        assert db._session_sweeper is None
+        assert db._log_archiver is None
+        assert db._invalidation_listener is None
+    finally:
+        db.close()
+
+
+def test_clear_all_data_restarts_snapshot_refresher(tmp_path, monkeypatch):
+    db = DatabaseManager(str(tmp_path), snapshot_interval=900.0)
+    try:
+        clear(db, monkeypatch)
+
+        assert db._snapshot_refresher.running
+        assert db._snapshot_refresher.interval == 900.0
+    finally:
+        db.close()
@@ -0,0 +1,28 @@
+"""Выдача соединений из пула"""
+import warnings
+
+import pytest
+
+from database_manager import DatabaseManager
+
+
+def test_get_connection_outside_block_is_deprecated(tmp_path):
+    db = DatabaseManager(str(tmp_path))
+    try:
+        with pytest.warns(DeprecationWarning, match="connection"):
+            conn = db.get_connection("users_quick.db")
+        assert conn.execute("SELECT 1").fetchone()[0] == 1
+        db.release_connections()
+    finally:
+        db.close()
+
+
+def test_get_connection_inside_block_reuses_connection(tmp_path):
+    db = DatabaseManager(str(tmp_path))
+    try:
+        with db.connection("users_quick.db") as conn:
+            with warnings.catch_warnings():
+                warnings.simplefilter("error")
+                assert db.get_connection("users_quick.db") is conn
+    finally:
+        db.close()
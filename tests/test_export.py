@@ -0,0 +1,30 @@
+"""Постраничная выгрузка таблиц"""
+import pytest
+
+from database_manager import DatabaseManager
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = DatabaseManager(str(tmp_path))
+    assert db.register_user("user@test.ru", "Passw0rd1", "user")[0]
+    yield db
+    db.close()
+
+
+def test_secret_columns_require_include_secrets(db):
+    with pytest.raises(ValueError):
+        db.fetch_table_page("users_quick", columns=["password_hash", "salt"])
+    with pytest.raises(ValueError):
+        list(db.iter_table_chunks("users_quick", ["email", "salt"]))
+
+    rows, _ = db.fetch_table_page("users_quick", columns=["email", "salt"], include_secrets=True)
+    assert rows[0][0] == "user@test.ru" and rows[0][1]
+    assert "password_hash" in next(db.iter_table("users_quick", include_secrets=True))
+
+
+def test_unknown_table_or_column_is_value_error(db):
+    with pytest.raises(ValueError):
+        db.fetch_table_page("sqlite_master")
+    with pytest.raises(ValueError):
+        db.fetch_table_page("users_full", columns=['email" FROM users_quick --'])
@@ -0,0 +1,47 @@
+"""Счетчики участников групп (триггеры group_member_counts)"""
+import pytest
+
+from database_manager import DatabaseManager
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = DatabaseManager(str(tmp_path))
+    for i in range(3):
+        assert db.register_user(f"user{i}@test.ru", "Passw0rd1", f"user{i}")[0]
+    yield db
+    db.close()
+
+
+def execute(db, sql, params):
+    with db.connection("groups_quick.db") as conn:
+        with conn:
+            conn.execute(sql, params)
+
+
+def test_member_count_follows_inserts_deletes_and_moves(db):
+    for i in range(3):
+        db.add_user_to_group(f"user{i}@test.ru", "G-1", "Группа 1")
+    # Повторное добавление не меняет счетчик (INSERT OR IGNORE)
+    db.add_user_to_group("user0@test.ru", "G-1")
+    assert db.get_group_member_count("G-1") == 3
+
+    execute(db, "DELETE FROM groups_quick WHERE user_email = ? AND group_id = ?", ("user2@test.ru", "G-1"))
+    assert db.get_group_member_count("G-1") == 2
+
+    execute(db, "UPDATE groups_quick SET group_id = ? WHERE user_email = ?", ("G-2", "user1@test.ru"))
+    assert (db.get_group_member_count("G-1"), db.get_group_member_count("G-2")) == (1, 1)
+    assert db.get_group_member_count("G-unknown") == 0
+
+
+def test_group_members_total_matches_pages(db):
+    for i in range(3):
+        db.add_user_to_group(f"user{i}@test.ru", "G-1", "Группа 1")
+
+    first = db.get_group_members("G-1", limit=2)
+    second = db.get_group_members("G-1", cursor=first["next_cursor"], limit=2)
+
+    assert first["total"] == second["total"] == 3
+    assert [m["email"] for m in first["members"] + second["members"]] == [
+        "user0@test.ru", "user1@test.ru", "user2@test.ru"]
+    assert second["next_cursor"] is None
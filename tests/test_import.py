@@ -0,0 +1,57 @@
+"""Массовый импорт пользователей"""
+from database_manager import DatabaseManager
+
+
+def column(db, db_name, query):
+    with db.connection(db_name) as conn:
+        return {row[0] for row in conn.execute(query)}
+
+
+def test_failed_users_full_step_leaves_no_orphans(tmp_path, monkeypatch):
+    db = DatabaseManager(str(tmp_path))
+    try:
+        assert db.register_user("old@test.ru", "Passw0rd1", "taken")[0]
+
+        # Гонка: никнейм занят после проверки, шаг users_full падает на UNIQUE
+        existing_keys = db._existing_keys
+        monkeypatch.setattr(db, "_existing_keys", lambda db_name, table, column, values: (
+            set() if column == "nickname" else existing_keys(db_name, table, column, values)))
+
+        rows = [
+            {"email": "a@test.ru", "password": "Passw0rd1", "nickname": "alpha", "group_id": "G-1"},
+            {"email": "b@test.ru", "password": "Passw0rd1", "nickname": "taken", "group_id": "G-1"},
+            {"email": "c@test.ru", "password": "Passw0rd1", "nickname": "gamma"},
+        ]
+        report = db.import_users(rows)
+
+        assert report["imported"] == 2
+        assert [error["email"] for error in report["errors"]] == ["b@test.ru"]
+        quick = column(db, "users_quick.db", "SELECT email FROM users_quick")
+        full = column(db, "users_full.db", "SELECT email FROM users_full")
+        assert quick == full == {"old@test.ru", "a@test.ru", "c@test.ru"}
+        assert column(db, "groups_quick.db", "SELECT user_email FROM groups_quick") == {"a@test.ru"}
+    finally:
+        db.close()
+
+
+def test_import_with_password_hash_keeps_hash(tmp_path):
+    db = DatabaseManager(str(tmp_path))
+    try:
+        password_hash, salt = db.make_password_hash("Passw0rd1")
+        legacy_hash, legacy_salt = DatabaseManager.hash_password("Passw0rd1")
+        report = db.import_users([
+            {"email": "new@test.ru", "password_hash": password_hash, "nickname": "new"},
+            {"email": "old@test.ru", "password_hash": legacy_hash, "salt": legacy_salt, "nickname": "old"},
+            {"email": "bad@test.ru", "password_hash": "x$y", "nickname": "bad"},
+            {"email": "nosalt@test.ru", "password_hash": legacy_hash, "nickname": "nosalt"},
+        ])
+
+        assert report["imported"] == 2
+        assert [error["email"] for error in report["errors"]] == ["bad@test.ru", "nosalt@test.ru"]
+        rows, _ = db.fetch_table_page("users_quick", columns=["email", "password_hash", "salt"],
+                                      include_secrets=True)
+        assert ("new@test.ru", password_hash, salt) in rows
+        assert db.authenticate_user("new@test.ru", "Passw0rd1")[0]
+        assert db.authenticate_user("old@test.ru", "Passw0rd1")[0]
+    finally:
+        db.close()
@@ -0,0 +1,63 @@
+"""Канал сброса кэшей между процессами"""
+import pytest
+
+from database_manager import DatabaseManager, InvalidationChannel
+
+
+def test_channel_delivers_only_other_origins_changes(tmp_path):
+    path = str(tmp_path / "cache_changes.db")
+    first, second = InvalidationChannel(path), InvalidationChannel(path)
+    try:
+        first.publish("profile", "user@test.ru")
+        second.publish("session", "abc")
+
+        assert second.poll() == [("profile", "user@test.ru", None)]
+        assert first.poll() == [("session", "abc", None)]
+        assert first.poll() == second.poll() == []
+
+        # Новый канал начинает с конца таблицы
+        late = InvalidationChannel(path)
+        assert late.poll() == []
+        late.close()
+    finally:
+        first.close()
+        second.close()
+
+
+@pytest.fixture
+def workers(tmp_path):
+    # Два "процесса"; опрос вручную, без фоновых потоков
+    managers = [DatabaseManager(str(tmp_path), invalidation="sqlite", role_index_ttl=None)
+                for _ in range(2)]
+    for db in managers:
+        db.stop_invalidation_listener()
+    yield managers
+    for db in managers:
+        db.close()
+
+
+def test_session_revoke_reaches_other_process(workers):
+    first, second = workers
+    assert first.register_user("user@test.ru", "Passw0rd1", "user")[0]
+    token = first.generate_session_token()
+    first.save_session("user@test.ru", token, "127.0.0.1")
+    assert second.validate_session(token) == (True, "user@test.ru")
+
+    first.revoke_session(token)
+    assert second.apply_remote_invalidations() > 0
+    assert second.validate_session(token) == (False, None)
+
+
+def test_profile_and_role_changes_reach_other_process(workers):
+    first, second = workers
+    assert first.register_user("user@test.ru", "Passw0rd1", "user", "Старое Имя")[0]
+    second.apply_remote_invalidations()
+    assert second.get_user_info("user@test.ru")["full_name"] == "Старое Имя"
+    assert not second.is_admin("user@test.ru")
+
+    first.update_user_profile("user@test.ru", full_name="Новое Имя")
+    first.assign_admin("user@test.ru")
+    second.apply_remote_invalidations()
+
+    assert second.get_user_info("user@test.ru")["full_name"] == "Новое Имя"
+    assert second.is_admin("user@test.ru")
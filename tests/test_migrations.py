@@ -0,0 +1,147 @@
+"""Миграции схемы: обновление баз, созданных до реестра миграций"""
+import sqlite3
+
+import pytest
+
+from database_manager import SCHEMA_MIGRATIONS, DatabaseManager
+
+# Схема файлов до реестра миграций: таблицы без новых столбцов и с внешними
+# ключами на другие файлы, без schema_migrations
+LEGACY_SCHEMA = {
+    "users_quick.db": '''
+        CREATE TABLE users_quick (
+            email TEXT PRIMARY KEY,
+            password_hash TEXT NOT NULL,
+            salt TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_login TIMESTAMP
+        );
+        CREATE INDEX idx_email ON users_quick(email);
+    ''',
+    "users_full.db": '''
+        CREATE TABLE users_full (
+            email TEXT PRIMARY KEY,
+            nickname TEXT NOT NULL UNIQUE,
+            full_name TEXT,
+            avatar TEXT,
+            theme TEXT DEFAULT 'light',
+            notifications_enabled INTEGER DEFAULT 1,
+            bio TEXT,
+            settings_json TEXT DEFAULT '{}',
+            FOREIGN KEY (email) REFERENCES users_quick(email) ON DELETE CASCADE
+        );
+        CREATE INDEX idx_nickname ON users_full(nickname);
+    ''',
+    "groups_quick.db": '''
+        CREATE TABLE groups_quick (
+            user_email TEXT,
+            group_id TEXT NOT NULL,
+            PRIMARY KEY (user_email, group_id),
+            FOREIGN KEY (user_email) REFERENCES users_quick(email) ON DELETE CASCADE
+        );
+        CREATE INDEX idx_user_group ON groups_quick(user_email, group_id);
+    ''',
+    "groups_full.db": '''
+        CREATE TABLE groups_full (
+            group_id TEXT PRIMARY KEY,
+            group_name TEXT NOT NULL,
+            description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            settings_json TEXT DEFAULT '{}'
+        );
+        CREATE INDEX idx_group_name ON groups_full(group_name);
+    ''',
+    "group_leaders.db": '''
+        CREATE TABLE group_leaders (
+            group_id TEXT NOT NULL,
+            leader_email TEXT NOT NULL,
+            PRIMARY KEY (group_id, leader_email),
+            FOREIGN KEY (group_id) REFERENCES groups_full(group_id) ON DELETE CASCADE,
+            FOREIGN KEY (leader_email) REFERENCES users_quick(email) ON DELETE CASCADE
+        );
+    ''',
+    "admins.db": '''
+        CREATE TABLE admins (
+            admin_email TEXT PRIMARY KEY,
+            permissions_json TEXT DEFAULT '{}',
+            FOREIGN KEY (admin_email) REFERENCES users_quick(email) ON DELETE CASCADE
+        );
+    ''',
+}
+
+
+def legacy_db(path, db_name, data=()):
+    conn = sqlite3.connect(str(path / db_name))
+    conn.executescript(LEGACY_SCHEMA[db_name])
+    for sql, params in data:
+        conn.execute(sql, params)
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def legacy_dir(tmp_path):
+    password_hash, salt = DatabaseManager.hash_password("Passw0rd1")
+    legacy_db(tmp_path, "users_quick.db", [
+        ("INSERT INTO users_quick (email, password_hash, salt) VALUES (?, ?, ?)",
+         (email, password_hash, salt)) for email in ("ivan@test.ru", "anna@test.ru")])
+    legacy_db(tmp_path, "users_full.db", [
+        ("INSERT INTO users_full (email, nickname, full_name) VALUES (?, ?, ?)", row)
+        for row in (("ivan@test.ru", "ivan", "Иван Петров"), ("anna@test.ru", "anna", "Анна Смирнова"))])
+    legacy_db(tmp_path, "groups_quick.db", [
+        ("INSERT INTO groups_quick (user_email, group_id) VALUES (?, ?)", (email, "G-1"))
+        for email in ("ivan@test.ru", "anna@test.ru")])
+    legacy_db(tmp_path, "groups_full.db", [
+        ("INSERT INTO groups_full (group_id, group_name) VALUES (?, ?)", ("G-1", "Группа 1"))])
+    legacy_db(tmp_path, "group_leaders.db", [
+        ("INSERT INTO group_leaders (group_id, leader_email) VALUES (?, ?)", ("G-1", "ivan@test.ru"))])
+    legacy_db(tmp_path, "admins.db")
+    return tmp_path
+
+
+def schema_version(path, db_name):
+    conn = sqlite3.connect(str(path / db_name))
+    try:
+        return conn.execute("SELECT MAX(version) FROM schema_migrations WHERE db_name = ?",
+                            (db_name,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_legacy_databases_are_upgraded_in_place(legacy_dir):
+    db = DatabaseManager(str(legacy_dir))
+    try:
+        db.init_databases()
+        for db_name, migrations in SCHEMA_MIGRATIONS.items():
+            assert schema_version(legacy_dir, db_name) == migrations[-1][0]
+
+        # Данные сохранены, новые столбцы и счетчики заполнены по ним
+        assert db.get_user_info("ivan@test.ru")["full_name"] == "Иван Петров"
+        assert db.get_group_member_count("G-1") == 2
+        assert db.is_group_leader("ivan@test.ru")
+        assert [result["email"] for result in db.search("смирн")["results"]] == ["anna@test.ru"]
+
+        # Вход по старому хэшу работает (столбцы блокировки добавлены)
+        assert db.authenticate_user("ivan@test.ru", "Passw0rd1")[0]
+        # Внешние ключи на другие файлы удалены: регистрация больше не падает
+        assert db.register_user("new@test.ru", "Passw0rd1", "newbie", group_id="G-1")[0]
+        assert db.get_group_member_count("G-1") == 3
+    finally:
+        db.close()
+
+
+def test_upgraded_databases_are_not_migrated_again(legacy_dir):
+    first = DatabaseManager(str(legacy_dir))
+    first.init_databases()
+    first.close()
+    # Как в новом процессе: проверка схемы не пропускается по кэшу класса
+    DatabaseManager._migrated.clear()
+    db = DatabaseManager(str(legacy_dir))
+    try:
+        db.init_databases()
+        conn = sqlite3.connect(str(legacy_dir / "users_full.db"))
+        applied = conn.execute("SELECT COUNT(*) FROM schema_migrations").fetchone()[0]
+        conn.close()
+        assert applied == len(SCHEMA_MIGRATIONS["users_full.db"])
+    finally:
+        db.close()
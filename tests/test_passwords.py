@@ -0,0 +1,68 @@
+"""Хэши паролей: прежний формат, перехэширование при входе, испорченные хэши"""
+import asyncio
+
+import pytest
+
+from database_manager import DatabaseManager, parse_password_hash
+
+PASSWORD = "Passw0rd1"
+MALFORMED = ["x$y", "pbkdf2_sha256$abc$salt$00", "pbkdf2_sha256$-1$salt$00",
+             "unknown$1$salt$00", "scrypt$8$salt$00", None]
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = DatabaseManager(str(tmp_path), password_cost=1000)
+    assert db.register_user("user@test.ru", PASSWORD, "user")[0]
+    yield db
+    db.close()
+
+
+def set_stored_hash(db, password_hash, salt):
+    with db.connection("users_quick.db") as conn:
+        with conn:
+            conn.execute("UPDATE users_quick SET password_hash = ?, salt = ? WHERE email = ?",
+                         (password_hash, salt, "user@test.ru"))
+
+
+def stored_hash(db):
+    with db.connection("users_quick.db") as conn:
+        return conn.execute("SELECT password_hash FROM users_quick WHERE email = ?",
+                            ("user@test.ru",)).fetchone()[0]
+
+
+def test_legacy_hex_hash_verifies():
+    password_hash, salt = DatabaseManager.hash_password(PASSWORD)
+    assert "$" not in password_hash
+    assert DatabaseManager.verify_password(PASSWORD, password_hash, salt)
+    assert not DatabaseManager.verify_password("Wrong0pass", password_hash, salt)
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_login_rehashes_legacy_hash(db, use_async):
+    set_stored_hash(db, *DatabaseManager.hash_password(PASSWORD))
+
+    if use_async:
+        result = asyncio.run(db.authenticate_user_async("user@test.ru", PASSWORD))
+    else:
+        result = db.authenticate_user("user@test.ru", PASSWORD)
+
+    assert result[0]
+    scheme, cost, _, _ = parse_password_hash(stored_hash(db))
+    assert (scheme, cost) == (db.password_scheme, db.password_cost)
+    assert not db.needs_rehash(stored_hash(db))
+    assert db.authenticate_user("user@test.ru", PASSWORD)[0]
+
+
+@pytest.mark.parametrize("password_hash", MALFORMED)
+def test_malformed_hash_is_rejected(password_hash):
+    assert DatabaseManager.verify_password(PASSWORD, password_hash, "salt") is False
+
+
+@pytest.mark.parametrize("password_hash", MALFORMED[:-1])
+def test_malformed_stored_hash_fails_login(db, password_hash):
+    set_stored_hash(db, password_hash, "salt")
+
+    assert db.needs_rehash(password_hash)
+    assert db.authenticate_user("user@test.ru", PASSWORD)[0] is False
+    assert asyncio.run(db.authenticate_user_async("user@test.ru", PASSWORD))[0] is False
@@ -0,0 +1,42 @@
+"""Кэш профилей get_user_info"""
+import time
+
+from database_manager import DatabaseManager
+
+
+def test_load_racing_a_write_is_not_cached(tmp_path):
+    db = DatabaseManager(str(tmp_path))
+    try:
+        assert db.register_user("user@test.ru", "Passw0rd1", "user", "Старое Имя")[0]
+        load = db._load_user_info
+
+        def load_then_write(email):
+            # Запись и сброс кэша приходятся между чтением профиля и set()
+            profile = load(email)
+            db.update_user_profile(email, full_name="Новое Имя")
+            return profile
+
+        db._load_user_info = load_then_write
+        assert db.get_user_info("user@test.ru")["full_name"] == "Старое Имя"
+        db._load_user_info = load
+
+        assert db.get_user_info("user@test.ru")["full_name"] == "Новое Имя"
+    finally:
+        db.close()
+
+
+def test_profile_changed_by_another_process_expires(tmp_path):
+    server = DatabaseManager(str(tmp_path), profile_cache_ttl=0.2)
+    cli = DatabaseManager(str(tmp_path))
+    try:
+        assert server.register_user("user@test.ru", "Passw0rd1", "user", "Старое Имя")[0]
+        assert server.get_user_info("user@test.ru")["full_name"] == "Старое Имя"
+
+        cli.update_user_profile("user@test.ru", full_name="Новое Имя")
+        assert server.get_user_info("user@test.ru")["full_name"] == "Старое Имя"
+
+        time.sleep(0.3)
+        assert server.get_user_info("user@test.ru")["full_name"] == "Новое Имя"
+    finally:
+        cli.close()
+        server.close()
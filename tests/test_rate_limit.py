@@ -0,0 +1,59 @@
+"""Ограничение частоты запросов"""
+import pytest
+
+from database_manager import DatabaseManager, SlidingWindowRateLimiter, SQLiteRateLimiter
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_limiter(request, tmp_path):
+    limiters = []
+
+    def make():
+        if request.param == "memory":
+            limiter = SlidingWindowRateLimiter()
+        else:
+            limiter = SQLiteRateLimiter(str(tmp_path / "rate_limits.db"))
+        limiters.append(limiter)
+        return limiter
+
+    yield make
+    for limiter in limiters:
+        if hasattr(limiter, "close"):
+            limiter.close()
+
+
+def test_limit_per_key(make_limiter):
+    limiter = make_limiter()
+    assert all(limiter.hit(("10.0.0.1", "login"), 3, 60) for _ in range(3))
+    assert not limiter.hit(("10.0.0.1", "login"), 3, 60)
+    assert limiter.hit(("10.0.0.2", "login"), 3, 60)
+
+    stats = limiter.stats()
+    assert (stats["allowed"], stats["rejected"], stats["keys"]) == (4, 1, 2)
+
+    limiter.reset(("10.0.0.1", "login"))
+    assert limiter.hit(("10.0.0.1", "login"), 3, 60)
+
+
+def test_sqlite_limiter_is_shared_between_instances(tmp_path):
+    first = SQLiteRateLimiter(str(tmp_path / "rate_limits.db"))
+    second = SQLiteRateLimiter(str(tmp_path / "rate_limits.db"))
+    try:
+        assert first.hit("key", 2, 60) and second.hit("key", 2, 60)
+        assert not first.hit("key", 2, 60)
+        assert not hasattr(first, "_buckets")
+    finally:
+        first.close()
+        second.close()
+
+
+def test_rate_limits_are_configurable(tmp_path):
+    db = DatabaseManager(str(tmp_path), rate_limits={"login": (50, 15)})
+    try:
+        assert all(db.check_rate_limit("10.0.0.1", "login") for _ in range(50))
+        assert not db.check_rate_limit("10.0.0.1", "login")
+        # Остальные действия - по RATE_LIMITS
+        assert all(db.check_rate_limit("10.0.0.1", "register") for _ in range(5))
+        assert not db.check_rate_limit("10.0.0.1", "register")
+    finally:
+        db.close()
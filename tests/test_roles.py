@@ -0,0 +1,36 @@
+"""Индекс ролей"""
+import time
+
+from database_manager import DatabaseManager
+
+
+def test_roles_granted_by_another_process_become_visible(tmp_path):
+    server = DatabaseManager(str(tmp_path), role_index_ttl=0.2)
+    cli = DatabaseManager(str(tmp_path), role_index=False)
+    try:
+        assert server.register_user("user@test.ru", "Passw0rd1", "user")[0]
+        assert not server.is_admin("user@test.ru")
+
+        cli.assign_admin("user@test.ru")
+        assert cli.is_admin("user@test.ru")
+
+        time.sleep(0.3)
+        assert server.is_admin("user@test.ru")
+    finally:
+        cli.close()
+        server.close()
+
+
+def test_local_grants_update_index_without_reload(tmp_path):
+    db = DatabaseManager(str(tmp_path), role_index_ttl=None)
+    try:
+        assert db.register_user("user@test.ru", "Passw0rd1", "user")[0]
+        assert not db.is_admin("user@test.ru")
+        loads = db.role_index_stats()["loads"]
+
+        db.assign_admin("user@test.ru", {"manage_users": True})
+
+        assert db.get_roles(["user@test.ru"])["user@test.ru"]["permissions"] == {"manage_users": True}
+        assert db.role_index_stats()["loads"] == loads
+    finally:
+        db.close()
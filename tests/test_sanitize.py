@@ -0,0 +1,96 @@
+"""sanitize_input и sanitize_many против прежней реализации"""
+import html
+import random
+import re
+
+import pytest
+
+from database_manager import DatabaseManager
+
+
+def reference_sanitize_input(input_str, max_length=255):
+    """Прежняя реализация sanitize_input (эталон для сравнения)"""
+    if not input_str:
+        return ""
+    sanitized = str(input_str)
+    if len(sanitized) > max_length:
+        sanitized = sanitized[:max_length]
+    sanitized = html.escape(sanitized)
+    sql_patterns = [
+        r'(\s*;\s*|\s*--\s*|\s*/\*\s*|\s*\*/\s*|\s*union\s+select\s*|\s*drop\s+table\s*|\s*delete\s+from\s*|\s*insert\s+into\s*|\s*update\s+set\s*)',
+        r'(\s*or\s+1\s*=\s*1\s*|\s*and\s+1\s*=\s*1\s*)',
+        r'(\s*exec\s*\(|\s*xp_cmdshell\s*)',
+        r'(\s*<script\b[^>]*>.*?</script\s*>|\s*javascript:|\s*on\w+\s*=)',
+        r'(\s*alert\s*\(|\s*prompt\s*\(|\s*confirm\s*\()'
+    ]
+    for pattern in sql_patterns:
+        sanitized = re.sub(pattern, '', sanitized, flags=re.IGNORECASE)
+    sanitized = ''.join(char for char in sanitized if ord(char) >= 32)
+    return sanitized.strip()
+
+
+TYPICAL = [
+    "student@uniportal.ru",
+    "ИванСтудент",
+    "Анна Петрова",
+    "IT-101",
+    "Информационные технологии 101",
+    "john.doe+tag@example.com",
+    "Студент 42",
+]
+
+MALICIOUS = [
+    "<script>alert(1)</script>",
+    "' OR 1=1; --",
+    "admin'; DROP TABLE users_quick; --",
+    "x UNION SELECT password_hash FROM users_quick",
+    "<img src=x onerror=alert(1)>",
+    "javascript:confirm('hi')",
+    "o;r 1=1",
+    "exec(xp_cmdshell 'dir')",
+    "a\x00b\x1fc\td\ne",
+    "  padded  ",
+    "/* comment */ value",
+]
+
+# Фрагменты для случайных строк: части шаблонов, пробелы, кириллица, управляющие
+FRAGMENTS = [
+    "or", "OR", " ", "1", "=", ";", "--", "/*", "*/", "union", "select",
+    "drop", "table", "delete", "from", "insert", "into", "update", "set",
+    "and", "exec", "(", "xp_cmdshell", "<", ">", "script", "</script>",
+    "javascript:", "on", "click", "alert", "prompt", "confirm", "&", "'",
+    '"', "\t", "\n", "\x00", "\x07", "ё", "Ж", "a", "Z", "@", ".", " ",
+]
+
+
+def fuzz_corpus(count, seed):
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield "".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(0, 40)))
+
+
+def corpus(fuzz=20000, seed=1):
+    values = [None, "", 0, 12345] + TYPICAL + MALICIOUS + ["x" * 400]
+    values.extend(fuzz_corpus(fuzz, seed))
+    return values
+
+
+def mismatches(values, max_length):
+    found = []
+    for value in values:
+        expected = reference_sanitize_input(value, max_length)
+        actual = DatabaseManager.sanitize_input(value, max_length)
+        if expected != actual:
+            found.append((value, expected, actual))
+    return found
+
+
+@pytest.mark.parametrize("max_length", [255, 50, 10])
+def test_sanitize_input_matches_reference(max_length):
+    assert mismatches(corpus(), max_length) == []
+
+
+def test_sanitize_many_matches_reference():
+    values = corpus(fuzz=2000)
+    assert DatabaseManager.sanitize_many(values, 50) == [
+        reference_sanitize_input(value, 50) for value in values]
@@ -0,0 +1,65 @@
+"""Свертка букв в поиске: одинаковая для FTS5 и справочника пользователей"""
+import sqlite3
+
+import pytest
+
+import database_manager
+from database_manager import DatabaseManager, apply_migrations
+
+NAME = "Йосиф Ёлкин"
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = DatabaseManager(str(tmp_path))
+    assert db.register_user("iosif@test.ru", "Passw0rd1", "iosif", NAME)[0]
+    db.add_user_to_group("iosif@test.ru", "G-1", "Йошкар-Ола")
+    yield db
+    db.close()
+
+
+def emails(db, query):
+    return [result["email"] for result in db.search(query, kinds=["users"])["results"]]
+
+
+@pytest.mark.parametrize("query", ["иосиф", "Йосиф", "елкин", "ЁЛКИН", "иос ёлк"])
+def test_full_text_search_folds_yo_and_short_i(db, query):
+    assert emails(db, query) == ["iosif@test.ru"]
+
+
+def test_group_search_folds_short_i(db):
+    assert [result["group_id"] for result in db.search("иошкар", kinds=["groups"])["results"]] == ["G-1"]
+
+
+@pytest.mark.parametrize("user_directory", [True, False])
+@pytest.mark.parametrize("prefix", ["иосиф", "елк"])
+def test_prefix_search_uses_same_folding(tmp_path, user_directory, prefix):
+    db = DatabaseManager(str(tmp_path), user_directory=user_directory)
+    try:
+        assert db.register_user("iosif@test.ru", "Passw0rd1", "iosif", NAME)[0]
+        assert [user["email"] for user in db.search_users(prefix)] == ["iosif@test.ru"]
+    finally:
+        db.close()
+
+
+def test_index_built_with_old_folding_is_rebuilt(tmp_path, monkeypatch):
+    # Схема версии 3: индекс сворачивал только "ё"
+    migrations = database_manager.SCHEMA_MIGRATIONS["users_full.db"]
+    columns = ["full_name", "nickname", "bio"]
+    monkeypatch.setattr(database_manager, "_SEARCH_FOLDS", (("ё", "е"),))
+    old = migrations[:2] + [(3, migrations[2][1], database_manager._fts_index("users_full", "users_fts", columns))]
+    monkeypatch.undo()
+
+    conn = sqlite3.connect(str(tmp_path / "users_full.db"))
+    apply_migrations(conn, "users_full.db", old)
+    with conn:
+        conn.execute("INSERT INTO users_full (email, nickname, full_name) VALUES (?, ?, ?)",
+                     ("iosif@test.ru", "iosif", NAME))
+    assert conn.execute("SELECT COUNT(*) FROM users_fts WHERE users_fts MATCH 'иосиф*'").fetchone()[0] == 0
+    conn.close()
+
+    db = DatabaseManager(str(tmp_path))
+    try:
+        assert emails(db, "иосиф") == ["iosif@test.ru"]
+    finally:
+        db.close()
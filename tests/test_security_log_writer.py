@@ -0,0 +1,18 @@
+"""Фоновая запись журнала безопасности"""
+import atexit
+
+import database_manager
+from database_manager import DatabaseManager
+
+
+def test_writers_do_not_accumulate_exit_handlers(tmp_path):
+    callbacks = atexit._ncallbacks()
+    for i in range(3):
+        db = DatabaseManager(str(tmp_path / str(i)))
+        db.log_security_event("10.0.0.1", "login", "user@test.ru", success=True)
+        writer = db._security_log_writer
+        assert writer in database_manager._OPEN_SECURITY_LOG_WRITERS
+        db.close()
+        assert writer not in database_manager._OPEN_SECURITY_LOG_WRITERS
+
+    assert atexit._ncallbacks() == callbacks
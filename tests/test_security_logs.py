@@ -0,0 +1,101 @@
+"""Поиск по архивам журнала безопасности"""
+import gzip
+import json
+import os
+import threading
+import tracemalloc
+from datetime import datetime, timedelta
+
+import pytest
+
+from database_manager import DatabaseManager
+
+
+def write_archive(db, month, records):
+    os.makedirs(db.archive_dir, exist_ok=True)
+    with gzip.open(db._archive_path(month), "wt", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+def make_records(first_id, count, email="user@test.ru"):
+    return [{
+        "id": first_id + i,
+        "timestamp": (datetime(2024, 1, 1) + timedelta(seconds=i)).strftime("%Y-%m-%d %H:%M:%S"),
+        "ip_address": "10.0.0.1",
+        "event_type": "login",
+        "user_email": email,
+        "success": 1,
+        "error_message": None,
+        "user_agent": None,
+    } for i in range(count)]
+
+
+def peak_memory(db, **query):
+    tracemalloc.start()
+    try:
+        result = db.query_security_logs(**query)
+        return tracemalloc.get_traced_memory()[1], result
+    finally:
+        tracemalloc.stop()
+
+
+def test_archive_scan_memory_does_not_grow_with_matches(tmp_path):
+    small = DatabaseManager(str(tmp_path / "small"))
+    large = DatabaseManager(str(tmp_path / "large"))
+    try:
+        write_archive(small, "2024-01", make_records(1, 20000))
+        write_archive(large, "2024-01", make_records(1, 200000))
+
+        small_peak, small_result = peak_memory(small, user_email="user@test.ru", limit=10)
+        large_peak, large_result = peak_memory(large, user_email="user@test.ru", limit=10)
+
+        assert len(small_result) == len(large_result) == 10
+        assert large_result[0]["id"] == 200000
+        # В 10 раз больше совпадений, а пиковая память почти та же
+        assert large_peak < small_peak * 1.5
+    finally:
+        small.close()
+        large.close()
+
+
+def test_archive_duplicates_are_returned_once(tmp_path):
+    db = DatabaseManager(str(tmp_path))
+    try:
+        records = make_records(1, 50)
+        # Повтор пачки после сбоя между дозаписью архива и удалением
+        write_archive(db, "2024-01", records + records[-5:])
+        result = db.query_security_logs(limit=10)
+        ids = [record["id"] for record in result]
+        assert ids == list(range(50, 40, -1))
+    finally:
+        db.close()
+
+
+def test_archiving_waits_for_archive_file_lock(tmp_path):
+    fcntl = pytest.importorskip("fcntl")
+    db = DatabaseManager(str(tmp_path), async_security_log=False)
+    try:
+        with db.connection("users_quick.db") as conn:
+            with conn:
+                conn.executemany('''
+                    INSERT INTO security_logs (timestamp, ip_address, event_type, user_email, success)
+                    VALUES (?, '10.0.0.1', 'login', 'user@test.ru', 1)
+                ''', [(record["timestamp"],) for record in make_records(1, 100)])
+
+        # Блокировку держит "другой процесс" - отдельное открытие файла
+        os.makedirs(db.archive_dir, exist_ok=True)
+        with open(os.path.join(db.archive_dir, ".archive.lock"), "a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            worker = threading.Thread(target=db.archive_security_logs)
+            worker.start()
+            worker.join(0.3)
+            assert worker.is_alive()
+            assert not os.path.exists(db._archive_path("2024-01"))
+        worker.join(5)
+
+        assert not worker.is_alive()
+        with gzip.open(db._archive_path("2024-01"), "rt", encoding="utf-8") as f:
+            assert len(f.readlines()) == 100
+    finally:
+        db.close()
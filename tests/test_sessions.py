@@ -0,0 +1,75 @@
+"""Очистка сессий"""
+from database_manager import DatabaseManager
+
+
+def add_sessions(db, prefix, count, expired=False, revoked=False):
+    with db.connection("users_quick.db") as conn:
+        with conn:
+            conn.executemany('''
+                INSERT INTO sessions (session_id, user_email, ip_address, expires_at, is_valid)
+                VALUES (?, 'user@test.ru', '127.0.0.1',
+                        datetime('now', ?), ?)
+            ''', [(f"{prefix}{i}", "-1 hours" if expired else "+1 hours", 0 if revoked else 1)
+                  for i in range(count)])
+
+
+def count_sessions(db, where):
+    with db.connection("users_quick.db") as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM sessions WHERE {where}").fetchone()[0]
+
+
+def test_revoked_sessions_purged_despite_expired_backlog(tmp_path):
+    db = DatabaseManager(str(tmp_path))
+    try:
+        assert db.register_user("user@test.ru", "Passw0rd1", "user")[0]
+        add_sessions(db, "expired", 100, expired=True)
+        add_sessions(db, "revoked", 5, revoked=True)
+        add_sessions(db, "live", 3)
+
+        result = db.purge_sessions(batch_size=10, max_batches=4, vacuum_pages=0)
+
+        assert result["batches"] == 4
+        assert result["revoked_purged"] == 5
+        assert count_sessions(db, "is_valid = 0") == 0
+        # Остаток бюджета ушел на истекшие, хвост остался на следующий запуск
+        assert result["expired_purged"] == 30
+        assert count_sessions(db, "expires_at <= CURRENT_TIMESTAMP") == 70
+        assert count_sessions(db, "session_id LIKE 'live%'") == 3
+    finally:
+        db.close()
+
+
+def test_unknown_token_miss_is_cached_until_session_saved(tmp_path):
+    db = DatabaseManager(str(tmp_path))
+    try:
+        assert db.register_user("user@test.ru", "Passw0rd1", "user")[0]
+        token = db.generate_session_token()
+
+        assert db.validate_session(token) == (False, None)
+        assert db.validate_session(token) == (False, None)
+        # Повторный промах отвечен из кэша, без запроса к БД
+        assert db.statement_stats()["sessions.load"]["calls"] == 1
+
+        db.save_session("user@test.ru", token, "127.0.0.1")
+        assert db.validate_session(token) == (True, "user@test.ru")
+    finally:
+        db.close()
+
+
+def test_revoked_sessions_are_rejected_despite_cache(tmp_path):
+    db = DatabaseManager(str(tmp_path))
+    try:
+        assert db.register_user("user@test.ru", "Passw0rd1", "user")[0]
+        tokens = [db.generate_session_token() for _ in range(3)]
+        for token in tokens:
+            db.save_session("user@test.ru", token, "127.0.0.1")
+            assert db.validate_session(token) == (True, "user@test.ru")
+
+        assert db.revoke_session(tokens[0])
+        assert db.validate_session(tokens[0]) == (False, None)
+        assert db.validate_session(tokens[1]) == (True, "user@test.ru")
+
+        assert db.revoke_user_sessions("user@test.ru") == 2
+        assert [db.validate_session(token)[0] for token in tokens] == [False, False, False]
+    finally:
+        db.close()
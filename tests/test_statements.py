@@ -0,0 +1,24 @@
+"""Именованные запросы QUERIES"""
+import sqlite3
+
+import pytest
+
+import database_manager
+from database_manager import DatabaseManager
+
+
+def test_failed_select_is_counted_not_printed(tmp_path, monkeypatch, capsys):
+    monkeypatch.setitem(database_manager.QUERIES, "test.broken",
+                        ("users_quick.db", "SELECT json_extract(?, '$.a')"))
+    db = DatabaseManager(str(tmp_path))
+    try:
+        with pytest.raises(sqlite3.OperationalError):
+            db.query_one("test.broken", ("не JSON",))
+
+        assert capsys.readouterr().out == ""
+        assert db.statement_stats()["test.broken"]["errors"] == 1
+        # Соединение вернулось в пул без открытой транзакции
+        with db.connection("users_quick.db") as conn:
+            assert not conn.in_transaction
+    finally:
+        db.close()
@@ -0,0 +1,41 @@
+"""Поиск пользователей по префиксу"""
+from database_manager import DatabaseManager, UserDirectory
+
+ROWS = [
+    ("ivan@test.ru", "ivan", "Иван Петров"),
+    ("anna@test.ru", "anna", "Анна Петрова"),
+    ("petr@test.ru", "petr", "Пётр Сидоров"),
+    ("olga@test.ru", "olga", "Ольга  Ёлкина-Петрова"),
+]
+
+
+def emails(results):
+    return [user["email"] for user in results]
+
+
+def test_directory_finds_surname_inside_full_name():
+    directory = UserDirectory()
+    assert directory.load(ROWS, directory.generation)
+
+    # Сначала имена, начинающиеся с префикса, затем совпадения по фамилии
+    assert emails(directory.search("пет", ["full_name"])) == ["petr@test.ru", "ivan@test.ru", "anna@test.ru"]
+    assert emails(directory.search("елк", ["full_name"])) == ["olga@test.ru"]
+
+    directory.put("anna@test.ru", "anna", "Анна Смирнова")
+    assert emails(directory.search("петров", ["full_name"])) == ["ivan@test.ru"]
+    directory.remove("ivan@test.ru")
+    assert directory.search("петров", ["full_name"]) == []
+    assert emails(directory.search("смир")) == ["anna@test.ru"]
+
+
+def test_search_users_matches_words_with_and_without_directory(tmp_path):
+    for user_directory in (True, False):
+        db = DatabaseManager(str(tmp_path / str(user_directory)), user_directory=user_directory)
+        try:
+            for email, nickname, full_name in ROWS:
+                assert db.register_user(email, "Passw0rd1", nickname, full_name)[0]
+            assert emails(db.search_users("пет", ["full_name"])) == [
+                "petr@test.ru", "ivan@test.ru", "anna@test.ru"]
+            assert emails(db.search_users("сидор")) == ["petr@test.ru"]
+        finally:
+            db.close()